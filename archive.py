@@ -0,0 +1,119 @@
+"""
+Tiered archival of finished raw material units and closed warnings.
+
+The hot tables only need rows that can still change or are looked at daily.
+archive() moves
+
+- raw material units in Consumed or Scrapped received more than
+  ARCHIVE_MATERIAL_DAYS ago, and
+- Closed warnings triggered more than ARCHIVE_WARNING_DAYS ago
+
+into rawmaterialtracerecord_archive / qualityriskwarning_archive, at most
+ARCHIVE_BATCH_SIZE rows per transaction so online writers only wait for one
+short batch. Each batch deletes from the hot table with RETURNING (repeating
+the status and age conditions) and inserts exactly the returned rows, so a
+row is in one tier at any time. A unit's consumption ledger rows are deleted
+in the same transaction and folded into the archived usedrecords, which is
+the list the API shows for the unit anyway.
+
+Both states are terminal (nothing reopens a warning or revives a consumed
+unit), so archived rows never change. get-by-id and trace fall back to the
+archive tables; lists and search cover the hot tables only. The KPI tables
+count both tiers, so moving rows leaves them unchanged and kpi.rebuild()
+reads both.
+
+Run from cron / Task Scheduler, or POST /archive/run:
+
+    python manage.py archive [--material-days 180] [--warning-days 90]
+"""
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from models import (MaterialConsumptionRecord, QualityRiskWarning, QualityRiskWarningArchive, RawMaterialTraceArchive,
+                    RawMaterialTraceRecord)
+from traceability import consumption_entry
+
+ARCHIVE_MATERIAL_DAYS = int(os.getenv("ARCHIVE_MATERIAL_DAYS", "180"))
+ARCHIVE_WARNING_DAYS = int(os.getenv("ARCHIVE_WARNING_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "2000"))
+FINISHED_STATUSES = ("Consumed", "Scrapped")
+
+
+def _archive_materials_batch(db: Session, cutoff: datetime, batch_size: int) -> Tuple[int, bool]:
+    material, ledger = RawMaterialTraceRecord.__table__, MaterialConsumptionRecord.__table__
+    eligible = (material.c.tracestatus.in_(FINISHED_STATUSES), material.c.receivetime < cutoff)
+    # Served by ix_rawmaterial_status_receivetime
+    keys = db.execute(select(material.c.traceid).where(*eligible).limit(batch_size)).scalars().all()
+    if not keys:
+        return 0, False
+    batch = (material.c.traceid.in_(keys), *eligible)
+    # Ledger rows first: they reference the unit by foreign key
+    entries = defaultdict(list)
+    ledger_rows = db.execute(
+        delete(ledger).where(ledger.c.tracecode.in_(select(material.c.tracecode).where(*batch))).returning(*ledger.c)
+    ).all()
+    for row in sorted(ledger_rows, key=lambda r: r.consumptionid):
+        entries[row.tracecode].append(consumption_entry(row))
+    rows = db.execute(delete(material).where(*batch).returning(*material.c)).mappings().all()
+    if rows:
+        now = datetime.now(timezone.utc)
+        db.execute(insert(RawMaterialTraceArchive), [
+            {**row, "usedrecords": list(row["usedrecords"] or []) + entries[row["tracecode"]], "archivedtime": now}
+            for row in rows
+        ])
+    db.commit()
+    # (rows moved, keys found): a batch whose rows all left the eligible set concurrently
+    # moved nothing but is not the end of the table
+    return len(rows), True
+
+
+def _archive_warnings_batch(db: Session, cutoff: datetime, batch_size: int) -> Tuple[int, bool]:
+    warning = QualityRiskWarning.__table__
+    eligible = (warning.c.handlestatus == "Closed", warning.c.triggertime < cutoff)
+    # Served by ix_warning_handlestatus_triggertime
+    keys = db.execute(select(warning.c.warningid).where(*eligible).limit(batch_size)).scalars().all()
+    if not keys:
+        return 0, False
+    rows = db.execute(delete(warning).where(warning.c.warningid.in_(keys), *eligible).returning(*warning.c)).mappings().all()
+    if rows:
+        now = datetime.now(timezone.utc)
+        db.execute(insert(QualityRiskWarningArchive), [{**row, "archivedtime": now} for row in rows])
+    db.commit()
+    return len(rows), True
+
+
+def archive(session_factory, material_days: int = ARCHIVE_MATERIAL_DAYS, warning_days: int = ARCHIVE_WARNING_DAYS,
+            batch_size: int = ARCHIVE_BATCH_SIZE, max_batches: Optional[int] = None, pause: float = 0.0) -> dict:
+    """Move eligible rows to the archive tables; return counts and timings.
+
+    `max_batches` bounds one run (per table); `pause` sleeps between batches
+    to leave the database to online traffic during a large first run.
+    """
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    report = {}
+    for name, step, cutoff in (
+        ("raw_materials", _archive_materials_batch, now - timedelta(days=material_days)),
+        ("warnings", _archive_warnings_batch, now - timedelta(days=warning_days)),
+    ):
+        table_started = time.perf_counter()
+        moved = batches = 0
+        with session_factory() as db:
+            while max_batches is None or batches < max_batches:
+                count, progressed = step(db, cutoff.replace(tzinfo=None), batch_size)
+                if not progressed:
+                    break
+                moved += count
+                batches += 1
+                if pause:
+                    time.sleep(pause)
+        report[name] = {"archived": moved, "batches": batches, "cutoff": cutoff.isoformat(),
+                        "seconds": round(time.perf_counter() - table_started, 3)}
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
@@ -0,0 +1,184 @@
+"""
+Attachment transfer: streaming multipart upload into the object store and
+single-range downloads.
+
+receive_upload() pushes the request body into python-multipart's parser as
+it arrives from the socket. Bytes of the `file` part are handed to an
+ObjectWriter (hashed and written on a worker thread) in batches of at most
+ATTACHMENT_FLUSH_BYTES, so memory holds one batch regardless of the file's
+size, and the body is not first spooled to a temporary file the way
+UploadFile would. Other form fields are skipped without being buffered.
+
+parse_range() understands one `bytes=` range (the form PDF viewers and
+download managers send); anything else is answered with the whole object.
+"""
+import os
+from typing import List, NamedTuple, Optional, Tuple
+from urllib.parse import quote
+
+from starlette.concurrency import run_in_threadpool
+
+from object_store import ObjectStore, ObjectTooLarge, StoredObject
+
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(200 * 1024 * 1024)))
+ATTACHMENT_FLUSH_BYTES = 256 * 1024
+MAX_PART_HEADER_BYTES = 16 * 1024
+FILE_FIELD = "file"
+
+
+class AttachmentError(ValueError):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class Upload(NamedTuple):
+    filename: str
+    contenttype: str
+    object: StoredObject
+
+
+def _filename(raw: Optional[bytes]) -> str:
+    # Browsers on Windows may send the full client path; keep the last component only
+    name = (raw or b"").decode("utf-8", "replace").replace("\\", "/").rsplit("/", 1)[-1].strip()
+    return name[:255] or "upload.bin"
+
+
+async def receive_upload(request, store: ObjectStore, max_bytes: int = ATTACHMENT_MAX_BYTES) -> Upload:
+    """Stream the `file` part of a multipart/form-data request into `store`."""
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise AttachmentError(415, "Expected multipart/form-data with a boundary")
+
+    # Parser callbacks only record what they saw; the async loop below acts on it
+    events: List[tuple] = []
+    header = {"field": b"", "value": b""}
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+        if len(header["value"]) > MAX_PART_HEADER_BYTES:
+            raise AttachmentError(400, "Multipart part header too large")
+
+    def on_header_end():
+        events.append(("header", header["field"].lower(), header["value"]))
+        header["field"] = header["value"] = b""
+
+    callbacks = {
+        "on_part_begin": lambda: events.append(("begin",)),
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": lambda: events.append(("headers",)),
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end",)),
+    }
+    parser = MultipartParser(params[b"boundary"], callbacks)
+
+    writer = None
+    in_file = False
+    filename = contenttype = None
+    headers: dict = {}
+    pending: List[bytes] = []
+    pending_bytes = 0
+
+    async def flush():
+        nonlocal pending_bytes
+        if pending:
+            data = b"".join(pending)
+            pending.clear()
+            pending_bytes = 0
+            await run_in_threadpool(writer.write, data)
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for event in events:
+                kind = event[0]
+                if kind == "begin":
+                    headers = {}
+                elif kind == "header":
+                    headers[event[1]] = event[2]
+                elif kind == "headers":
+                    _, options = parse_options_header(headers.get(b"content-disposition", b""))
+                    in_file = options.get(b"name") == FILE_FIELD.encode()
+                    if in_file:
+                        if writer is not None:
+                            raise AttachmentError(400, "Only one file per request")
+                        filename = _filename(options.get(b"filename"))
+                        contenttype = headers.get(b"content-type", b"application/octet-stream").decode("latin-1")[:100]
+                        writer = await run_in_threadpool(store.writer, max_bytes)
+                elif kind == "data" and in_file:
+                    pending.append(event[1])
+                    pending_bytes += len(event[1])
+                elif kind == "end" and in_file:
+                    in_file = False
+                    await flush()
+            events.clear()
+            if pending_bytes >= ATTACHMENT_FLUSH_BYTES:
+                await flush()
+        parser.finalize()
+        if writer is None:
+            raise AttachmentError(400, f"Multipart field '{FILE_FIELD}' is required")
+        await flush()
+        stored = await run_in_threadpool(writer.commit)
+    except ObjectTooLarge:
+        await run_in_threadpool(writer.abort)
+        raise AttachmentError(413, f"File exceeds {max_bytes} bytes")
+    except MultipartParseError as exc:
+        if writer is not None:
+            await run_in_threadpool(writer.abort)
+        raise AttachmentError(400, f"Malformed multipart body: {exc}")
+    except BaseException:
+        # Includes client disconnects mid-upload: drop the partial temporary file
+        if writer is not None:
+            await run_in_threadpool(writer.abort)
+        raise
+    return Upload(filename, contenttype, stored)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive for a single `bytes=` range, or None to send the whole object.
+
+    Raises RangeNotSatisfiable when the range starts past the end of the object.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - suffix), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def content_disposition(filename: str, disposition: str = "attachment") -> str:
+    # ASCII fallback plus the RFC 5987 form for non-ASCII names (e.g. Chinese report titles)
+    fallback = filename.encode("ascii", "replace").decode("ascii").replace('"', "'")
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
@@ -0,0 +1,1129 @@
+"""
+Benchmarks for the traceability API.
+
+Each scenario builds its data in a throwaway SQLite database in a temporary
+directory, so running a benchmark never touches ./app.db.
+
+Usage:
+    python benchmark.py trace --edges 1000000
+    python benchmark.py auth --requests 5000
+    python benchmark.py login-storm --users 500 --concurrency 200 [--stored-rounds 20000]
+    python benchmark.py db-concurrency --writers 4 --readers 8 [--postgres-url URL]
+    python benchmark.py read-load --rows 20000 --concurrency 64
+    python benchmark.py export --rows 1000000 --rss-ceiling-mb 64
+    python benchmark.py serialization --scale 10k --page-sizes 100,1000
+    python benchmark.py rules --measurements 500000
+    python benchmark.py graph-sync --relations 100000
+    python benchmark.py suite --scale 100k --output results.json [--baseline baseline.json]
+    python benchmark.py cold-start --runs 5 [--exe dist/main.exe]
+    python benchmark.py workers --workers 1,2,4,8 --duration 10
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from models import Base
+
+TIMESTAMP = "2024-01-01 00:00:00.000000"
+
+
+def summarize(samples: list, elapsed: float = None) -> dict:
+    """Latency summary in milliseconds (and throughput when `elapsed` is given)."""
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 3)
+
+    summary = {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+    if elapsed:
+        summary["throughput_per_s"] = round(len(ordered) / elapsed, 1)
+    return summary
+
+
+def temp_engine(workdir: str, name: str = "bench.db"):
+    # Imported lazily: db_clients reads SQLALCHEMY_DATABASE_URL at import time (see load_app)
+    from db_clients import create_sqlalchemy_engine
+
+    engine = create_sqlalchemy_engine(f"sqlite:///{os.path.join(workdir, name)}")
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+# In-process ASGI driver (no network, no extra client dependency)
+
+async def asgi_request(app, method: str, path: str, headers: dict = None, body: bytes = b"", query: str = "", on_body=None):
+    """Send one request straight into the ASGI app; return (status, headers, body).
+
+    With `on_body`, response chunks are passed to the callback instead of
+    being collected, and the returned body is empty.
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000),
+    }
+    done = asyncio.Event()
+    delivered = False
+    response = {"status": None, "headers": {}, "body": []}
+
+    async def receive():
+        nonlocal delivered
+        if not delivered:
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {k.decode().lower(): v.decode() for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            if on_body is not None:
+                on_body(message.get("body", b""))
+            else:
+                response["body"].append(message.get("body", b""))
+            if not message.get("more_body"):
+                done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return response["status"], response["headers"], b"".join(response["body"])
+
+
+async def run_load(app, make_request, total: int, concurrency: int) -> tuple:
+    """Issue `total` requests from `concurrency` tasks; return (latencies, elapsed, errors)."""
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, path, headers, body, query = make_request(i)
+            t0 = time.perf_counter()
+            status, _, _ = await asgi_request(app, method, path, headers, body, query)
+            latencies.append(time.perf_counter() - t0)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start, errors
+
+
+def load_app(workdir: str):
+    """Import main against a throwaway database in `workdir`."""
+    os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'app.db')}"
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    import main
+
+    assert main.SQLALCHEMY_DATABASE_URL == os.environ["SQLALCHEMY_DATABASE_URL"], "load_app must run before db_clients is imported"
+    # Requests are sent straight to the ASGI app, so the lifespan hook never runs
+    main.initialize()
+    return main
+
+
+# Synthetic genealogy
+
+def seed_genealogy(engine, edges: int, levels: int = 3, fanout: int = 10) -> dict:
+    """Insert raw materials plus `levels` product tiers, each node feeding `fanout` children.
+
+    Returns the raw material codes (forward trace roots) and last-tier codes
+    (backward trace roots).
+    """
+    per_root = sum(fanout ** k for k in range(1, levels + 1))
+    roots = max(1, edges // per_root)
+    raw_codes = [f"R{i:08d}" for i in range(roots)]
+    raw_rows = [
+        (f"TR{i:08d}", f"MB{i % 5000:05d}", code, f"SUP{i % 200:03d}", "PO", "IQC", TIMESTAMP, "WH-A", "[]", 100, "In Stock")
+        for i, code in enumerate(raw_codes)
+    ]
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO rawmaterialtracerecord (traceid, materialbatchno, tracecode, supplierid, purchaseorderid, "
+            "incominginspectionid, receivetime, storagelocation, usedrecords, remainingqty, tracestatus) "
+            "VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+            raw_rows,
+        )
+        parents = raw_codes
+        count = 0
+        for level in range(1, levels + 1):
+            children = []
+            rows = []
+            for i, parent in enumerate(parents):
+                for j in range(fanout):
+                    code = f"L{level}-{i * fanout + j:09d}"
+                    children.append(code)
+                    rows.append((f"REL{count:010d}", f"PB{level}", code, parent, "EQ-1", "PS-1", "INSP-1", TIMESTAMP, f"stage-{level}", "Valid"))
+                    count += 1
+            conn.exec_driver_sql(
+                "INSERT INTO batchtracerelation (relationid, productbatchno, producttracecode, materialtracecode, equipmentid, "
+                "processschemeid, inspectionpersonid, inspectiontime, relationstage, relationstatus) "
+                "VALUES (?,?,?,?,?,?,?,?,?,?)",
+                rows,
+            )
+            parents = children
+    return {"raw_codes": raw_codes, "leaf_codes": parents, "edges": count}
+
+
+def bench_trace(args) -> dict:
+    import traceability
+
+    with tempfile.TemporaryDirectory() as workdir:
+        engine = temp_engine(workdir)
+        start = time.perf_counter()
+        data = seed_genealogy(engine, args.edges, levels=args.levels, fanout=args.fanout)
+        seed_seconds = time.perf_counter() - start
+        rng = random.Random(42)
+        results = {"edges": data["edges"], "seed_seconds": round(seed_seconds, 2)}
+        for direction, pool in (("backward", data["leaf_codes"]), ("forward", data["raw_codes"])):
+            samples = []
+            nodes = 0
+            with Session(engine) as db:
+                for _ in range(args.iterations):
+                    code = rng.choice(pool)
+                    t0 = time.perf_counter()
+                    result = traceability.trace(db, code, direction)
+                    samples.append(time.perf_counter() - t0)
+                    nodes = len(result["tracecodes"])
+                    db.expunge_all()
+            results[direction] = {**summarize(samples), "nodes_per_trace": nodes}
+        engine.dispose()
+    return results
+
+
+def bench_auth(args) -> dict:
+    """Authenticated GET /me throughput with and without the token cache."""
+    with tempfile.TemporaryDirectory() as workdir:
+        main = load_app(workdir)
+        with main.SessionLocal() as db:
+            db.add(main.User(username="bench", hashed_password=main.get_password_hash("bench"), role="user"))
+            db.commit()
+        token = main.create_access_token({"sub": "bench"})
+        headers = {"Authorization": f"Bearer {token}"}
+
+        def make_request(i):
+            return "GET", "/me", headers, b"", ""
+
+        results = {}
+        default_ttl = main.token_cache.ttl
+        for label, ttl in (("without_cache", 0), ("with_cache", default_ttl or 60)):
+            main.token_cache.ttl = ttl
+            main.token_cache.clear()
+            latencies, elapsed, errors = asyncio.run(run_load(main.app, make_request, args.requests, args.concurrency))
+            results[label] = {**summarize(latencies, elapsed), "errors": errors}
+        results["cache_stats"] = main.token_cache.stats()
+        main.token_cache.ttl = default_ttl
+    return results
+
+
+def bench_login_storm(args) -> dict:
+    """Many operators logging in at once, with a cheap probe request running alongside."""
+    from urllib.parse import urlencode
+
+    with tempfile.TemporaryDirectory() as workdir:
+        main = load_app(workdir)
+        from password_hashing import make_context
+
+        # One hash shared by every user keeps seeding fast; --stored-rounds exercises rehash-on-login
+        stored = make_context(args.stored_rounds or main.password_hasher.rounds).hash("shift-change")
+        with main.SessionLocal() as db:
+            db.add_all([main.User(username=f"op{i:05d}", hashed_password=stored, role="user") for i in range(args.users)])
+            db.commit()
+
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+        def make_request(i):
+            body = urlencode({"username": f"op{i % args.users:05d}", "password": "shift-change"}).encode()
+            return "POST", "/auth/login", headers, body, ""
+
+        async def run_all() -> dict:
+            probe_latencies = []
+            storm_done = asyncio.Event()
+
+            async def probe():
+                # Event-loop responsiveness while hashing is in progress
+                while not storm_done.is_set():
+                    t0 = time.perf_counter()
+                    await asgi_request(main.app, "GET", "/")
+                    probe_latencies.append(time.perf_counter() - t0)
+                    await asyncio.sleep(0.01)
+
+            async def storm():
+                try:
+                    return await run_load(main.app, make_request, args.users, args.concurrency)
+                finally:
+                    storm_done.set()
+
+            (latencies, elapsed, errors), _ = await asyncio.gather(storm(), probe())
+            await main.async_engine.dispose()
+            storm_summary = summarize(latencies, elapsed)
+            return {
+                "logins": {**storm_summary, "logins_per_s": storm_summary["throughput_per_s"], "errors": errors},
+                "probe_during_storm": summarize(probe_latencies) if probe_latencies else None,
+                "hasher": main.password_hasher.stats(),
+            }
+
+        result = asyncio.run(run_all())
+        main.password_hasher.shutdown()
+    return result
+
+
+def mixed_workload(engine, writers: int, readers: int, duration: float) -> dict:
+    """Run create-handler-shaped writers against keyset-page readers for `duration` seconds."""
+    from models import RawMaterialTraceRecord
+    from datetime import datetime, timezone
+
+    stop = threading.Event()
+    samples = {"write": [], "read": []}
+    errors = {"write": 0, "read": 0}
+    lock = threading.Lock()
+
+    def writer(n: int):
+        i = 0
+        while not stop.is_set():
+            traceid = f"BW{n}-{i}"
+            i += 1
+            t0 = time.perf_counter()
+            try:
+                with Session(engine) as db:
+                    if db.query(RawMaterialTraceRecord).filter(RawMaterialTraceRecord.traceid == traceid).first() is None:
+                        db.add(RawMaterialTraceRecord(
+                            traceid=traceid, materialbatchno="MB", tracecode=f"BWC{n}-{i}", supplierid=f"SUP{i % 20}",
+                            purchaseorderid="PO", incominginspectionid="IQC", receivetime=datetime.now(timezone.utc),
+                            storagelocation="WH", usedrecords=[], remainingqty=1, tracestatus="In Stock",
+                        ))
+                        db.commit()
+                kind = "write"
+            except OperationalError:
+                kind = None
+                with lock:
+                    errors["write"] += 1
+            if kind:
+                with lock:
+                    samples[kind].append(time.perf_counter() - t0)
+
+    def reader(n: int):
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                with Session(engine) as db:
+                    (db.query(RawMaterialTraceRecord)
+                     .filter(RawMaterialTraceRecord.supplierid == f"SUP{n % 20}")
+                     .order_by(RawMaterialTraceRecord.receivetime.desc(), RawMaterialTraceRecord.traceid.desc())
+                     .limit(100).all())
+                with lock:
+                    samples["read"].append(time.perf_counter() - t0)
+            except OperationalError:
+                with lock:
+                    errors["read"] += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    result = {}
+    for kind in ("write", "read"):
+        result[kind] = {**(summarize(samples[kind], elapsed) if samples[kind] else {"count": 0}), "errors": errors[kind]}
+    return result
+
+
+def bench_db_concurrency(args) -> dict:
+    """N writers plus M readers on SQLite with default vs tuned settings (and PostgreSQL if given)."""
+    from db_clients import create_sqlalchemy_engine
+
+    modes = {
+        "sqlite_default": lambda url: create_engine(url, connect_args={"check_same_thread": False}),
+        "sqlite_tuned": create_sqlalchemy_engine,
+    }
+    results = {}
+    for mode, factory in modes.items():
+        with tempfile.TemporaryDirectory() as workdir:
+            engine = factory(f"sqlite:///{os.path.join(workdir, 'concurrency.db')}")
+            Base.metadata.create_all(bind=engine)
+            results[mode] = mixed_workload(engine, args.writers, args.readers, args.duration)
+            engine.dispose()
+    if args.postgres_url:
+        # Use a scratch database: tables are created and the benchmark rows are removed afterwards
+        from models import RawMaterialTraceRecord
+
+        engine = create_sqlalchemy_engine(args.postgres_url)
+        Base.metadata.create_all(bind=engine)
+        try:
+            results["postgresql_pooled"] = mixed_workload(engine, args.writers, args.readers, args.duration)
+        finally:
+            with Session(engine) as db:
+                db.query(RawMaterialTraceRecord).filter(RawMaterialTraceRecord.traceid.like("BW%")).delete(synchronize_session=False)
+                db.commit()
+            engine.dispose()
+    return results
+
+
+def raw_traceid(i: int) -> str:
+    return f"T{i:09d}"
+
+
+def seed_raw_materials(engine, rows: int, batch: int = 50000) -> int:
+    """Insert `rows` raw material records spread over 200 suppliers, `batch` rows per transaction.
+
+    Record i gets traceid raw_traceid(i); rows are generated per batch so
+    seeding millions of records keeps memory flat.
+    """
+    for start in range(0, rows, batch):
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT INTO rawmaterialtracerecord (traceid, materialbatchno, tracecode, supplierid, purchaseorderid, "
+                "incominginspectionid, receivetime, storagelocation, usedrecords, remainingqty, tracestatus) "
+                "VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                [
+                    (raw_traceid(i), f"MB{i % 5000:05d}", f"C{i:09d}", f"SUP{i % 200:03d}", "PO", "IQC",
+                     f"2024-01-{1 + i % 28:02d} {i % 24:02d}:00:00.{i % 1000000:06d}", "WH-A", "[]", 100, "In Stock")
+                    for i in range(start, min(rows, start + batch))
+                ],
+            )
+    return rows
+
+
+def bench_read_load(args) -> dict:
+    """Async read endpoints vs the same queries as sync handlers on the threadpool."""
+    from typing import List
+    from fastapi import Depends, FastAPI
+
+    with tempfile.TemporaryDirectory() as workdir:
+        main = load_app(workdir)
+        seed_raw_materials(main.engine, args.rows)
+
+        sync_app = FastAPI()
+
+        @sync_app.get("/raw-material-trace/{traceid}", response_model=main.RawMaterialTraceRead)
+        def get_sync(traceid: str, db=Depends(main.get_db)):
+            return db.get(main.RawMaterialTraceRecord, traceid)
+
+        @sync_app.get("/raw-material-trace", response_model=List[main.RawMaterialTraceRead])
+        def list_sync(supplierid: str, limit: int = 50, db=Depends(main.get_db)):
+            model = main.RawMaterialTraceRecord
+            return (db.query(model).filter(model.supplierid == supplierid)
+                    .order_by(model.receivetime.desc(), model.traceid.desc()).limit(limit).all())
+
+        rng = random.Random(7)
+        requests = {
+            "get_by_id": lambda i: ("GET", f"/raw-material-trace/{raw_traceid(rng.randrange(args.rows))}", {}, b"", ""),
+            "list_page": lambda i: ("GET", "/raw-material-trace", {}, b"", f"supplierid=SUP{i % 200:03d}&limit=50"),
+        }
+        async def run_all() -> dict:
+            # One event loop for every run: the async pool is bound to the loop it was first used on
+            results = {}
+            for name, make_request in requests.items():
+                for label, app in (("sync", sync_app), ("async", main.app)):
+                    latencies, elapsed, errors = await run_load(app, make_request, args.requests, args.concurrency)
+                    results[f"{name}_{label}"] = {**summarize(latencies, elapsed), "errors": errors}
+            await main.async_engine.dispose()
+            return results
+
+        return asyncio.run(run_all())
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process (Linux /proc; falls back to peak RSS elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_export(args) -> dict:
+    """Stream a full-table export and check RSS growth stays under a fixed ceiling."""
+    with tempfile.TemporaryDirectory() as workdir:
+        main = load_app(workdir)
+        seed_raw_materials(main.engine, args.rows)
+        gc.collect()
+        results = {"rows": args.rows, "rss_ceiling_mb": args.rss_ceiling_mb, "passed": True}
+        for fmt, gzip in (("ndjson", False), ("csv", True)):
+            baseline = current_rss_mb()
+            peak = baseline
+            received = 0
+            stop = threading.Event()
+
+            def sample():
+                nonlocal peak
+                while not stop.wait(0.05):
+                    peak = max(peak, current_rss_mb())
+
+            def on_body(chunk: bytes):
+                nonlocal received
+                received += len(chunk)
+
+            sampler = threading.Thread(target=sample)
+            sampler.start()
+            t0 = time.perf_counter()
+            status, _, _ = asyncio.run(asgi_request(
+                main.app, "GET", "/raw-material-trace/export", query=f"format={fmt}&gzip={str(gzip).lower()}", on_body=on_body,
+            ))
+            elapsed = time.perf_counter() - t0
+            stop.set()
+            sampler.join()
+            peak = max(peak, current_rss_mb())
+            growth = peak - baseline
+            results[f"{fmt}{'_gzip' if gzip else ''}"] = {
+                "status": status,
+                "seconds": round(elapsed, 2),
+                "rows_per_s": round(args.rows / elapsed, 1),
+                "bytes": received,
+                "baseline_rss_mb": round(baseline, 1),
+                "peak_rss_mb": round(peak, 1),
+                "rss_growth_mb": round(growth, 1),
+            }
+            if status != 200 or growth > args.rss_ceiling_mb:
+                results["passed"] = False
+    return results
+
+
+def bench_serialization(args) -> dict:
+    """Large read payloads: ORM objects + Pydantic (before) vs row tuples + serialization.py (after), then per-encoding sizes.
+
+    The pipeline part times query plus encoding of one page per table both
+    ways and checks the bodies are byte-identical. The endpoint part drives
+    list and trace endpoints through the app with Accept-Encoding identity,
+    gzip and (with brotli installed) br.
+    """
+    from typing import List
+
+    from pydantic import TypeAdapter
+    from sqlalchemy import select
+
+    import datagen
+    import serialization
+    from compression import CompressionMiddleware
+
+    with tempfile.TemporaryDirectory() as workdir:
+        main = load_app(workdir)
+        dataset = datagen.generate(main.engine, datagen.SCALES[args.scale], seed=args.seed)
+        samples = dataset["samples"]
+        page_sizes = [int(n) for n in args.page_sizes.split(",")]
+        pipelines = {}
+        with Session(main.engine) as db:
+            for name, model, schema in (
+                ("raw_materials", main.RawMaterialTraceRecord, main.RawMaterialTraceRead),
+                ("relations", main.BatchTraceRelation, main.BatchTraceRelationRead),
+                ("warnings", main.QualityRiskWarning, main.QualityRiskWarningRead),
+            ):
+                adapter = TypeAdapter(List[schema])
+                key = list(model.__table__.primary_key.columns)
+                for size in page_sizes:
+                    def before():
+                        records = db.scalars(select(model).order_by(*key).limit(size)).all()
+                        body = adapter.dump_json(adapter.validate_python(records, from_attributes=True))
+                        db.expunge_all()
+                        return body
+
+                    def after():
+                        rows = db.execute(select(*serialization.columns(model, schema)).order_by(*key).limit(size)).all()
+                        return serialization.encode_list(schema, rows)
+
+                    timings = {}
+                    for label, run in (("before", before), ("after", after)):
+                        run()
+                        times = []
+                        for _ in range(args.iterations):
+                            t0 = time.perf_counter()
+                            run()
+                            times.append(time.perf_counter() - t0)
+                        timings[label] = statistics.median(times)
+                    body = after()
+                    pipelines[f"{name}_{size}"] = {
+                        "rows": len(json.loads(body)),
+                        "bytes": len(body),
+                        "before_ms": round(timings["before"] * 1000, 3),
+                        "after_ms": round(timings["after"] * 1000, 3),
+                        "speedup": round(timings["before"] / timings["after"], 2),
+                        "identical": before() == body,
+                    }
+
+        rng = random.Random(args.seed)
+        endpoints = {
+            "list_raw_materials": lambda: ("/raw-material-trace", f"limit={max(page_sizes)}"),
+            "list_relations": lambda: ("/batch-trace-relations", f"limit={max(page_sizes)}"),
+            "search_warnings": lambda: ("/quality-risk-warnings/search", "page_size=200"),
+            "trace_forward": lambda: (f"/trace/forward/{rng.choice(samples['raw_codes'])}", ""),
+        }
+        encodings = ["identity", "gzip"] + (["br"] if "br" in CompressionMiddleware(None).encodings() else [])
+
+        async def run_all() -> dict:
+            results = {}
+            for name, target in endpoints.items():
+                for encoding in encodings:
+                    headers = {"Accept-Encoding": encoding}
+
+                    def make_request(i):
+                        path, query = target()
+                        return "GET", path, headers, b"", query
+
+                    path, query = target()
+                    _, response_headers, body = await asgi_request(main.app, "GET", path, headers, query=query)
+                    await run_load(main.app, make_request, args.warmup, args.concurrency)
+                    latencies, elapsed, errors = await run_load(main.app, make_request, args.requests, args.concurrency)
+                    results[f"{name}_{encoding}"] = {
+                        **summarize(latencies, elapsed), "errors": errors,
+                        "content_encoding": response_headers.get("content-encoding", "identity"), "bytes": len(body),
+                    }
+            await main.async_engine.dispose()
+            return results
+
+        endpoint_results = asyncio.run(run_all())
+        main.password_hasher.shutdown()
+    passed = all(p["identical"] for p in pipelines.values()) and not any(r["errors"] for r in endpoint_results.values())
+    return {"scale": args.scale, "pipelines": pipelines, "endpoints": endpoint_results, "passed": passed}
+
+
+def bench_rules(args) -> dict:
+    """Quality rule evaluation and warning write-out throughput in measurements per second."""
+    from quality_rules import DEFAULT_RULES, QualityRuleEngine
+
+    rng = random.Random(11)
+    rules = [r for r in DEFAULT_RULES if "lower" in r and "upper" in r]
+    measurements = []
+    for i in range(args.measurements):
+        rule = rules[i % len(rules)]
+        low, high = rule["lower"], rule["upper"]
+        value = rng.uniform(low, high)
+        if rng.random() < args.violation_rate:
+            value = high * rng.uniform(1.01, 1.5)
+        measurements.append({
+            "objectid": f"T{i % args.objects:09d}", "warningobject": "Raw Material", "materialtype": rule["materialtype"],
+            "parameter": rule["parameter"], "value": value, "inspectionid": f"IQC{i}", "measuredtime": None,
+        })
+    engine = QualityRuleEngine(DEFAULT_RULES)
+    t0 = time.perf_counter()
+    evaluated = engine.evaluate(measurements)
+    evaluate_seconds = time.perf_counter() - t0
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_engine = temp_engine(workdir)
+        samples = []
+        created = 0
+        start = time.perf_counter()
+        with Session(db_engine) as db:
+            for offset in range(0, len(measurements), args.batch):
+                t0 = time.perf_counter()
+                created += engine.raise_warnings(db, measurements[offset:offset + args.batch])["warnings_created"]
+                samples.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - start
+        db_engine.dispose()
+    return {
+        "measurements": args.measurements,
+        "violations": len(evaluated["findings"]),
+        "evaluate_only_per_s": round(args.measurements / evaluate_seconds, 1),
+        "end_to_end_per_s": round(args.measurements / elapsed, 1),
+        "warnings_created": created,
+        "batch": {**summarize(samples), "size": args.batch},
+    }
+
+
+def bench_graph_sync(args) -> dict:
+    """Outbox write cost on the relation path and drain throughput into the in-memory graph."""
+    from sqlalchemy.orm import sessionmaker
+    import graph_sync
+
+    relations = [
+        {"relationid": f"R{i:09d}", "productbatchno": "PB", "producttracecode": f"P{i:09d}",
+         "materialtracecode": f"M{i % 1000:06d}", "equipmentid": "EQ", "processschemeid": "PS",
+         "inspectionpersonid": "QC", "inspectiontime": TIMESTAMP, "relationstage": "Processing",
+         "relationstatus": "Valid"}
+        for i in range(args.relations)
+    ]
+    with tempfile.TemporaryDirectory() as workdir:
+        db_engine = temp_engine(workdir)
+        session_factory = sessionmaker(bind=db_engine)
+        t0 = time.perf_counter()
+        with session_factory() as db:
+            for offset in range(0, len(relations), args.batch):
+                graph_sync.enqueue(db, "upsert", relations[offset:offset + args.batch])
+                db.commit()
+        enqueue_seconds = time.perf_counter() - t0
+
+        sink = graph_sync.InMemoryGraphSink()
+        worker = graph_sync.GraphSyncWorker(session_factory, sink, batch_size=args.batch)
+        lag_before = worker.status()["lag_seconds"]
+        t0 = time.perf_counter()
+        synced = worker.drain()
+        drain_seconds = time.perf_counter() - t0
+        status = worker.status()
+        db_engine.dispose()
+    return {
+        "relations": args.relations,
+        "enqueue_per_s": round(args.relations / enqueue_seconds, 1),
+        "drain_per_s": round(synced / drain_seconds, 1),
+        "lag_seconds_before_drain": lag_before,
+        "edges_in_graph": len(sink.edges),
+        "pending_after": status["pending"],
+        "batches": status["batches"],
+    }
+
+
+# Cold start: process spawn -> first served request
+
+def _free_port() -> int:
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _server_env(workdir: str, port: int) -> dict:
+    return {**os.environ, "HOST": "127.0.0.1", "PORT": str(port),
+            "SQLALCHEMY_DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'app.db')}",
+            "TIMESERIES_PATH": os.path.join(workdir, "timeseries.db")}
+
+
+def _wait_serving(proc, port: int, started: float, timeout: float) -> float:
+    """Poll GET / until it answers 200; return seconds since `started`."""
+    import urllib.request
+
+    while time.perf_counter() - started < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{proc.args[0]} exited with {proc.returncode} before serving")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as resp:
+                if resp.status == 200:
+                    return time.perf_counter() - started
+        except OSError:
+            time.sleep(0.005)
+    raise TimeoutError(f"no response within {timeout}s")
+
+
+def _stop_server(proc) -> None:
+    import subprocess
+
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def time_to_first_request(command: list, cwd: str, workdir: str, timeout: float = 120.0) -> float:
+    """Seconds from spawning `command` (a server honouring HOST/PORT) until GET / answers 200."""
+    import subprocess
+
+    port = _free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=cwd, env=_server_env(workdir, port), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        return _wait_serving(proc, port, started, timeout)
+    finally:
+        _stop_server(proc)
+
+
+def measure_cold_start(command: list, cwd: str, runs: int) -> dict:
+    """First start on an empty database (migrate + admin seed), then `runs` restarts against it."""
+    with tempfile.TemporaryDirectory() as workdir:
+        first = time_to_first_request(command, cwd, workdir)
+        restarts = [time_to_first_request(command, cwd, workdir) for _ in range(runs)]
+    return {
+        "start_ms": round(statistics.median(restarts) * 1000, 1),
+        "start_min_ms": round(min(restarts) * 1000, 1),
+        "first_start_ms": round(first * 1000, 1),
+        "runs": runs,
+    }
+
+
+def measure_import(runs: int) -> float:
+    """Median milliseconds to `import main` in a fresh interpreter (no database work happens on import)."""
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    samples = []
+    with tempfile.TemporaryDirectory() as workdir:
+        env = {**os.environ, "SQLALCHEMY_DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'app.db')}",
+               "TIMESERIES_PATH": os.path.join(workdir, "timeseries.db")}
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", code], cwd=here, env=env, capture_output=True, text=True, check=True)
+            samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return round(statistics.median(samples) * 1000, 1)
+
+
+def cold_start_results(runs: int, exe: str = None) -> dict:
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {"cold_start_source": {**measure_cold_start([sys.executable, "main.py"], here, runs),
+                                     "import_ms": measure_import(runs)}}
+    if exe:
+        exe = os.path.abspath(exe)
+        # The frozen build looks for static/ and templates/ next to the executable (see build_exe.py)
+        results["cold_start_frozen"] = measure_cold_start([exe], os.path.dirname(exe), runs)
+    return results
+
+
+def bench_cold_start(args) -> dict:
+    """Time to first served request for `python main.py` and, with --exe, the PyInstaller build."""
+    return cold_start_results(args.runs, args.exe)
+
+
+# Worker scaling: real server processes, load from separate client processes
+
+async def _http_connection(port: int, paths: list, deadline: float, latencies: list, errors: list) -> None:
+    """One keep-alive HTTP/1.1 connection issuing GETs until `deadline` (bodies are read, not parsed)."""
+    rng = random.Random()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        while time.perf_counter() < deadline:
+            request = f"GET {rng.choice(paths)} HTTP/1.1\r\nHost: bench\r\n\r\n".encode()
+            started = time.perf_counter()
+            writer.write(request)
+            head = await reader.readuntil(b"\r\n\r\n")
+            headers = dict(line.lower().split(b":", 1) for line in head.split(b"\r\n")[1:] if b":" in line)
+            length = int(headers.get(b"content-length", b"0"))
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            if not head.startswith(b"HTTP/1.1 200"):
+                errors.append(head.split(b"\r\n", 1)[0].decode())
+    finally:
+        writer.close()
+
+
+def _client_process(port: int, paths: list, connections: int, duration: float) -> tuple:
+    """Run in a separate process so the load generator does not share a GIL with anything else."""
+    async def run():
+        latencies, errors = [], []
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(_http_connection(port, paths, deadline, latencies, errors) for _ in range(connections)))
+        return latencies, errors
+
+    return asyncio.run(run())
+
+
+def drive_http_load(port: int, paths: list, clients: int, connections: int, duration: float) -> dict:
+    """`connections` keep-alive connections spread over `clients` processes for `duration` seconds."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    per_client = [connections // clients + (1 if i < connections % clients else 0) for i in range(clients)]
+    with ProcessPoolExecutor(clients, mp_context=multiprocessing.get_context("spawn")) as pool:
+        started = time.perf_counter()
+        futures = [pool.submit(_client_process, port, paths, n, duration) for n in per_client if n]
+        outcomes = [f.result() for f in futures]
+        elapsed = time.perf_counter() - started
+    latencies = [x for lat, _ in outcomes for x in lat]
+    errors = [x for _, err in outcomes for x in err]
+    # Elapsed includes client process startup; throughput is over the measured window only
+    return {**summarize(latencies, duration), "errors": len(errors), "wall_seconds": round(elapsed, 2)}
+
+
+def bench_workers(args) -> dict:
+    """Read throughput of `serve.py --workers N` for each N, against one generated dataset."""
+    import subprocess
+    import datagen
+    from db_clients import create_sqlalchemy_engine
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    counts = [int(n) for n in args.workers.split(",")]
+    cpus = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as workdir:
+        engine = create_sqlalchemy_engine(f"sqlite:///{os.path.join(workdir, 'app.db')}")
+        samples = datagen.generate(engine, datagen.SCALES[args.scale], seed=args.seed)["samples"]
+        engine.dispose()
+        rng = random.Random(args.seed)
+        # Mix of the scanner lookups and list pages the line-side terminals issue
+        paths = ([f"/raw-material-trace/{rng.choice(samples['traceids'])}" for _ in range(500)]
+                 + [f"/raw-material-trace?supplierid={s}&limit=50" for s in samples["suppliers"]]
+                 + ["/kpi/stock"] * 50)
+
+        results = {}
+        for workers in counts:
+            port = _free_port()
+            env = {**_server_env(workdir, port), "WORKERS": str(workers), "SECRET_KEY": "bench"}
+            if args.no_cache:
+                env["RESPONSE_CACHE_TTL_SECONDS"] = "0"
+            proc = subprocess.Popen([sys.executable, "serve.py", "--workers", str(workers)], cwd=here, env=env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                _wait_serving(proc, port, time.perf_counter(), 120.0)
+                # Unrecorded: lets every worker finish starting and fill its pools and caches
+                drive_http_load(port, paths, args.clients, args.connections, args.warmup)
+                results[f"workers_{workers}"] = {"workers": workers, **drive_http_load(port, paths, args.clients, args.connections, args.duration)}
+            finally:
+                _stop_server(proc)
+
+    base = results[f"workers_{counts[0]}"]["throughput_per_s"] / counts[0]
+    for entry in results.values():
+        entry["speedup"] = round(entry["throughput_per_s"] / (base * counts[0]), 2)
+        entry["efficiency"] = round(entry["throughput_per_s"] / (base * entry["workers"]), 2)
+    return {
+        "cpus": cpus,
+        "clients": args.clients,
+        "connections": args.connections,
+        # Server workers and client processes share the machine; beyond this, added workers only time-slice
+        "cpu_bound_at_workers": max(1, cpus - args.clients),
+        "results": results,
+    }
+
+
+# Reproducible suite: generated dataset + in-process load per endpoint family
+
+def git_revision() -> str:
+    import subprocess
+
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> dict:
+    """Flag scenarios whose throughput fell, or p99 / start time rose, by more than `tolerance` (a fraction)."""
+    regressions = []
+    scenarios = {}
+    for name, current in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        entry = {}
+        for metric, higher_is_better in (("throughput_per_s", True), ("p99_ms", False), ("start_ms", False)):
+            if not base.get(metric) or metric not in current:
+                continue
+            change = (current[metric] - base[metric]) / base[metric]
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            entry[metric] = {"baseline": base[metric], "current": current[metric],
+                             "change_pct": round(change * 100, 1), "regressed": regressed}
+            if regressed:
+                regressions.append(f"{name}.{metric}")
+        scenarios[name] = entry
+    return {"baseline_revision": baseline.get("meta", {}).get("revision"), "tolerance_pct": tolerance * 100,
+            "regressions": regressions, "scenarios": scenarios}
+
+
+def bench_suite(args) -> dict:
+    """Cold start, then create, bulk create, list, get-by-id, trace, KPI and login against a generated dataset."""
+    import platform
+    from urllib.parse import urlencode
+    import datagen
+
+    # Before load_app: the spawned servers must not share this process's imports or database
+    startup = cold_start_results(args.cold_start_runs, args.exe) if args.cold_start_runs else {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        main = load_app(workdir)
+        t0 = time.perf_counter()
+        dataset = datagen.generate(main.engine, datagen.SCALES[args.scale], seed=args.seed)
+        seed_seconds = time.perf_counter() - t0
+        samples = dataset["samples"]
+        stored = main.password_hasher.hash_sync("bench")
+        with main.SessionLocal() as db:
+            db.add_all([main.User(username=f"op{i:04d}", hashed_password=stored, role="user") for i in range(200)])
+            db.commit()
+        admin = {"Authorization": f"Bearer {main.create_access_token({'sub': 'admin'})}", "Content-Type": "application/json"}
+        form = {"Content-Type": "application/x-www-form-urlencoded"}
+        rng = random.Random(args.seed)
+
+        def material(prefix: str, i: int) -> dict:
+            return {"traceid": f"{prefix}{i:09d}", "materialbatchno": f"BM{i // 20:07d}", "tracecode": f"{prefix}C{i:09d}",
+                    "supplierid": rng.choice(samples["suppliers"]), "purchaseorderid": "PO-BENCH", "incominginspectionid": f"IQC{i}",
+                    "storagelocation": "WH-B", "usedrecords": [], "remainingqty": 100, "tracestatus": "In Stock"}
+
+        def bulk_body(i: int) -> bytes:
+            return json.dumps([material("BB", i * args.bulk_size + j) for j in range(args.bulk_size)]).encode()
+
+        scenarios = {
+            "create": (args.requests, lambda i: ("POST", "/raw-material-trace", admin, json.dumps(material("BC", i)).encode(), "")),
+            "bulk_create": (args.bulk_requests, lambda i: ("POST", "/raw-material-trace/bulk", admin, bulk_body(i), "")),
+            "list_raw_materials": (args.requests, lambda i: ("GET", "/raw-material-trace", {}, b"",
+                                                             f"supplierid={rng.choice(samples['suppliers'])}&limit=100")),
+            "list_relations": (args.requests, lambda i: ("GET", "/batch-trace-relations", {}, b"", "relationstatus=Valid&limit=100")),
+            "get_by_id": (args.requests, lambda i: ("GET", f"/raw-material-trace/{rng.choice(samples['traceids'])}", {}, b"", "")),
+            "trace_backward": (args.requests, lambda i: ("GET", f"/trace/backward/{rng.choice(samples['product_codes'])}", {}, b"", "include_invalid=true")),
+            "trace_forward": (args.requests, lambda i: ("GET", f"/trace/forward/{rng.choice(samples['raw_codes'])}", {}, b"", "")),
+            "kpi_warnings": (args.requests, lambda i: ("GET", "/kpi/warnings", {}, b"", "")),
+            "kpi_stock": (args.requests, lambda i: ("GET", "/kpi/stock", {}, b"", "")),
+            "login": (args.login_requests, lambda i: ("POST", "/auth/login", form,
+                                                      urlencode({"username": f"op{i % 200:04d}", "password": "bench"}).encode(), "")),
+        }
+        selected = args.only.split(",") if args.only else list(scenarios)
+
+        async def run_all() -> dict:
+            results = {}
+            for name in selected:
+                total, make_request = scenarios[name]
+                concurrency = min(args.concurrency, 4) if name == "bulk_create" else args.concurrency
+                if args.warmup and name not in ("create", "bulk_create"):
+                    # Unrecorded: fills the connection pools and caches so percentiles are steady-state
+                    await run_load(main.app, make_request, args.warmup, concurrency)
+                latencies, elapsed, errors = await run_load(main.app, make_request, total, concurrency)
+                results[name] = {**summarize(latencies, elapsed), "errors": errors, "concurrency": concurrency}
+                if name == "bulk_create":
+                    results[name]["rows_per_s"] = round(total * args.bulk_size / elapsed, 1)
+            await main.async_engine.dispose()
+            return results
+
+        results = {**startup, **asyncio.run(run_all())}
+        main.password_hasher.shutdown()
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "scale": args.scale,
+            "seed": args.seed,
+            "dataset": {k: v for k, v in dataset.items() if k != "samples"},
+            "seed_seconds": round(seed_seconds, 2),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["comparison"] = compare_to_baseline(results, json.load(f), args.tolerance)
+        report["passed"] = not report["comparison"]["regressions"]
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="scenario", required=True)
+
+    p = sub.add_parser("trace", help="backward/forward trace over a synthetic multi-level genealogy")
+    p.add_argument("--edges", type=int, default=1_000_000)
+    p.add_argument("--levels", type=int, default=3)
+    p.add_argument("--fanout", type=int, default=10)
+    p.add_argument("--iterations", type=int, default=200)
+    p.set_defaults(func=bench_trace)
+
+    p = sub.add_parser("auth", help="authenticated request throughput with and without the token cache")
+    p.add_argument("--requests", type=int, default=5000)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.set_defaults(func=bench_auth)
+
+    p = sub.add_parser("login-storm", help="concurrent logins: logins/s, p99 latency, event-loop probe latency")
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--concurrency", type=int, default=200)
+    p.add_argument("--stored-rounds", type=int, default=None, help="hash cost of the seeded users (default: current)")
+    p.set_defaults(func=bench_login_storm)
+
+    p = sub.add_parser("db-concurrency", help="concurrent writers and readers per engine configuration")
+    p.add_argument("--writers", type=int, default=4)
+    p.add_argument("--readers", type=int, default=8)
+    p.add_argument("--duration", type=float, default=10.0)
+    p.add_argument("--postgres-url", default=None, help="scratch PostgreSQL database to include")
+    p.set_defaults(func=bench_db_concurrency)
+
+    p = sub.add_parser("read-load", help="async vs sync read endpoints under concurrent load")
+    p.add_argument("--rows", type=int, default=20000)
+    p.add_argument("--requests", type=int, default=5000)
+    p.add_argument("--concurrency", type=int, default=64)
+    p.set_defaults(func=bench_read_load)
+
+    p = sub.add_parser("export", help="streaming export of a large table under an RSS ceiling")
+    p.add_argument("--rows", type=int, default=1_000_000)
+    p.add_argument("--rss-ceiling-mb", type=float, default=64.0, help="maximum RSS growth during the export")
+    p.set_defaults(func=bench_export)
+
+    p = sub.add_parser("serialization", help="ORM + Pydantic vs row tuples + fast JSON for large pages, and gzip/br response sizes")
+    p.add_argument("--scale", choices=("10k", "100k", "1m"), default="10k")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--page-sizes", default="100,1000", help="comma-separated rows per page for the pipeline comparison")
+    p.add_argument("--iterations", type=int, default=30, help="timed pages per table, size and pipeline")
+    p.add_argument("--requests", type=int, default=200, help="requests per endpoint and encoding")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--warmup", type=int, default=20)
+    p.set_defaults(func=bench_serialization)
+
+    p = sub.add_parser("rules", help="quality rule engine throughput")
+    p.add_argument("--measurements", type=int, default=500_000)
+    p.add_argument("--objects", type=int, default=20_000)
+    p.add_argument("--violation-rate", type=float, default=0.01)
+    p.add_argument("--batch", type=int, default=5000)
+    p.set_defaults(func=bench_rules)
+
+    p = sub.add_parser("graph-sync", help="outbox enqueue and drain throughput (in-memory graph sink)")
+    p.add_argument("--relations", type=int, default=100_000)
+    p.add_argument("--batch", type=int, default=500)
+    p.set_defaults(func=bench_graph_sync)
+
+    p = sub.add_parser("suite", help="full endpoint suite on a generated dataset, with optional baseline comparison")
+    p.add_argument("--scale", choices=("10k", "100k", "1m"), default="10k", help="raw material units to generate")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    p.add_argument("--concurrency", type=int, default=32)
+    p.add_argument("--bulk-requests", type=int, default=20)
+    p.add_argument("--bulk-size", type=int, default=1000)
+    p.add_argument("--login-requests", type=int, default=200)
+    p.add_argument("--warmup", type=int, default=100, help="unrecorded requests before each read/login scenario")
+    p.add_argument("--only", default=None, help="comma-separated subset of scenarios")
+    p.add_argument("--output", default=None, help="write the JSON report here (usable later as --baseline)")
+    p.add_argument("--baseline", default=None, help="previous --output file to compare against")
+    p.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown before flagging a regression")
+    p.add_argument("--cold-start-runs", type=int, default=3, help="server restarts timed for cold start (0 to skip)")
+    p.add_argument("--exe", default=None, help="PyInstaller build to include in the cold-start measurement")
+    p.set_defaults(func=bench_suite)
+
+    p = sub.add_parser("workers", help="read throughput of the multi-worker server per worker count (HTTP, separate client processes)")
+    p.add_argument("--workers", default=",".join(str(n) for n in (1, 2, 4, 8, 16) if n <= max(2, os.cpu_count() or 1)),
+                   help="comma-separated worker counts (default: powers of two up to the CPU count)")
+    p.add_argument("--scale", choices=("10k", "100k", "1m"), default="10k")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 4), help="load generator processes")
+    p.add_argument("--connections", type=int, default=64, help="keep-alive connections across all clients")
+    p.add_argument("--duration", type=float, default=10.0, help="measured seconds per worker count")
+    p.add_argument("--warmup", type=float, default=3.0)
+    p.add_argument("--no-cache", action="store_true", help="disable the response cache so every lookup queries the database")
+    p.set_defaults(func=bench_workers)
+
+    p = sub.add_parser("cold-start", help="time from process spawn to the first served request (source and frozen builds)")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--exe", default=None, help="path to the executable built by build_exe.py")
+    p.set_defaults(func=bench_cold_start)
+
+    args = parser.parse_args()
+    result = args.func(args)
+    print(json.dumps({args.scenario: result}, indent=2))
+    if result.get("passed") is False:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
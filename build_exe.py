@@ -8,23 +8,41 @@ static_dir = os.path.join(base_dir, 'static')
 templates_dir = os.path.join(base_dir, 'templates')
 dist_dir = os.path.join(base_dir, 'dist')
 
-# 打包 main.py 为单文件 exe，包含静态文件和模板，并处理 passlib 的依赖
+# --onedir：输出目录而非单文件。单文件 exe 每次启动都要先解压到临时目录，冷启动明显更慢
+onedir = '--onedir' in sys.argv[1:]
+
+# 通过字符串动态加载、PyInstaller 静态分析不到的模块：
+# passlib 的 pbkdf2 handler、SQLAlchemy 的 aiosqlite 方言（异步读接口）、uvicorn 的协议/事件循环实现
+hidden_imports = [
+    'passlib.handlers.pbkdf2',
+    'aiosqlite',
+    'sqlalchemy.dialects.sqlite.aiosqlite',
+    'uvicorn.logging',
+    'uvicorn.loops.auto',
+    'uvicorn.protocols.http.auto',
+    'uvicorn.protocols.websockets.auto',
+    'uvicorn.lifespan.on',
+]
+
+# 打包 main.py 为 exe，包含静态文件和模板
 cmd = (
-    'pyinstaller --onefile '
-    '--add-data "static;static" '
-    '--add-data "templates;templates" '
-    '--hidden-import=passlib.handlers.pbkdf2 '
-    'main.py --clean'
+    f'pyinstaller {"--onedir" if onedir else "--onefile"} '
+    f'--add-data "static{os.pathsep}static" '
+    f'--add-data "templates{os.pathsep}templates" '
+    + ''.join(f'--hidden-import={name} ' for name in hidden_imports)
+    + 'main.py --clean'
 )
 
 print('执行命令:')
 print(cmd)
 os.system(cmd)
 
-# 复制 static 和 templates 到 dist 目录，防止 exe 运行时找不到目录
-if os.path.exists(dist_dir):
+# 复制 static 和 templates 到 exe 所在目录，防止 exe 运行时找不到目录
+target_dir = os.path.join(dist_dir, 'main') if onedir else dist_dir
+if os.path.exists(target_dir):
     if os.path.exists(static_dir):
-        shutil.copytree(static_dir, os.path.join(dist_dir, 'static'), dirs_exist_ok=True)
+        shutil.copytree(static_dir, os.path.join(target_dir, 'static'), dirs_exist_ok=True)
     if os.path.exists(templates_dir):
-        shutil.copytree(templates_dir, os.path.join(dist_dir, 'templates'), dirs_exist_ok=True)
-print('static 和 templates 目录已复制到 dist 目录。')
+        shutil.copytree(templates_dir, os.path.join(target_dir, 'templates'), dirs_exist_ok=True)
+print(f'static 和 templates 目录已复制到 {target_dir}。')
+print('冷启动耗时：python benchmark.py cold-start --exe <生成的可执行文件>')
@@ -0,0 +1,169 @@
+"""
+Bulk ingest for MES/WMS pushes of raw material, relation and warning rows.
+
+A batch is validated as a whole before anything is written: schema errors,
+duplicates inside the batch, uniqueness against existing rows and foreign
+references are all checked with set-based IN queries. Accepted rows are then
+inserted with executemany in chunked transactions.
+
+Modes:
+- atomic: any rejected row rejects the whole batch; nothing is written.
+- partial: valid rows are written, rejected rows are reported.
+"""
+import json
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from traceability import chunked
+
+BULK_CHUNK_SIZE = 1000
+BULK_MAX_ROWS = 50000
+
+
+class BulkIngestError(ValueError):
+    """The request body could not be read as a JSON array or NDJSON."""
+
+
+def parse_json_array(body: bytes) -> List[object]:
+    try:
+        rows = json.loads(body or b"[]")
+    except ValueError as exc:
+        raise BulkIngestError(f"Invalid JSON: {exc}")
+    if not isinstance(rows, list):
+        raise BulkIngestError("Expected a JSON array of records")
+    return rows
+
+
+def parse_ndjson_lines(lines: Iterable[bytes]) -> List[object]:
+    """Parse NDJSON lines; a malformed line becomes a ValueError placeholder so it is reported by index."""
+    rows: List[object] = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            rows.append(json.loads(line))
+        except ValueError as exc:
+            rows.append(ValueError(f"Invalid JSON: {exc}"))
+    return rows
+
+
+def _error(index: int, detail: str, field: Optional[str] = None) -> dict:
+    return {"index": index, "field": field, "detail": detail}
+
+
+def ingest(db: Session, model, schema: type, rows: Sequence[object], unique_fields: Sequence[str],
+           references: Optional[Dict[str, object]] = None, fill_now: Sequence[str] = (),
+           archive=None, atomic: bool = True, chunk_size: int = BULK_CHUNK_SIZE,
+           on_insert: Optional[Callable[[Session, List[dict]], object]] = None) -> dict:
+    """Validate and insert `rows` into `model`.
+
+    `unique_fields` are checked against the batch itself, the table and its
+    `archive` model when given;
+    `references` maps a field to the column (or tuple of columns) its values
+    must already exist in;
+    `fill_now` fields default to the current UTC time when omitted;
+    `on_insert` is called with each inserted chunk inside its transaction.
+    """
+    errors: List[dict] = []
+    candidates: List[Tuple[int, dict]] = []
+    for index, row in enumerate(rows):
+        if isinstance(row, Exception):
+            errors.append(_error(index, str(row)))
+            continue
+        try:
+            values = schema.model_validate(row).model_dump()
+        except ValidationError as exc:
+            for err in exc.errors():
+                loc = ".".join(str(part) for part in err["loc"]) or None
+                errors.append(_error(index, err["msg"], loc))
+            continue
+        candidates.append((index, values))
+
+    rejected = {e["index"] for e in errors}
+
+    # Uniqueness inside the batch (first occurrence wins) and against the table
+    for field in unique_fields:
+        seen = set()
+        for index, values in candidates:
+            if values[field] in seen:
+                errors.append(_error(index, f"duplicate {field} in batch", field))
+                rejected.add(index)
+            seen.add(values[field])
+        existing = set()
+        for table in (model, archive) if archive is not None else (model,):
+            column = getattr(table, field)
+            for chunk in chunked(list(seen)):
+                existing.update(v for (v,) in db.query(column).filter(column.in_(chunk)))
+        for index, values in candidates:
+            if values[field] in existing:
+                errors.append(_error(index, f"{field} already exists", field))
+                rejected.add(index)
+
+    for field, columns in (references or {}).items():
+        wanted = list({values[field] for _, values in candidates})
+        found = set()
+        for column in columns if isinstance(columns, tuple) else (columns,):
+            for chunk in chunked([v for v in wanted if v not in found]):
+                found.update(v for (v,) in db.query(column).filter(column.in_(chunk)))
+        for index, values in candidates:
+            if values[field] not in found:
+                errors.append(_error(index, f"{field} not found", field))
+                rejected.add(index)
+
+    accepted = [(index, values) for index, values in candidates if index not in rejected]
+    if atomic and rejected:
+        accepted = []
+    now = datetime.now(timezone.utc)
+    for _, values in accepted:
+        for field in fill_now:
+            if values.get(field) is None:
+                values[field] = now
+
+    def write(chunk: Sequence[Tuple[int, dict]]) -> None:
+        db.execute(insert(model), [values for _, values in chunk])
+        if on_insert is not None:
+            on_insert(db, [values for _, values in chunk])
+
+    inserted = 0
+    try:
+        for chunk in chunked(accepted, chunk_size):
+            try:
+                write(chunk)
+                if not atomic:
+                    db.commit()
+                inserted += len(chunk)
+            except IntegrityError:
+                db.rollback()
+                if atomic:
+                    raise
+                # A concurrent writer won the race for some key in this chunk: retry it row by
+                # row so only the conflicting rows are rejected
+                for row in chunk:
+                    try:
+                        write([row])
+                        db.commit()
+                        inserted += 1
+                    except IntegrityError as exc:
+                        db.rollback()
+                        errors.append(_error(row[0], f"conflict during insert: {exc.orig}"))
+                        rejected.add(row[0])
+        if atomic:
+            db.commit()
+    except IntegrityError as exc:
+        inserted = 0
+        errors.append(_error(-1, f"batch rolled back: {exc.orig}"))
+        rejected.update(index for index, _ in accepted)
+
+    errors.sort(key=lambda e: e["index"])
+    return {
+        "mode": "atomic" if atomic else "partial",
+        "received": len(rows),
+        "inserted": inserted,
+        "rejected": len(rejected),
+        "errors": errors,
+    }
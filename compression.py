@@ -0,0 +1,178 @@
+"""
+Response compression negotiated per request from Accept-Encoding.
+
+br is offered when the optional brotli package is installed, gzip always;
+the client's q-values decide, br winning ties. Only compressible media
+types (JSON, NDJSON, CSV, text, JavaScript, SVG) of at least
+COMPRESSION_MIN_BYTES are compressed. Responses that already carry a
+Content-Encoding (the gzip export) and responses serving byte ranges
+(attachment downloads and static files advertise Accept-Ranges, and a Range
+must address the stored bytes) pass through untouched, which starlette's
+GZipMiddleware would not guarantee.
+
+A single-body response (list, search, trace) is compressed in one call, on
+a worker thread when it is larger than COMPRESSION_THREAD_BYTES so a large
+page does not stall the event loop. Streaming responses (exports) are
+compressed chunk by chunk as they are sent. Compressed responses get
+`Vary: Accept-Encoding` and a weak ETag: the bytes differ from the identity
+encoding, and If-None-Match comparison ignores the W/ prefix so conditional
+GETs keep working.
+
+    COMPRESSION_ENABLED=false         # turn it off (e.g. behind a compressing proxy)
+    COMPRESSION_MIN_BYTES=1024
+    COMPRESSION_GZIP_LEVEL=6
+    COMPRESSION_BROTLI_QUALITY=4
+"""
+import os
+import zlib
+from typing import Optional, Sequence
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_THREAD_BYTES = 256 * 1024
+COMPRESSIBLE_TYPES = {
+    "application/json", "application/x-ndjson", "application/javascript", "image/svg+xml",
+}
+
+
+def negotiate(accept_encoding: str, available: Sequence[str]) -> Optional[str]:
+    """The encoding in `available` (in preference order) the client ranks highest, or None."""
+    ranks = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            ranks[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = ranks.get(encoding, ranks.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class _Compressor:
+    """Incremental compressor: compress() per chunk, finish() once at the end."""
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            import brotli
+
+            compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+            self.compress, self.finish = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.compress, self.finish = compressor.compress, compressor.flush
+
+
+def compress(encoding: str, body: bytes) -> bytes:
+    compressor = _Compressor(encoding)
+    return compressor.compress(body) + compressor.finish()
+
+
+def _compressible(headers: MutableHeaders) -> bool:
+    media_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+        # Resolved on the first request, so importing the app does not import brotli
+        self._encodings = None
+
+    def encodings(self) -> tuple:
+        if self._encodings is None:
+            try:
+                import brotli  # noqa: F401
+
+                self._encodings = ("br", "gzip")
+            except ImportError:
+                self._encodings = ("gzip",)
+        return self._encodings
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""), self.encodings())
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _Responder(send, encoding, self.minimum_size).send)
+
+
+class _Responder:
+    """Holds back http.response.start until the first body message shows whether to compress."""
+
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+
+    def _mark(self, headers: MutableHeaders) -> None:
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = "W/" + etag
+
+    async def send(self, message) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+        if self.compressor is not None:
+            body = self.compressor.compress(message.get("body", b""))
+            if not message.get("more_body", False):
+                body += self.compressor.finish()
+            await self._send({**message, "body": body})
+            return
+
+        # First body message: decide
+        headers = MutableHeaders(raw=self.start["headers"])
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if (self.start["status"] in (204, 206, 304) or "content-encoding" in headers or "accept-ranges" in headers
+                or not _compressible(headers)):
+            self.passthrough = True
+        elif not more_body and len(body) < self.minimum_size:
+            headers.add_vary_header("Accept-Encoding")
+            self.passthrough = True
+        if self.passthrough:
+            await self._send(self.start)
+            await self._send(message)
+            return
+
+        self._mark(headers)
+        if not more_body:
+            if len(body) >= COMPRESSION_THREAD_BYTES:
+                body = await run_in_threadpool(compress, self.encoding, body)
+            else:
+                body = compress(self.encoding, body)
+            headers["Content-Length"] = str(len(body))
+            await self._send(self.start)
+            await self._send({**message, "body": body})
+            return
+        # Streaming: length unknown up front
+        del headers["Content-Length"]
+        self.compressor = _Compressor(self.encoding)
+        await self._send(self.start)
+        await self._send({**message, "body": self.compressor.compress(body)})
@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+# main.py reads its storage locations and keys at import: point them at a
+# scratch directory so test runs never touch ./app.db, ./timeseries.db or ./objects
+_scratch = tempfile.mkdtemp(prefix="traceability-tests-")
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", f"sqlite:///{_scratch}/app.db")
+os.environ.setdefault("TIMESERIES_PATH", os.path.join(_scratch, "timeseries.db"))
+os.environ.setdefault("OBJECT_STORE_PATH", os.path.join(_scratch, "objects"))
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+os.environ.setdefault("PASSWORD_HASH_ROUNDS", "1000")
+os.environ.setdefault("GRAPH_SYNC_WORKER", "0")
+
+
+@pytest.fixture(scope="session")
+def client():
+    """TestClient for main.app, signed in as the seeded admin."""
+    import main
+    import manage
+
+    with TestClient(main.app) as client:
+        response = client.post("/auth/login", data={"username": manage.ADMIN_USERNAME, "password": manage.ADMIN_PASSWORD})
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+        yield client
+
+
+@pytest.fixture
+def receive(client):
+    """Create a raw material unit of `qty` through the API, with traceid == tracecode."""
+    def receive(tracecode, qty=5):
+        response = client.post("/raw-material-trace", json={
+            "traceid": tracecode, "materialbatchno": "MB", "tracecode": tracecode, "supplierid": "SUP",
+            "purchaseorderid": "PO", "incominginspectionid": "II", "storagelocation": "WH", "remainingqty": qty,
+        })
+        assert response.status_code == 201
+    return receive
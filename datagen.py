@@ -0,0 +1,161 @@
+"""
+Synthetic traceability dataset for benchmarks and load tests.
+
+Shape: suppliers -> raw material batches (several units per batch, skewed
+toward a few large suppliers, receive times spread over a year) -> three
+relation stages per consumed unit (Machining -> Heat Treatment -> Assembly,
+so backward traces from a finished product are three hops deep) -> quality
+warnings on a small share of materials and products.
+
+Generation is deterministic for a given seed and streams rows in batches, so
+the 1M scale keeps memory flat. Rows bypass the request handlers, so the
+KPI summary tables are rebuilt once at the end. Usage:
+
+    python datagen.py --scale 100k --url sqlite:///./bench.db
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import kpi
+from models import Base, BatchTraceRelation, QualityRiskWarning, RawMaterialTraceRecord
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+STAGES = ("Machining", "Heat Treatment", "Assembly")
+MATERIAL_TYPES = ("Titanium Alloy", "Aluminium Alloy", "Stainless Steel", "Composite")
+UNITS_PER_BATCH = 20
+SAMPLE_SIZE = 10000
+EPOCH = datetime(2024, 1, 1)
+
+
+def traceid(i: int) -> str:
+    return f"T{i:09d}"
+
+
+def raw_tracecode(i: int) -> str:
+    return f"RM{i:09d}"
+
+
+def stage_tracecode(stage: int, i: int, branch: int = 0) -> str:
+    return f"S{stage}{branch}{i:09d}"
+
+
+def _status(rng: random.Random) -> str:
+    r = rng.random()
+    return "In Stock" if r < 0.35 else "In Use" if r < 0.75 else "Consumed" if r < 0.97 else "Scrapped"
+
+
+def generate(engine, materials: int, seed: int = 1, warning_rate: float = 0.02, batch: int = 20000) -> Dict[str, object]:
+    """Insert the dataset through `engine`; return row counts and samples of ids/codes for request generators."""
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(seed)
+    suppliers = [f"SUP{i:05d}" for i in range(max(20, materials // 500))]
+    # Zipf-like skew: a handful of suppliers deliver most batches
+    supplier_weights = [1 / (rank + 1) for rank in range(len(suppliers))]
+    counts = {"suppliers": len(suppliers), "raw_materials": 0, "relations": 0, "warnings": 0}
+    samples: Dict[str, List[str]] = {"traceids": [], "raw_codes": [], "product_codes": [], "suppliers": suppliers[:50]}
+    seen: Dict[str, int] = {name: 0 for name in samples}
+
+    def sample(name: str, value: str) -> None:
+        # Reservoir sampling keeps a uniform sample of at most SAMPLE_SIZE values
+        seen[name] += 1
+        bucket = samples[name]
+        if len(bucket) < SAMPLE_SIZE:
+            bucket.append(value)
+        else:
+            j = rng.randrange(seen[name])
+            if j < SAMPLE_SIZE:
+                bucket[j] = value
+
+    for start in range(0, materials, batch):
+        raws, relations, warnings = [], [], []
+        batch_supplier = None
+        for i in range(start, min(materials, start + batch)):
+            if i % UNITS_PER_BATCH == 0 or batch_supplier is None:
+                batch_supplier = rng.choices(suppliers, supplier_weights)[0]
+                batch_time = EPOCH + timedelta(seconds=rng.randrange(365 * 86400))
+            status = _status(rng)
+            code = raw_tracecode(i)
+            receivetime = batch_time + timedelta(milliseconds=i % UNITS_PER_BATCH)
+            raws.append({
+                "traceid": traceid(i), "materialbatchno": f"MB{i // UNITS_PER_BATCH:08d}", "tracecode": code,
+                "supplierid": batch_supplier, "purchaseorderid": f"PO{i // 1000:07d}", "incominginspectionid": f"IQC{i:09d}",
+                "receivetime": receivetime, "storagelocation": f"WH-{'ABCD'[i % 4]}-{i % 50:02d}", "usedrecords": [],
+                "remainingqty": 0 if status == "Consumed" else round(rng.uniform(1, 500), 2), "tracestatus": status,
+            })
+            sample("traceids", traceid(i))
+            sample("raw_codes", code)
+            if rng.random() < warning_rate:
+                warnings.append(_warning(rng, f"W{i:09d}R", "Raw Material", code, receivetime))
+
+            if status in ("In Use", "Consumed"):
+                # Stage 1 may split a unit into two parts; each part then goes through the remaining stages
+                for branch in range(2 if rng.random() < 0.2 else 1):
+                    parent = code
+                    when = receivetime
+                    for stage, name in enumerate(STAGES, start=1):
+                        product = stage_tracecode(stage, i, branch)
+                        when += timedelta(hours=rng.randrange(1, 72))
+                        r = rng.random()
+                        relations.append({
+                            "relationid": f"REL{stage}{branch}{i:09d}", "productbatchno": f"PB{stage}{i // 100:07d}",
+                            "producttracecode": product, "materialtracecode": parent,
+                            "equipmentid": f"EQ-{stage}-{i % 40:02d}", "processschemeid": f"PS-{name[:4].upper()}-{i % 7}",
+                            "inspectionpersonid": f"QC{i % 120:03d}", "inspectiontime": when, "relationstage": name,
+                            "relationstatus": "Valid" if r < 0.97 else "Pending Confirmation" if r < 0.99 else "Invalid",
+                        })
+                        parent = product
+                    sample("product_codes", parent)
+                    if rng.random() < warning_rate:
+                        warnings.append(_warning(rng, f"W{i:09d}P{branch}", "Finished Product", parent, when))
+
+        with engine.begin() as conn:
+            conn.execute(insert(RawMaterialTraceRecord), raws)
+            if relations:
+                conn.execute(insert(BatchTraceRelation), relations)
+            if warnings:
+                conn.execute(insert(QualityRiskWarning), warnings)
+        counts["raw_materials"] += len(raws)
+        counts["relations"] += len(relations)
+        counts["warnings"] += len(warnings)
+    with Session(engine) as db:
+        kpi.rebuild(db)
+    return {**counts, "samples": samples}
+
+
+def _warning(rng: random.Random, warningid: str, obj: str, objectid: str, when: datetime) -> dict:
+    material = rng.choice(MATERIAL_TYPES)
+    r = rng.random()
+    return {
+        "warningid": warningid, "warningobject": obj, "objectid": objectid,
+        "risktype": rng.choice(("Out of Tolerance: tensile_strength", "Out of Tolerance: hardness", "Certificate Missing")),
+        "risklevel": rng.choices((1, 2, 3, 4, 5), (5, 30, 40, 20, 5))[0],
+        "triggercondition": f"{material} inspection outside specification",
+        "triggertime": when + timedelta(minutes=rng.randrange(1, 600)),
+        "handlerid": f"QA{rng.randrange(30):03d}",
+        "handlestatus": "Pending Handling" if r < 0.3 else "In Handling" if r < 0.5 else "Closed",
+        "handleresult": "Dispositioned" if r >= 0.5 else None,
+    }
+
+
+def main():
+    from db_clients import create_sqlalchemy_engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=sorted(SCALES), default="10k", help="number of raw material units")
+    parser.add_argument("--url", required=True, help="target database (use a scratch database)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--warning-rate", type=float, default=0.02)
+    args = parser.parse_args()
+    engine = create_sqlalchemy_engine(args.url)
+    result = generate(engine, SCALES[args.scale], seed=args.seed, warning_rate=args.warning_rate)
+    engine.dispose()
+    print({k: v for k, v in result.items() if k != "samples"})
+
+
+if __name__ == "__main__":
+    main()
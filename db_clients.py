@@ -7,19 +7,44 @@ Database architecture setup for Section 5.1:
 
 This module provides lazy-initialized clients configured via environment variables.
 No network calls are made on import; clients are created on demand.
+
+Fork safety: a forked worker (gunicorn --preload, multiprocessing fork) must
+not share sockets or SQLite handles with its parent. After a fork the child
+drops the lazy clients, so each is recreated on first use, and every engine
+made here gets a fresh pool (dispose(close=False) leaves the parent's
+connections alone).
 """
 import os
+import time
+import weakref
 from typing import Optional
 
 # Relational: keep existing SQLite; optionally support PostgreSQL URL via env
 DEFAULT_SQLALCHEMY_URL = os.getenv("SQLALCHEMY_DATABASE_URL", "sqlite:///./app.db")
 
+# SQLite tuning (applied on every new connection)
+SQLITE_WAL = os.getenv("SQLITE_WAL", "true").lower() == "true"
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+# Connection pool (PostgreSQL and file-backed SQLite)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
 # InfluxDB config
 INFLUX_URL = os.getenv("INFLUX_URL", "http://localhost:8086")
 INFLUX_TOKEN = os.getenv("INFLUX_TOKEN", "")
 INFLUX_ORG = os.getenv("INFLUX_ORG", "")
 INFLUX_BUCKET = os.getenv("INFLUX_BUCKET", "")
 
+# Local time-series store, used when InfluxDB is not configured
+TIMESERIES_PATH = os.getenv("TIMESERIES_PATH", "./timeseries.db")
+
 # MinIO config
 MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "localhost:9000")
 MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "")
@@ -27,6 +52,9 @@ MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "")
 MINIO_SECURE = os.getenv("MINIO_SECURE", "false").lower() == "true"
 MINIO_BUCKET = os.getenv("MINIO_BUCKET", "")
 
+# Local attachment store, used when MinIO (with a bucket) is not configured
+OBJECT_STORE_PATH = os.getenv("OBJECT_STORE_PATH", "./objects")
+
 # Neo4j config
 NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "")
@@ -36,6 +64,28 @@ NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "")
 _influx_client = None
 _minio_client = None
 _neo4j_driver = None
+_timeseries_backend = None
+_object_store = None
+
+# Engines created by this module; their pools are replaced in forked children
+_engines = weakref.WeakSet()
+# Clients inherited across a fork are kept referenced and never used, so their
+# finalizers cannot close or write to connections the parent still owns
+_inherited_clients = []
+
+
+def _after_fork_in_child() -> None:
+    global _influx_client, _minio_client, _neo4j_driver, _timeseries_backend, _object_store
+    clients = (_influx_client, _minio_client, _neo4j_driver, _timeseries_backend, _object_store)
+    _inherited_clients.extend(c for c in clients if c is not None)
+    _influx_client = _minio_client = _neo4j_driver = _timeseries_backend = _object_store = None
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    # POSIX only; on Windows workers are spawned and import everything afresh
+    os.register_at_fork(after_in_child=_after_fork_in_child)
 
 
 def get_influx_client():
@@ -54,6 +104,20 @@ def get_influx_client():
     return None
 
 
+def get_timeseries_backend():
+    """Return the InfluxDB backend if configured, else the local embedded store."""
+    global _timeseries_backend
+    if _timeseries_backend is not None:
+        return _timeseries_backend
+    from timeseries import InfluxTimeSeriesBackend, SQLiteTimeSeriesBackend
+    client = get_influx_client() if INFLUX_BUCKET else None
+    if client is not None:
+        _timeseries_backend = InfluxTimeSeriesBackend(client, INFLUX_BUCKET, INFLUX_ORG)
+    else:
+        _timeseries_backend = SQLiteTimeSeriesBackend(TIMESERIES_PATH)
+    return _timeseries_backend
+
+
 def get_minio_client():
     """Return a MinIO client if credentials exist; otherwise None."""
     global _minio_client
@@ -69,6 +133,20 @@ def get_minio_client():
     return None
 
 
+def get_object_store():
+    """Return the MinIO attachment store if configured with a bucket, else the local one."""
+    global _object_store
+    if _object_store is not None:
+        return _object_store
+    from object_store import LocalObjectStore, MinioObjectStore
+    client = get_minio_client() if MINIO_BUCKET else None
+    if client is not None:
+        _object_store = MinioObjectStore(client, MINIO_BUCKET)
+    else:
+        _object_store = LocalObjectStore(OBJECT_STORE_PATH)
+    return _object_store
+
+
 def get_neo4j_driver():
     """Return a Neo4j driver if credentials exist; otherwise None."""
     global _neo4j_driver
@@ -84,14 +162,160 @@ def get_neo4j_driver():
     return None
 
 
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        if SQLITE_WAL:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        # Negative cache_size is in KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+
+def create_sqlalchemy_engine(url: str = DEFAULT_SQLALCHEMY_URL, **kwargs):
+    """Create the relational engine for `url`.
+
+    SQLite gets WAL journaling, synchronous=NORMAL, a busy timeout and larger
+    page/mmap caches so concurrent writers wait instead of failing with
+    "database is locked". PostgreSQL gets a sized QueuePool with pre-ping,
+    recycling and a server-side statement timeout.
+    """
+    from sqlalchemy import create_engine, event
+
+    if url.startswith("sqlite"):
+        options = {"connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+        if ":memory:" not in url and url.rstrip("/") != "sqlite:":
+            options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+        options.update(kwargs)
+        engine = create_engine(url, **options)
+        event.listen(engine, "connect", _apply_sqlite_pragmas)
+        _engines.add(engine)
+        return engine
+
+    connect_args = {}
+    if url.startswith("postgresql"):
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    options = dict(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        connect_args=connect_args,
+    )
+    options.update(kwargs)
+    engine = create_engine(url, **options)
+    _engines.add(engine)
+    return engine
+
+
+def to_async_url(url: str) -> str:
+    """Map a sync SQLAlchemy URL to its async driver (aiosqlite / asyncpg)."""
+    scheme, sep, rest = url.partition("://")
+    dialect = scheme.split("+", 1)[0]
+    if dialect == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if dialect in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    return url
+
+
+def create_async_sqlalchemy_engine(url: str = DEFAULT_SQLALCHEMY_URL, **kwargs):
+    """Async counterpart of create_sqlalchemy_engine with the same tuning.
+
+    Requires aiosqlite for SQLite and asyncpg for PostgreSQL.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+    async_url = to_async_url(url)
+    if async_url.startswith("sqlite"):
+        options = {"connect_args": {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+        if ":memory:" not in async_url:
+            # aiosqlite defaults to NullPool, which reconnects (and re-runs pragmas) per session
+            options.update(poolclass=AsyncAdaptedQueuePool, pool_size=DB_POOL_SIZE,
+                           max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+        options.update(kwargs)
+        engine = create_async_engine(async_url, **options)
+        event.listen(engine.sync_engine, "connect", _apply_sqlite_pragmas)
+        _engines.add(engine.sync_engine)
+        return engine
+
+    connect_args = {}
+    if async_url.startswith("postgresql+asyncpg"):
+        connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+    options = dict(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        connect_args=connect_args,
+    )
+    options.update(kwargs)
+    engine = create_async_engine(async_url, **options)
+    _engines.add(engine.sync_engine)
+    return engine
+
+
 # Example tiny helpers (no external calls unless clients configured):
 
-def get_architecture_status() -> dict:
-    """Return a status dictionary indicating which layers are configured."""
-    return {
+def _probe(check) -> dict:
+    started = time.perf_counter()
+    try:
+        check()
+        return {"healthy": True, "latency_ms": round((time.perf_counter() - started) * 1000, 3)}
+    except Exception as exc:
+        return {"healthy": False, "latency_ms": round((time.perf_counter() - started) * 1000, 3), "error": f"{type(exc).__name__}: {exc}"[:300]}
+
+
+def check_backends(engine=None) -> dict:
+    """Ping each configured backend and report health and round-trip latency."""
+    results = {}
+    if engine is not None:
+        def relational():
+            from sqlalchemy import text
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        results["relational"] = _probe(relational)
+    influx = get_influx_client()
+    if influx is not None:
+        def influx_ping():
+            if not influx.ping():
+                raise ConnectionError("ping failed")
+        results["time_series"] = _probe(influx_ping)
+    else:
+        def local_timeseries():
+            get_timeseries_backend().query_rollups("1h", equipmentid="__health__")
+        results["time_series"] = _probe(local_timeseries)
+    minio = get_minio_client()
+    if minio is not None:
+        results["file_storage"] = _probe(lambda: minio.bucket_exists(MINIO_BUCKET) if MINIO_BUCKET else minio.list_buckets())
+    else:
+        results["file_storage"] = _probe(lambda: get_object_store().size("0" * 64))
+    neo4j = get_neo4j_driver()
+    if neo4j is not None:
+        results["graph"] = _probe(neo4j.verify_connectivity)
+    return results
+
+
+def get_architecture_status(engine=None, check: bool = False) -> dict:
+    """Return which layers are configured; with `check`, also probe their health and latency."""
+    status = {
         "relational": True,  # SQLite (or PostgreSQL if env provided)
         "time_series_configured": bool(INFLUX_TOKEN and INFLUX_URL),
+        "time_series_backend": "influxdb" if (INFLUX_TOKEN and INFLUX_URL and INFLUX_BUCKET) else "local",
         "file_storage_configured": bool(MINIO_ACCESS_KEY and MINIO_SECRET_KEY and MINIO_ENDPOINT),
+        "file_storage_backend": "minio" if (MINIO_ACCESS_KEY and MINIO_SECRET_KEY and MINIO_ENDPOINT and MINIO_BUCKET) else "local",
         "graph_configured": bool(NEO4J_URI and NEO4J_USER and NEO4J_PASSWORD),
     }
+    if check:
+        status["health"] = check_backends(engine)
+    return status
 
@@ -0,0 +1,91 @@
+"""
+Streaming NDJSON/CSV export of trace tables.
+
+Rows are read as plain tuples with yield_per (a server-side cursor on
+PostgreSQL) and encoded straight into output chunks, optionally gzip
+compressed on the fly. No ORM objects or Pydantic models are built, and only
+one chunk of output is held at a time, so memory stays flat regardless of how
+many rows are exported.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Callable, Iterable, Iterator, Optional
+
+EXPORT_YIELD_PER = 1000
+# Flush encoded output to the client in chunks of roughly this many bytes
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def iter_rows(engine, stmt, transform: Optional[Callable] = None) -> Iterator[tuple]:
+    """Stream result rows of `stmt` on a dedicated connection.
+
+    `transform(conn, rows)` may rewrite each partition of EXPORT_YIELD_PER
+    rows, e.g. to join in data with one extra query per partition.
+    """
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_YIELD_PER).execute(stmt)
+        for partition in result.partitions():
+            yield from (transform(conn, partition) if transform else partition)
+
+
+def ndjson_chunks(columns: Iterable[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+    columns = list(columns)
+    buffer = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(columns, row)), default=_json_default, ensure_ascii=False) + "\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(buffer).encode("utf-8")
+            buffer.clear()
+            size = 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def csv_chunks(columns: Iterable[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([
+            json.dumps(v, default=_json_default, ensure_ascii=False) if isinstance(v, (list, dict))
+            else v.isoformat() if isinstance(v, datetime)
+            else v
+            for v in row
+        ])
+        if out.tell() >= EXPORT_CHUNK_BYTES:
+            yield out.getvalue().encode("utf-8")
+            out.seek(0)
+            out.truncate()
+    if out.tell():
+        yield out.getvalue().encode("utf-8")
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(engine, stmt, columns: Iterable[str], fmt: str = "ndjson", gzip: bool = False,
+                  transform: Optional[Callable] = None) -> Iterator[bytes]:
+    rows = iter_rows(engine, stmt, transform)
+    chunks = csv_chunks(columns, rows) if fmt == "csv" else ndjson_chunks(columns, rows)
+    return gzip_chunks(chunks) if gzip else chunks
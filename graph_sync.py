@@ -0,0 +1,485 @@
+"""
+Outbox-based synchronization of BatchTraceRelation into the graph store
+(Section 6.2.1 step 4).
+
+Request handlers call enqueue() inside the transaction that changes the
+relation, so a committed relation always has a committed outbox row and no
+network call happens on the write path. GraphSyncWorker drains pending rows
+in outboxid order on a background thread:
+
+- a batch is claimed before it is applied: one UPDATE sets claimedby /
+  claimeduntil on unclaimed pending rows (the candidate SELECT uses
+  FOR UPDATE SKIP LOCKED on PostgreSQL; SQLite serializes writers), so two
+  drainers never hold the same row. A claim expires after
+  GRAPH_SYNC_LEASE_SECONDS, which lets another drainer pick up the rows of
+  one that died mid-batch;
+- a batch is collapsed to the newest event per relationid and written with
+  one UNWIND query per operation;
+- every graph edge stores the outboxid it was written from as `version`, and
+  a write only lands if its version is newer than every edge with that
+  relationid. A delete leaves a tombstone (r.deleted = true with its
+  version) instead of removing the edge, so a stale upsert delivered after
+  it (an expired claim re-run, a requeued row) cannot bring the edge back.
+  Tombstones older than every unprocessed outbox row are removed by the
+  hourly purge;
+- connection-level failures (sink unreachable) release the claim and back
+  off exponentially without counting an attempt. Other failures retry the
+  batch one relation at a time, so one bad event does not use up the
+  attempts of the rest; rows that fail GRAPH_SYNC_MAX_ATTEMPTS times are left
+  in place, reported as dead, and `python manage.py graph-requeue` puts them
+  back in the queue.
+
+Exactly one process drains (see drains_in_app()); the claims make a second
+one harmless but it only adds polling load.
+
+Graph model: (:TraceCode {tracecode})-[:USED_IN {relationid, ...}]->(:TraceCode).
+Queries against the graph skip edges with r.deleted = true.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from models import GraphOutbox
+from traceability import chunked
+
+logger = logging.getLogger(__name__)
+
+GRAPH_SYNC_SINK = os.getenv("GRAPH_SYNC_SINK", "")  # "", "neo4j" or "memory"; "" = neo4j when configured
+GRAPH_SYNC_BATCH_SIZE = int(os.getenv("GRAPH_SYNC_BATCH_SIZE", "500"))
+GRAPH_SYNC_POLL_SECONDS = float(os.getenv("GRAPH_SYNC_POLL_SECONDS", "1.0"))
+GRAPH_SYNC_MAX_ATTEMPTS = int(os.getenv("GRAPH_SYNC_MAX_ATTEMPTS", "10"))
+GRAPH_SYNC_MAX_BACKOFF_SECONDS = float(os.getenv("GRAPH_SYNC_MAX_BACKOFF_SECONDS", "60"))
+# A claimed batch not finished within this long is claimable again
+GRAPH_SYNC_LEASE_SECONDS = float(os.getenv("GRAPH_SYNC_LEASE_SECONDS", "300"))
+# Processed outbox rows are purged after this long
+GRAPH_SYNC_RETENTION_HOURS = float(os.getenv("GRAPH_SYNC_RETENTION_HOURS", "24"))
+
+RELATION_FIELDS = (
+    "relationid", "productbatchno", "producttracecode", "materialtracecode", "equipmentid",
+    "processschemeid", "inspectionpersonid", "inspectiontime", "relationstage", "relationstatus",
+)
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def relation_payload(relation) -> dict:
+    """Relation columns as JSON-safe values, from an ORM object or a dict."""
+    get = relation.get if isinstance(relation, dict) else lambda f: getattr(relation, f)
+    return {f: _plain(get(f)) for f in RELATION_FIELDS}
+
+
+def enqueue(db: Session, operation: str, relations: Sequence[object]) -> int:
+    """Add outbox rows for `relations` to the caller's transaction (no commit)."""
+    now = datetime.now(timezone.utc)
+    rows = [
+        {
+            "idempotencykey": uuid.uuid4().hex,
+            "relationid": payload["relationid"],
+            "operation": operation,
+            "payload": payload,
+            "createdtime": now,
+            "attempts": 0,
+        }
+        for payload in map(relation_payload, relations)
+    ]
+    if rows:
+        db.execute(insert(GraphOutbox), rows)
+    return len(rows)
+
+
+# Errors meaning the sink is unreachable rather than that it rejected the data; neo4j driver
+# classes are matched by name so this module does not import the driver
+TRANSIENT_ERRORS = {"ServiceUnavailable", "SessionExpired", "TransientError"}
+
+
+def is_transient(exc: BaseException) -> bool:
+    return isinstance(exc, (OSError, TimeoutError)) or any(c.__name__ in TRANSIENT_ERRORS for c in type(exc).__mro__)
+
+
+class GraphSink(ABC):
+    """Target of the sync. Rows carry relationid, version, eventkey and props (the relation's columns)."""
+
+    @abstractmethod
+    def apply(self, upserts: List[dict], deletes: List[dict]) -> None:
+        ...
+
+    @abstractmethod
+    def purge_tombstones(self, below_version: int) -> int:
+        """Remove delete tombstones older than `below_version`; return how many."""
+
+
+class Neo4jGraphSink(GraphSink):
+    # Skip events not newer than any edge with the relationid (live or tombstone), then
+    # MERGE and check again: a concurrent transaction may have written the edge meanwhile
+    _NEWER = (
+        "UNWIND $rows AS row "
+        "OPTIONAL MATCH ()-[old:USED_IN {relationid: row.relationid}]->() "
+        "WITH row, max(old.version) AS current WHERE coalesce(current, 0) < row.version "
+        "MERGE (m:TraceCode {tracecode: row.props.materialtracecode}) "
+        "MERGE (p:TraceCode {tracecode: row.props.producttracecode}) "
+        "MERGE (m)-[r:USED_IN {relationid: row.relationid}]->(p) "
+        "WITH r, row WHERE coalesce(r.version, 0) < row.version "
+    )
+    UPSERT = _NEWER + "SET r += row.props, r.deleted = false, r.version = row.version, r.eventkey = row.eventkey"
+    DELETE = _NEWER + "SET r.deleted = true, r.version = row.version, r.eventkey = row.eventkey"
+    PURGE = (
+        "MATCH ()-[r:USED_IN]->() WHERE r.deleted AND r.version < $below "
+        "DELETE r RETURN count(r) AS purged"
+    )
+
+    # MERGE on :TraceCode and the relationid lookups above need these to avoid label / relationship
+    # scans; the uniqueness constraint also stops concurrent MERGEs from creating duplicate nodes
+    SCHEMA = (
+        "CREATE CONSTRAINT tracecode_unique IF NOT EXISTS FOR (t:TraceCode) REQUIRE t.tracecode IS UNIQUE",
+        "CREATE INDEX used_in_relationid IF NOT EXISTS FOR ()-[r:USED_IN]-() ON (r.relationid)",
+    )
+
+    def __init__(self, driver, database: Optional[str] = None):
+        self.driver = driver
+        self.database = database
+        self._schema_ready = False
+
+    def ensure_schema(self) -> None:
+        """Create the constraint and index (idempotent); runs once per sink, before the first write."""
+        if self._schema_ready:
+            return
+        with self.driver.session(database=self.database) as session:
+            for statement in self.SCHEMA:
+                session.run(statement).consume()
+        self._schema_ready = True
+
+    def apply(self, upserts: List[dict], deletes: List[dict]) -> None:
+        self.ensure_schema()
+
+        def work(tx):
+            if upserts:
+                tx.run(self.UPSERT, rows=upserts).consume()
+            if deletes:
+                tx.run(self.DELETE, rows=deletes).consume()
+
+        with self.driver.session(database=self.database) as session:
+            session.execute_write(work)
+
+    def purge_tombstones(self, below_version: int) -> int:
+        self.ensure_schema()
+        with self.driver.session(database=self.database) as session:
+            return session.execute_write(lambda tx: tx.run(self.PURGE, below=below_version).single()["purged"])
+
+
+class InMemoryGraphSink(GraphSink):
+    """Same semantics as Neo4jGraphSink, for local runs and tests."""
+
+    def __init__(self):
+        self.edges: Dict[str, dict] = {}
+        self.nodes = set()
+        self.applied_keys = set()
+        self.fail_next = 0  # inject failures to exercise retries
+        self._lock = threading.Lock()
+
+    def apply(self, upserts: List[dict], deletes: List[dict]) -> None:
+        with self._lock:
+            if self.fail_next:
+                self.fail_next -= 1
+                raise ConnectionError("injected graph failure")
+            for rows, deleted in ((upserts, False), (deletes, True)):
+                for row in rows:
+                    edge = self.edges.get(row["relationid"])
+                    if edge is not None and edge["version"] >= row["version"]:
+                        continue
+                    props = row["props"]
+                    self.nodes.update((props["materialtracecode"], props["producttracecode"]))
+                    self.edges[row["relationid"]] = {
+                        **props, "deleted": deleted, "version": row["version"], "eventkey": row["eventkey"],
+                    }
+                    self.applied_keys.add(row["eventkey"])
+
+    def purge_tombstones(self, below_version: int) -> int:
+        with self._lock:
+            purged = [k for k, e in self.edges.items() if e["deleted"] and e["version"] < below_version]
+            for key in purged:
+                del self.edges[key]
+            return len(purged)
+
+    def downstream(self, tracecode: str) -> List[str]:
+        return [e["producttracecode"] for e in self.edges.values()
+                if e["materialtracecode"] == tracecode and not e["deleted"]]
+
+
+class GraphSyncWorker:
+    def __init__(self, session_factory, sink: GraphSink, batch_size: int = GRAPH_SYNC_BATCH_SIZE,
+                 poll_interval: float = GRAPH_SYNC_POLL_SECONDS, max_attempts: int = GRAPH_SYNC_MAX_ATTEMPTS):
+        self.session_factory = session_factory
+        self.sink = sink
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.worker_id = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._failures_in_a_row = 0
+        self._last_purge = 0.0
+        self.started_at: Optional[float] = None
+        self.events_synced = 0
+        self.events_collapsed = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_batch_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    def claim(self, db: Session) -> list:
+        """Lease the next batch of pending rows to this worker; return them in outboxid order."""
+        now = datetime.now(timezone.utc)
+        claimable = (
+            GraphOutbox.processedtime.is_(None),
+            GraphOutbox.attempts < self.max_attempts,
+            or_(GraphOutbox.claimeduntil.is_(None), GraphOutbox.claimeduntil < now),
+        )
+        candidates = (
+            select(GraphOutbox.outboxid).where(*claimable).order_by(GraphOutbox.outboxid)
+            .limit(self.batch_size).with_for_update(skip_locked=True)
+        )
+        # The conditions are repeated on the UPDATE: a row claimed by another worker since is not taken
+        rows = db.execute(
+            update(GraphOutbox).where(GraphOutbox.outboxid.in_(candidates), *claimable)
+            .values(claimedby=self.worker_id, claimeduntil=now + timedelta(seconds=GRAPH_SYNC_LEASE_SECONDS))
+            .returning(GraphOutbox.outboxid, GraphOutbox.idempotencykey, GraphOutbox.relationid,
+                       GraphOutbox.operation, GraphOutbox.payload)
+        ).all()
+        db.commit()
+        return sorted(rows, key=lambda row: row.outboxid)
+
+    def _apply(self, rows: Sequence[tuple]) -> None:
+        upserts, deletes = [], []
+        for row in rows:
+            event = {"relationid": row.relationid, "version": row.outboxid, "eventkey": row.idempotencykey,
+                     "props": row.payload}
+            (deletes if row.operation == "delete" else upserts).append(event)
+        self.sink.apply(upserts, deletes)
+
+    def _update(self, db: Session, ids: Sequence[int], **values) -> None:
+        for chunk in chunked(ids):
+            db.execute(update(GraphOutbox).where(GraphOutbox.outboxid.in_(chunk)).values(**values))
+        db.commit()
+
+    def _failed(self, exc: Exception, rows: int) -> str:
+        self.failures += 1
+        self.last_error = f"{type(exc).__name__}: {exc}"
+        logger.warning("graph sync failed (%s rows): %s", rows, self.last_error)
+        return self.last_error[:1000]
+
+    def run_once(self) -> int:
+        """Sync one batch; return the number of outbox rows handled (0 when idle).
+
+        A connection-level failure releases the claim without counting an
+        attempt and is re-raised so the loop backs off. Any other failure
+        retries the batch one relation at a time, so only the events the
+        sink rejects count an attempt (and end up dead).
+        """
+        with self.session_factory() as db:
+            rows = self.claim(db)
+            if not rows:
+                return 0
+            latest: Dict[str, tuple] = {}
+            ids_by_relation: Dict[str, List[int]] = defaultdict(list)
+            for row in rows:
+                latest[row.relationid] = row  # ordered by outboxid: last one wins
+                ids_by_relation[row.relationid].append(row.outboxid)
+            ids = [row.outboxid for row in rows]
+
+            started = time.perf_counter()
+            try:
+                self._apply(list(latest.values()))
+                done, failed, applied, stopped = ids, [], len(latest), None
+            except Exception as exc:
+                self._failed(exc, len(ids))
+                if is_transient(exc):
+                    done, failed, applied, stopped = [], [], 0, exc
+                else:
+                    done, failed, applied, stopped = self._apply_one_by_one(db, latest, ids_by_relation)
+                    if not done and stopped is None:
+                        stopped = exc  # nothing got through: back off as for a connection error
+            elapsed = time.perf_counter() - started
+            self._update(db, done, processedtime=datetime.now(timezone.utc))
+            if stopped is not None:
+                handled = set(done) | set(failed)
+                self._update(db, [i for i in ids if i not in handled], claimedby=None, claimeduntil=None)
+
+        self._failures_in_a_row = 0 if stopped is None else self._failures_in_a_row + 1
+        self.batches += 1
+        self.events_synced += len(done)
+        self.events_collapsed += len(done) - applied
+        self.last_batch_seconds = elapsed
+        self.busy_seconds += elapsed
+        if stopped is not None:
+            raise stopped
+        return len(done) + len(failed)
+
+    def _apply_one_by_one(self, db: Session, latest: Dict[str, tuple], ids_by_relation: Dict[str, List[int]]):
+        """Retry a failed batch per relation; only the rejected events count an attempt."""
+        done, failed, applied = [], [], 0
+        for relationid, row in latest.items():
+            try:
+                self._apply([row])
+            except Exception as exc:
+                if is_transient(exc):
+                    self._failed(exc, 1)
+                    return done, failed, applied, exc
+                self._update(db, ids_by_relation[relationid], attempts=GraphOutbox.attempts + 1,
+                             lasterror=self._failed(exc, 1), claimedby=None, claimeduntil=None)
+                failed.extend(ids_by_relation[relationid])
+            else:
+                done.extend(ids_by_relation[relationid])
+                applied += 1
+        return done, failed, applied, None
+
+    def drain(self) -> int:
+        """Sync until nothing is pending (used by tests, scripts and benchmarks)."""
+        total = 0
+        while True:
+            handled = self.run_once()
+            if not handled:
+                return total
+            total += handled
+
+    def purge_processed(self) -> int:
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=GRAPH_SYNC_RETENTION_HOURS)
+        with self.session_factory() as db:
+            newest = db.execute(select(func.max(GraphOutbox.outboxid))).scalar()
+            if newest is None:
+                return 0
+            # The newest row is kept so SQLite never reuses an outboxid: versions must keep growing
+            result = db.execute(
+                delete(GraphOutbox).where(GraphOutbox.processedtime < cutoff, GraphOutbox.outboxid < newest)
+            )
+            db.commit()
+            # A tombstone can go once no unprocessed event (pending, claimed or dead) is older than it
+            oldest_open = db.execute(
+                select(func.min(GraphOutbox.outboxid)).where(GraphOutbox.processedtime.is_(None))
+            ).scalar()
+        self.sink.purge_tombstones(oldest_open if oldest_open is not None else newest + 1)
+        return result.rowcount
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                handled = self.run_once()
+            except Exception:
+                backoff = min(GRAPH_SYNC_MAX_BACKOFF_SECONDS, self.poll_interval * 2 ** self._failures_in_a_row)
+                self._stop.wait(backoff)
+                continue
+            if time.time() - self._last_purge > 3600:
+                self._last_purge = time.time()
+                try:
+                    self.purge_processed()
+                except Exception:
+                    logger.exception("graph outbox purge failed")
+            if handled < self.batch_size:
+                self._stop.wait(self.poll_interval)
+
+    def run(self) -> None:
+        """Drain in the calling thread until stop() (python manage.py graph-sync)."""
+        self._stop.clear()
+        self.started_at = time.time()
+        self._loop()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._loop, name="graph-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def status(self) -> dict:
+        uptime = time.time() - self.started_at if self.started_at else None
+        return {
+            "sink": type(self.sink).__name__,
+            "running": self._thread is not None and self._thread.is_alive(),
+            **outbox_status(self.session_factory, self.max_attempts),
+            "events_synced": self.events_synced,
+            "events_collapsed": self.events_collapsed,
+            "batches": self.batches,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_batch_ms": round(self.last_batch_seconds * 1000, 3),
+            "throughput_per_s": round(self.events_synced / uptime, 1) if uptime else None,
+            "sink_throughput_per_s": round(self.events_synced / self.busy_seconds, 1) if self.busy_seconds else None,
+        }
+
+
+def outbox_status(session_factory, max_attempts: int = GRAPH_SYNC_MAX_ATTEMPTS) -> dict:
+    """Backlog, dead events and lag, read from the outbox (works in processes that do not drain)."""
+    with session_factory() as db:
+        pending, oldest = db.execute(
+            select(func.count(), func.min(GraphOutbox.createdtime))
+            .where(GraphOutbox.processedtime.is_(None), GraphOutbox.attempts < max_attempts)
+        ).one()
+        dead = db.execute(
+            select(func.count()).where(GraphOutbox.processedtime.is_(None), GraphOutbox.attempts >= max_attempts)
+        ).scalar_one()
+    lag = None
+    if oldest is not None:
+        if oldest.tzinfo is None:
+            oldest = oldest.replace(tzinfo=timezone.utc)
+        lag = round((datetime.now(timezone.utc) - oldest).total_seconds(), 3)
+    return {"pending": pending, "dead": dead, "lag_seconds": lag}
+
+
+def requeue_dead(session_factory, max_attempts: int = GRAPH_SYNC_MAX_ATTEMPTS) -> int:
+    """Give dead rows (GRAPH_SYNC_MAX_ATTEMPTS failures) a fresh set of attempts; return how many.
+
+    Safe at any time: a requeued event older than what the graph holds for
+    its relationid is ignored by the version check.
+    """
+    with session_factory() as db:
+        result = db.execute(
+            update(GraphOutbox)
+            .where(GraphOutbox.processedtime.is_(None), GraphOutbox.attempts >= max_attempts)
+            .values(attempts=0, lasterror=None, claimedby=None, claimeduntil=None)
+        )
+        db.commit()
+        return result.rowcount
+
+
+def drains_in_app() -> bool:
+    """Whether the process serving the app runs the drainer (GRAPH_SYNC_WORKER, default 1).
+
+    Read at call time: serve.py drains in its supervisor and sets
+    GRAPH_SYNC_WORKER=0 for the workers it starts, which then only enqueue.
+    With GRAPH_SYNC_WORKER=0 everywhere, run `python manage.py graph-sync` as
+    the one drainer (e.g. next to gunicorn).
+    """
+    return os.getenv("GRAPH_SYNC_WORKER", "1") == "1"
+
+
+def create_sink() -> Optional[GraphSink]:
+    """Neo4j when configured (or GRAPH_SYNC_SINK=neo4j), memory when asked for, else None."""
+    if GRAPH_SYNC_SINK == "memory":
+        return InMemoryGraphSink()
+    from db_clients import get_neo4j_driver
+
+    driver = get_neo4j_driver() if GRAPH_SYNC_SINK in ("", "neo4j") else None
+    return Neo4jGraphSink(driver) if driver is not None else None
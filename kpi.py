@@ -0,0 +1,226 @@
+"""
+Quality and supply KPIs from summary tables.
+
+Three tables hold running totals per group:
+
+- kpistock: units and remaining quantity per (tracestatus, storagelocation)
+- kpiwarning: warnings per (handlestatus, risklevel, risktype); "open" means
+  handlestatus != 'Closed'
+- kpisupplierwarning: warnings on raw material units (warningobject
+  'Raw Material', objectid = tracecode) per supplier of that unit
+
+Write paths call add_materials / remove_materials / move_stock / add_warnings
+/ remove_warnings inside their own transaction, so the totals commit or roll
+back with the rows they describe. Deltas are aggregated per group in Python
+and applied with one upsert per table (ON CONFLICT ... SET n = n + excluded.n
+on SQLite and PostgreSQL), in key order so concurrent writers lock summary
+rows in the same order. Reads touch one row per group.
+
+Rows moved to the archive tables (archive.py) stay counted: archiving
+changes no totals, warnings are attributed through either tier of units, and
+rebuild() reads both tiers.
+
+Writers that bypass these helpers (datagen, manual SQL) leave the totals
+stale; rebuild() recomputes everything from the base tables:
+
+    python manage.py rebuild-kpis --url sqlite:///./app.db
+"""
+import time
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Sequence, Tuple
+
+from sqlalchemy import case, delete, func, insert, select, union_all, update
+from sqlalchemy.orm import Session
+
+from models import (KpiStock, KpiSupplierWarning, KpiWarning, QualityRiskWarning, QualityRiskWarningArchive, RawMaterialTraceArchive,
+                    RawMaterialTraceRecord)
+from traceability import chunked
+
+def _getter(row):
+    return row.get if isinstance(row, dict) else lambda f: getattr(row, f)
+
+
+def _qty(value) -> Decimal:
+    return Decimal(str(value or 0)).quantize(Decimal("0.01"))
+
+
+def _apply(db: Session, model, deltas: Dict[Tuple, Tuple]) -> None:
+    """Add `deltas` ({primary key: value deltas}) to the summary rows of `model`, creating missing rows."""
+    table = model.__table__
+    keys = [c.name for c in table.primary_key.columns]
+    values = [c.name for c in table.columns if not c.primary_key]
+    rows = [dict(zip(keys + values, key + delta)) for key, delta in sorted(deltas.items()) if any(delta)]
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        # Imported here: the postgresql dialect package is slow to import and unused on SQLite
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        stmt = upsert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys, set_={v: table.c[v] + stmt.excluded[v] for v in values}
+        )
+        db.execute(stmt, rows)
+        return
+    for row in rows:
+        match = [table.c[k] == row[k] for k in keys]
+        result = db.execute(update(table).where(*match).values({v: table.c[v] + row[v] for v in values}))
+        if not result.rowcount:
+            db.execute(insert(table).values(row))
+
+
+def _supplier_deltas(db: Session, warnings: Sequence[object], sign: int) -> Dict[Tuple, Tuple]:
+    """Per-supplier deltas for raw material warnings, resolving each objectid to its unit's supplier."""
+    by_object: Dict[str, list] = defaultdict(list)
+    for warning in warnings:
+        get = _getter(warning)
+        if get("warningobject") == "Raw Material":
+            by_object[get("objectid")].append(get("handlestatus") != "Closed")
+    deltas: Dict[Tuple, list] = defaultdict(lambda: [0, 0])
+    for chunk in chunked(list(by_object)):
+        # A tracecode lives in exactly one tier
+        rows = [row for model in (RawMaterialTraceRecord, RawMaterialTraceArchive) for row in db.execute(
+            select(model.tracecode, model.supplierid).where(model.tracecode.in_(chunk))
+        )]
+        for tracecode, supplierid in rows:
+            for is_open in by_object[tracecode]:
+                deltas[(supplierid,)][0] += sign
+                deltas[(supplierid,)][1] += sign if is_open else 0
+    return {key: tuple(delta) for key, delta in deltas.items()}
+
+
+def _material_deltas(db: Session, materials: Sequence[object], sign: int) -> None:
+    stock: Dict[Tuple, list] = defaultdict(lambda: [0, Decimal("0")])
+    suppliers: Dict[str, str] = {}
+    for material in materials:
+        get = _getter(material)
+        delta = stock[(get("tracestatus"), get("storagelocation"))]
+        delta[0] += sign
+        delta[1] += sign * _qty(get("remainingqty"))
+        suppliers[get("tracecode")] = get("supplierid")
+
+    # Warnings raised against these units count toward their supplier while the unit exists
+    deltas: Dict[Tuple, list] = defaultdict(lambda: [0, 0])
+    for chunk in chunked(list(suppliers)):
+        rows = [row for model in (QualityRiskWarning, QualityRiskWarningArchive) for row in db.execute(
+            select(model.objectid, model.handlestatus != "Closed")
+            .where(model.warningobject == "Raw Material", model.objectid.in_(chunk))
+        )]
+        for objectid, is_open in rows:
+            delta = deltas[(suppliers[objectid],)]
+            delta[0] += sign
+            delta[1] += sign if is_open else 0
+    # Reads first: on SQLite the first upsert takes the write lock, which is then held until commit
+    _apply(db, KpiStock, {key: tuple(delta) for key, delta in stock.items()})
+    _apply(db, KpiSupplierWarning, {key: tuple(delta) for key, delta in deltas.items()})
+
+
+def add_materials(db: Session, materials: Sequence[object]) -> None:
+    """Count newly inserted raw material units (ORM objects or row dicts); no commit."""
+    _material_deltas(db, materials, 1)
+
+
+def remove_materials(db: Session, materials: Sequence[object]) -> None:
+    _material_deltas(db, materials, -1)
+
+
+def move_stock(db: Session, storagelocation: str, old_status: str, old_qty, new_status: str, new_qty) -> None:
+    """Account for one unit changing status and/or remaining quantity (e.g. a consumption)."""
+    deltas: Dict[Tuple, list] = defaultdict(lambda: [0, Decimal("0")])
+    deltas[(old_status, storagelocation)][0] -= 1
+    deltas[(old_status, storagelocation)][1] -= _qty(old_qty)
+    deltas[(new_status, storagelocation)][0] += 1
+    deltas[(new_status, storagelocation)][1] += _qty(new_qty)
+    _apply(db, KpiStock, {key: tuple(delta) for key, delta in deltas.items()})
+
+
+def _warning_deltas(db: Session, warnings: Sequence[object], sign: int) -> None:
+    counts: Dict[Tuple, int] = defaultdict(int)
+    for warning in warnings:
+        get = _getter(warning)
+        counts[(get("handlestatus"), get("risklevel"), get("risktype"))] += sign
+    suppliers = _supplier_deltas(db, warnings, sign)
+    _apply(db, KpiWarning, {key: (count,) for key, count in counts.items()})
+    _apply(db, KpiSupplierWarning, suppliers)
+
+
+def add_warnings(db: Session, warnings: Sequence[object]) -> None:
+    """Count newly inserted warnings (ORM objects or row dicts); no commit."""
+    _warning_deltas(db, warnings, 1)
+
+
+def remove_warnings(db: Session, warnings: Sequence[object]) -> None:
+    _warning_deltas(db, warnings, -1)
+
+
+def rebuild(db: Session) -> dict:
+    """Recompute all summary tables from the base tables (hot and archive) in one transaction."""
+    started = time.perf_counter()
+    materials = union_all(*(
+        select(m.tracecode, m.supplierid, m.tracestatus, m.storagelocation, m.remainingqty)
+        for m in (RawMaterialTraceRecord, RawMaterialTraceArchive)
+    )).subquery()
+    warnings = union_all(*(
+        select(w.warningobject, w.objectid, w.risklevel, w.risktype, w.handlestatus)
+        for w in (QualityRiskWarning, QualityRiskWarningArchive)
+    )).subquery()
+    material, warning = materials.c, warnings.c
+    for model in (KpiStock, KpiWarning, KpiSupplierWarning):
+        db.execute(delete(model))
+    db.execute(insert(KpiStock).from_select(
+        ["tracestatus", "storagelocation", "itemcount", "remainingqty"],
+        select(material.tracestatus, material.storagelocation, func.count(), func.coalesce(func.sum(material.remainingqty), 0))
+        .group_by(material.tracestatus, material.storagelocation),
+    ))
+    db.execute(insert(KpiWarning).from_select(
+        ["handlestatus", "risklevel", "risktype", "warningcount"],
+        select(warning.handlestatus, warning.risklevel, warning.risktype, func.count())
+        .group_by(warning.handlestatus, warning.risklevel, warning.risktype),
+    ))
+    db.execute(insert(KpiSupplierWarning).from_select(
+        ["supplierid", "warningcount", "openwarningcount"],
+        select(material.supplierid, func.count(), func.sum(case((warning.handlestatus != "Closed", 1), else_=0)))
+        .select_from(warnings)
+        .join(materials, material.tracecode == warning.objectid)
+        .where(warning.warningobject == "Raw Material")
+        .group_by(material.supplierid),
+    ))
+    db.commit()
+    groups = {model.__tablename__: db.scalar(select(func.count()).select_from(model)) for model in (KpiStock, KpiWarning, KpiSupplierWarning)}
+    return {"groups": groups, "seconds": round(time.perf_counter() - started, 3)}
+
+
+# Read queries: each scans the summary rows only
+
+def warnings_query(open_only: bool = True):
+    stmt = select(KpiWarning.risklevel, KpiWarning.risktype, func.sum(KpiWarning.warningcount).label("count"))
+    if open_only:
+        stmt = stmt.where(KpiWarning.handlestatus != "Closed")
+    return (
+        stmt.group_by(KpiWarning.risklevel, KpiWarning.risktype)
+        .having(func.sum(KpiWarning.warningcount) > 0)
+        .order_by(KpiWarning.risklevel.desc(), KpiWarning.risktype)
+    )
+
+
+def stock_query(tracestatus: str = None):
+    stmt = select(KpiStock.tracestatus, KpiStock.storagelocation, KpiStock.itemcount.label("count"), KpiStock.remainingqty)
+    if tracestatus:
+        stmt = stmt.where(KpiStock.tracestatus == tracestatus)
+    return stmt.where(KpiStock.itemcount > 0).order_by(KpiStock.tracestatus, KpiStock.storagelocation)
+
+
+def supplier_warnings_query(limit: int = 100, open_only: bool = False):
+    count = KpiSupplierWarning.openwarningcount if open_only else KpiSupplierWarning.warningcount
+    return (
+        select(KpiSupplierWarning.supplierid, KpiSupplierWarning.warningcount.label("warnings"),
+               KpiSupplierWarning.openwarningcount.label("open_warnings"))
+        .where(count > 0)
+        .order_by(count.desc(), KpiSupplierWarning.supplierid)
+        .limit(limit)
+    )
+
@@ -1,43 +1,107 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, Header
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from fastapi import FastAPI, Depends, HTTPException, Request, Header, Query, Response
+from sqlalchemy import and_, or_, event, select, update, func, case
+from sqlalchemy.orm import sessionmaker, Session, object_session
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from pydantic import BaseModel, Field
-from typing import Optional, List, Literal, Any
+from typing import Optional, List, Literal, Generic, TypeVar
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
+from contextlib import asynccontextmanager
+import base64
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+import uuid
 
 # Import models
-from models import Base, User, RawMaterialTraceRecord, BatchTraceRelation, QualityRiskWarning
+from models import User, RawMaterialTraceRecord, BatchTraceRelation, QualityRiskWarning, MaterialConsumptionRecord, Attachment
+from models import RawMaterialTraceArchive, QualityRiskWarningArchive
+import traceability
+import archive
+import attachments
+import bulk_ingest
+import exporter
+import graph_sync
+import kpi
+import manage
+import search
+import serialization
+import shared_settings
+from quality_rules import QualityRuleEngine, load_rules
+from db_clients import DEFAULT_SQLALCHEMY_URL, create_sqlalchemy_engine, create_async_sqlalchemy_engine, get_timeseries_backend, get_object_store, get_architecture_status
+from metrics import METRICS_ENABLED, Metrics, MetricsMiddleware
+from compression import COMPRESSION_ENABLED, CompressionMiddleware
+from auth_cache import Principal, TokenCache
+from password_hashing import HashingBusy, PasswordHasher
+from response_cache import ResponseCache, etag_matches, make_etag
 
-# Auth settings
-SECRET_KEY = "change-this-secret-key"
+# Auth settings. Every worker process must sign and verify with the same key,
+# so it comes from the environment (serve.py generates one per launch if unset)
+SECRET_KEY = os.getenv("SECRET_KEY")
+if not SECRET_KEY:
+    # Only usable by a single process: another worker would sign with a key of its own
+    SECRET_KEY = secrets.token_urlsafe(32)
+    logging.getLogger(__name__).warning(
+        "SECRET_KEY is not set: using a random key for this process only. Tokens end at restart and are "
+        "rejected by other workers; set SECRET_KEY (or start with serve.py) for any multi-worker deployment"
+    )
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 8
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# Login hashes on a dedicated bounded pool; cost set by PASSWORD_HASH_ROUNDS
+password_hasher = PasswordHasher()
+# Verified token -> principal cache; AUTH_CACHE_TTL_SECONDS=0 disables it
+token_cache = TokenCache(
+    maxsize=int(os.getenv("AUTH_CACHE_MAXSIZE", "10000")),
+    ttl=float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60")),
+)
 
-# Database setup (SQLite)
-SQLALCHEMY_DATABASE_URL = "sqlite:///./app.db"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+# Serialized single-record responses; RESPONSE_CACHE_TTL_SECONDS=0 disables it
+response_cache = ResponseCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_MAXSIZE", "10000")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30")),
 )
+
+# Database setup (SQLite by default; set SQLALCHEMY_DATABASE_URL for PostgreSQL)
+SQLALCHEMY_DATABASE_URL = DEFAULT_SQLALCHEMY_URL
+engine = create_sqlalchemy_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Async engine for read endpoints (aiosqlite / asyncpg); writes keep the sync session
+async_engine = create_async_sqlalchemy_engine(SQLALCHEMY_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+# Request/SQL instrumentation, exposed at /metrics
+metrics = Metrics()
+metrics.instrument_engine(engine)
+metrics.instrument_engine(async_engine.sync_engine)
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Schema and admin seed are applied at startup, not on import (see manage.py);
+# AUTO_MIGRATE=0 when `python manage.py migrate` / `seed` run as a release step
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1") == "1"
+# Substring search backend ("fts5", "pg_trgm" or "like"), detected by initialize()
+search_backend = "like"
+_initialized = False
+_initialize_lock = threading.Lock()
 
-# Seed an admin user if none exists
-with SessionLocal() as db:
-    admin = db.query(User).filter(User.username == "admin").first()
-    if not admin:
-        hashed = pwd_context.hash("admin123")
-        admin = User(username="admin", hashed_password=hashed, role="admin")
-        db.add(admin)
-        db.commit()
+def initialize() -> None:
+    """One-time startup work; called from the lifespan hook (and by scripts that drive the app directly)."""
+    global search_backend, _initialized
+    with _initialize_lock:
+        if _initialized:
+            return
+        if AUTO_MIGRATE:
+            manage.bootstrap(engine, SessionLocal, password_hasher)
+        search_backend = search.detect_backend(engine)
+        _initialized = True
+
+# Outbox worker that syncs relations into the graph store (Neo4j when configured);
+# created at startup so each worker process opens its own driver
+graph_worker = None
 
 # Dependency
 
@@ -48,6 +112,10 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # Auth schemas
 class Token(BaseModel):
     access_token: str
@@ -144,22 +212,325 @@ class QualityRiskWarningRead(BaseModel):
     class Config:
         from_attributes = True
 
-app = FastAPI()
+# Material consumption ledger (6.2.1 step 3)
+class MaterialConsumptionCreate(BaseModel):
+    tracecode: str = Field(min_length=1, max_length=36)
+    quantity: float = Field(gt=0)
+    consumedtime: Optional[datetime] = None
+    workorderid: Optional[str] = Field(default=None, max_length=32)
+    semiproducttracecode: Optional[str] = Field(default=None, max_length=36)
+    operatorid: Optional[str] = Field(default=None, max_length=20)
+
+class MaterialConsumptionRead(BaseModel):
+    consumptionid: int
+    tracecode: str
+    quantity: float
+    consumedtime: datetime
+    workorderid: Optional[str]
+    semiproducttracecode: Optional[str]
+    operatorid: Optional[str]
+    # State of the material batch after this draw
+    remainingqty: float
+    tracestatus: str
+
+# Quality rule engine (6.2.2)
+class QualityRule(BaseModel):
+    materialtype: str = Field(min_length=1, max_length=50, description="Material type, or * for any")
+    parameter: str = Field(min_length=1, max_length=50)
+    lower: Optional[float] = None
+    upper: Optional[float] = None
+    nominal: Optional[float] = None
+    tolerance: Optional[float] = Field(default=None, ge=0)
+    unit: Optional[str] = None
+    risktype: Optional[str] = Field(default=None, max_length=50)
+    handlerid: Optional[str] = Field(default=None, max_length=20)
+
+class InspectionMeasurement(BaseModel):
+    objectid: str = Field(min_length=1, max_length=32)
+    warningobject: Literal['Raw Material','Semi-Finished Product','Finished Product'] = 'Raw Material'
+    materialtype: str = Field(min_length=1, max_length=50)
+    parameter: str = Field(min_length=1, max_length=50)
+    value: float
+    inspectionid: Optional[str] = Field(default=None, max_length=32)
+    measuredtime: Optional[datetime] = None
+
+class InspectionIngestReport(BaseModel):
+    received: int
+    unmatched: int
+    violations: int
+    duplicates_suppressed: int
+    warnings_created: int
+    warningids: List[str]
+
+# Process / inspection time series
+class TimeSeriesPoint(BaseModel):
+    measurement: str = Field(min_length=1, max_length=50, description="e.g. process, inspection")
+    field: str = Field(min_length=1, max_length=50, description="Parameter name, e.g. temperature")
+    value: float
+    equipmentid: Optional[str] = Field(default=None, max_length=32)
+    tracecode: Optional[str] = Field(default=None, max_length=36)
+    time: Optional[datetime] = None
+
+class TimeSeriesRollup(BaseModel):
+    time: datetime
+    measurement: str
+    field: str
+    count: int
+    min: float
+    max: float
+    mean: float
+
+# Bulk ingest
+class BulkRowError(BaseModel):
+    index: int
+    field: Optional[str] = None
+    detail: str
+
+class BulkIngestReport(BaseModel):
+    mode: Literal['atomic','partial']
+    received: int
+    inserted: int
+    rejected: int
+    errors: List[BulkRowError]
+
+# Dashboard search: one page plus the total match count
+SearchItem = TypeVar("SearchItem")
+
+class SearchPage(BaseModel, Generic[SearchItem]):
+    total: int
+    page: int
+    page_size: int
+    items: List[SearchItem]
+
+# 5.3 Full-chain trace
+class TraceRelationRead(BatchTraceRelationRead):
+    depth: int
+
+class TraceResult(BaseModel):
+    tracecode: str
+    direction: Literal['backward','forward']
+    depth: int
+    truncated: bool
+    tracecodes: List[str]
+    relations: List[TraceRelationRead]
+    materials: List[RawMaterialTraceRead]
+    suppliers: List[str]
+
+# KPI aggregates
+class WarningKpi(BaseModel):
+    risklevel: int
+    risktype: str
+    count: int
+
+class StockKpi(BaseModel):
+    tracestatus: str
+    storagelocation: str
+    count: int
+    remainingqty: float
+
+class SupplierWarningKpi(BaseModel):
+    supplierid: str
+    warnings: int
+    open_warnings: int
+
+# Attachments (inspection reports, supplier certificates)
+AttachmentObjectType = Literal['Incoming Inspection','Supplier','Raw Material','Quality Warning']
+
+class AttachmentRead(BaseModel):
+    attachmentid: str
+    objecttype: str
+    objectid: str
+    filename: str
+    contenttype: str
+    size: int
+    sha256: str
+    uploadedby: str
+    uploadedtime: datetime
+    class Config:
+        from_attributes = True
+
+class AttachmentUploadRead(AttachmentRead):
+    # True when identical content was already stored and is shared
+    deduplicated: bool
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global graph_worker
+    await run_in_threadpool(initialize)
+    # One drainer per deployment: under serve.py (and with GRAPH_SYNC_WORKER=0) workers only enqueue
+    sink = graph_sync.create_sink() if graph_sync.drains_in_app() else None
+    if sink is not None:
+        graph_worker = graph_sync.GraphSyncWorker(SessionLocal, sink)
+        graph_worker.start()
+    settings_watcher.start()
+    yield
+    settings_watcher.stop()
+    if graph_worker is not None:
+        graph_worker.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+# gzip/br negotiated per request (compression.py); added first so metrics time the compression too
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
 
 # Mount static files and set up templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+# Jinja is only needed by the dashboard; loaded on first use
+templates = None
+
+def get_templates():
+    global templates
+    if templates is None:
+        from fastapi.templating import Jinja2Templates
+
+        templates = Jinja2Templates(directory="templates")
+    return templates
 
 @app.get("/", response_model=dict)
 async def root():
     return {"message": "Hello World"}
 
+# Keyset pagination helpers
+PAGE_SIZE_DEFAULT = 100
+PAGE_SIZE_MAX = 1000
+
+def encode_cursor(sort_value: datetime, key: str) -> str:
+    raw = json.dumps([sort_value.isoformat(), key]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        sort_value, key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(sort_value), str(key)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def keyset_page(db: AsyncSession, stmt, time_col, key_col, cursor: Optional[str], limit: int, response: Response) -> list:
+    """Return one page ordered by (time_col, key_col) descending.
+
+    The cursor holds the sort values of the last row of the previous page, so
+    the next page is an index range scan instead of an OFFSET skip. The cursor
+    for the following page is returned in the X-Next-Cursor header.
+    """
+    if cursor:
+        sort_value, key = decode_cursor(cursor)
+        stmt = stmt.where(or_(time_col < sort_value, and_(time_col == sort_value, key_col < key)))
+    rows = (await db.execute(stmt.order_by(time_col.desc(), key_col.desc()).limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(getattr(last, time_col.key), getattr(last, key_col.key))
+    return rows
+
+# Conditional GET: every read response carries a body-hash ETag; If-None-Match hits get a bodyless 304
+def json_response(request: Request, body: bytes, etag: str, headers: Optional[dict] = None) -> Response:
+    headers = {**(headers or {}), "ETag": etag}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def cached_record(request: Request, kind: str, key: str, schema, load) -> Response:
+    """Serve one record from response_cache, calling `load` (which may raise 404) on a miss."""
+    cached = response_cache.get(kind, key)
+    if cached is None:
+        generation = response_cache.generation
+        body = serialization.encode(schema, await load())
+        cached = response_cache.put(kind, key, body, generation)
+    return json_response(request, cached.body, cached.etag)
+
+def list_response(request: Request, response: Response, schema, items: list) -> Response:
+    # Rows go straight to JSON (serialization.py); response_model only documents the shape
+    body = serialization.encode_list(schema, items)
+    cursor = response.headers.get("X-Next-Cursor")
+    return json_response(request, body, make_etag(body), {"X-Next-Cursor": cursor} if cursor else None)
+
+# Server-side search (search.py): indexed substring match, sorted, page-number pagination
+SEARCH_PAGE_SIZE_MAX = 200
+
+async def search_page(db: AsyncSession, model, schema, filters: list, q: str, sort_col, key_col, order: str, page: int, page_size: int) -> tuple:
+    """Return (total, rows) for one page of `model` rows matching `q` and `filters`, with the columns of `schema`."""
+    clauses = list(filters)
+    q = q.strip()
+    if q:
+        clauses.append(search.search_condition(model, q, search_backend))
+    total = await db.scalar(select(func.count()).select_from(model).where(*clauses))
+    direction = (lambda c: c.desc()) if order == "desc" else (lambda c: c.asc())
+    stmt = (select(*serialization.columns(model, schema)).where(*clauses).order_by(direction(sort_col), direction(key_col))
+            .offset((page - 1) * page_size).limit(page_size))
+    return total, (await db.execute(stmt)).all()
+
+def search_response(schema, total: int, page: int, page_size: int, items: list) -> Response:
+    body = serialization.encode(SearchPage[schema], {"total": total, "page": page, "page_size": page_size, "items": items})
+    return Response(content=body, media_type="application/json")
+
+# usedrecords view: stored legacy entries followed by the consumption ledger
+async def with_usedrecords(db: AsyncSession, records: list) -> list:
+    """usedrecords assembled with the ledger for a page of record rows (traceability.with_usedrecords); returns dicts."""
+    return await db.run_sync(traceability.with_usedrecords, records)
+
+# Streaming export helpers
+def export_response(name: str, model, stmt, fmt: str, gzip: bool, transform=None) -> StreamingResponse:
+    """Stream `stmt` in primary-key order; the generator opens its own connection
+    because request-scoped sessions are closed before the body is streamed.
+    `transform(conn, rows)` rewrites each fetched batch of rows."""
+    table = model.__table__
+    stmt = stmt.order_by(*table.primary_key.columns)
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    filename = f"{name}.{fmt}"
+    if gzip:
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(
+        exporter.export_stream(engine, stmt, [c.name for c in table.columns], fmt, gzip, transform),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+# Bulk ingest helpers
+def bulk_request_body(schema_name: str) -> dict:
+    """OpenAPI body for bulk endpoints, which read the raw request stream."""
+    array = {"type": "array", "items": {"$ref": f"#/components/schemas/{schema_name}"}}
+    return {"requestBody": {"required": True, "content": {
+        "application/json": {"schema": array},
+        "application/x-ndjson": {"schema": {"$ref": f"#/components/schemas/{schema_name}"}},
+    }}}
+
+async def read_bulk_rows(request: Request) -> list:
+    """Read a JSON array, or an NDJSON stream parsed line by line as it arrives."""
+    content_type = request.headers.get("content-type", "")
+    try:
+        if "ndjson" in content_type or "jsonl" in content_type:
+            rows = []
+            pending = b""
+            async for chunk in request.stream():
+                *lines, pending = (pending + chunk).split(b"\n")
+                rows.extend(bulk_ingest.parse_ndjson_lines(lines))
+                if len(rows) > bulk_ingest.BULK_MAX_ROWS:
+                    break
+            rows.extend(bulk_ingest.parse_ndjson_lines([pending]))
+        else:
+            rows = bulk_ingest.parse_json_array(await request.body())
+    except bulk_ingest.BulkIngestError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if len(rows) > bulk_ingest.BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {bulk_ingest.BULK_MAX_ROWS} rows")
+    return rows
+
+def bulk_result(report: dict) -> dict:
+    if report["mode"] == "atomic" and report["rejected"]:
+        raise HTTPException(status_code=400, detail=report)
+    return report
+
 # Auth helpers
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hasher.verify_sync(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_hasher.hash_sync(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -167,10 +538,13 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)) -> Any:
+def get_current_user(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)) -> Principal:
     token = (authorization or "").replace("Bearer ", "")
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
+    principal = token_cache.get(token)
+    if principal is not None:
+        return principal
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -178,41 +552,161 @@ def get_current_user(authorization: Optional[str] = Header(None), db: Session =
             raise HTTPException(status_code=401, detail="Invalid token")
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
+    row = db.query(User.id, User.username, User.role).filter(User.username == username).first()
+    if row is None:
         raise HTTPException(status_code=401, detail="User not found")
-    return user
+    principal = Principal(id=row.id, username=row.username, role=row.role)
+    token_cache.put(token, principal, payload.get("exp"))
+    return principal
+
+# Drop cached principals when a user's role, password or name changes. The
+# flush-time drop covers the common case; the commit-time drop covers a request
+# that re-cached the old row between flush and commit.
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_cached_user(mapper, connection, target):
+    token_cache.invalidate_user(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("invalidated_user_ids", set()).add(target.id)
 
-def require_admin(user: Any = Depends(get_current_user)) -> Any:
+@event.listens_for(Session, "after_commit")
+def invalidate_committed_users(session):
+    for user_id in session.info.pop("invalidated_user_ids", ()):
+        token_cache.invalidate_user(user_id)
+
+def require_admin(user: Principal = Depends(get_current_user)) -> Principal:
     if user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin privileges required")
     return user
 
 @app.post("/auth/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = (await db.execute(select(User).where(User.username == form_data.username))).scalar_one_or_none()
+    try:
+        valid, new_hash = await password_hasher.verify_and_update(form_data.password, user.hashed_password if user else None)
+    except HashingBusy:
+        raise HTTPException(status_code=503, detail="Too many concurrent logins, retry shortly", headers={"Retry-After": "1"})
+    if not user or not valid:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
+    if new_hash:
+        # Stored hash used other parameters than PASSWORD_HASH_ROUNDS; upgrade it transparently
+        user.hashed_password = new_hash
+        await db.commit()
     access_token = create_access_token({"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/me", response_model=UserRead)
-def me(current: User = Depends(get_current_user)):
+def me(current: Principal = Depends(get_current_user)):
     return current
 
+@app.get("/auth/cache-stats", response_model=dict)
+def auth_cache_stats(_: Principal = Depends(require_admin)):
+    return token_cache.stats()
+
+@app.get("/response-cache/stats", response_model=dict)
+def response_cache_stats(_: Principal = Depends(require_admin)):
+    return response_cache.stats()
+
+# Observability
+HEALTH_CACHE_SECONDS = float(os.getenv("HEALTH_CACHE_SECONDS", "15"))
+_health = {"checked_at": 0.0, "status": None}
+
+def architecture_status() -> dict:
+    """Backend health/latency, probed at most every HEALTH_CACHE_SECONDS so scrapes stay cheap."""
+    if _health["status"] is None or time.monotonic() - _health["checked_at"] > HEALTH_CACHE_SECONDS:
+        _health["status"] = get_architecture_status(engine, check=True)
+        _health["checked_at"] = time.monotonic()
+    return _health["status"]
+
+def _stats_family(name: str, help_text: str, stats: dict, fields: tuple, kind: str = "gauge"):
+    return (name, kind, help_text, {(f,): stats[f] for f in fields}, ("stat",))
+
+@metrics.register_collector
+def _component_metrics():
+    health = architecture_status()["health"]
+    yield ("backend_up", "gauge", "1 if the backend answered its health probe.",
+           {(b,): int(h["healthy"]) for b, h in health.items()}, ("backend",))
+    yield ("backend_probe_latency_seconds", "gauge", "Round-trip time of the backend health probe.",
+           {(b,): h["latency_ms"] / 1000 for b, h in health.items()}, ("backend",))
+    cache_fields = ("size", "hits", "misses", "hit_ratio", "evictions", "invalidations")
+    yield _stats_family("auth_token_cache", "Token cache statistics.", token_cache.stats(), cache_fields)
+    yield _stats_family("response_cache", "Response cache statistics.", response_cache.stats(), cache_fields)
+    yield _stats_family("password_hasher", "Password hashing pool statistics.", password_hasher.stats(),
+                        ("pending", "completed", "rejected", "rehashed"))
+    if graph_worker is not None:
+        status = graph_worker.status()
+        status["lag_seconds"] = status["lag_seconds"] or 0
+        yield _stats_family("graph_sync", "Graph outbox sync statistics.", status,
+                            ("pending", "dead", "lag_seconds", "events_synced", "failures"))
+    elif not graph_sync.drains_in_app():
+        # Drained by another process: the backlog is still visible from here
+        status = graph_sync.outbox_status(SessionLocal)
+        status["lag_seconds"] = status["lag_seconds"] or 0
+        yield _stats_family("graph_sync", "Graph outbox sync statistics.", status, ("pending", "dead", "lag_seconds"))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus text exposition format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health", response_model=dict)
+def health():
+    return architecture_status()
+
+@app.get("/metrics/debug", response_model=dict)
+def metrics_debug(_: Principal = Depends(require_admin)):
+    """Recent slow queries and suspected N+1 requests, with their statements."""
+    return metrics.debug_report()
+
+def apply_profiler(setting: dict) -> None:
+    metrics.profiler.slow_request_ms = setting["slow_request_ms"]
+    if setting["enabled"]:
+        metrics.profiler.start()
+    else:
+        metrics.profiler.stop()
+
+profiler_setting = shared_settings.SharedValue("profiler", apply_profiler)
+
+@app.get("/metrics/profiler", response_model=dict)
+def profiler_status(db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
+    profiler_setting.refresh(db)
+    return metrics.profiler.status()
+
+@app.put("/metrics/profiler", response_model=dict)
+def toggle_profiler(enabled: bool, slow_request_ms: Optional[float] = Query(None, gt=0), db: Session = Depends(get_db),
+                    _: Principal = Depends(require_admin)):
+    """Start/stop the sampling profiler in every worker (within SHARED_SETTINGS_POLL_SECONDS);
+    requests slower than slow_request_ms keep their samples. Profiles stay in the worker that recorded them."""
+    profiler_setting.store(db, {"enabled": enabled, "slow_request_ms": slow_request_ms or metrics.profiler.slow_request_ms})
+    return metrics.profiler.status()
+
+@app.get("/metrics/profiles/{profile_id}", response_class=PlainTextResponse)
+def profile_folded(profile_id: int, _: Principal = Depends(require_admin)):
+    """Folded stacks of one slow request (input for flamegraph.pl or speedscope)."""
+    folded = metrics.profiler.folded(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(folded)
+
+@app.get("/auth/hash-stats", response_model=dict)
+def auth_hash_stats(_: Principal = Depends(require_admin)):
+    return password_hasher.stats()
+
 # Dashboard route
 @app.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return get_templates().TemplateResponse("index.html", {"request": request})
 
 # CRUD for RawMaterialTraceRecord
 @app.post("/raw-material-trace", response_model=RawMaterialTraceRead, status_code=201)
-def create_raw_material_trace(payload: RawMaterialTraceCreate, db: Session = Depends(get_db), _: User = Depends(require_admin)):
-    # uniqueness checks
-    if db.query(RawMaterialTraceRecord).filter(RawMaterialTraceRecord.traceid == payload.traceid).first():
-        raise HTTPException(status_code=400, detail="traceid already exists")
-    if db.query(RawMaterialTraceRecord).filter(RawMaterialTraceRecord.tracecode == payload.tracecode).first():
-        raise HTTPException(status_code=400, detail="tracecode already exists")
+def create_raw_material_trace(payload: RawMaterialTraceCreate, db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
+    # uniqueness checks, archived units included
+    for model in (RawMaterialTraceRecord, RawMaterialTraceArchive):
+        if db.query(model).filter(model.traceid == payload.traceid).first():
+            raise HTTPException(status_code=400, detail="traceid already exists")
+        if db.query(model).filter(model.tracecode == payload.tracecode).first():
+            raise HTTPException(status_code=400, detail="tracecode already exists")
     receivetime = payload.receivetime or datetime.now(timezone.utc)
     record = RawMaterialTraceRecord(
         traceid=payload.traceid,
@@ -228,39 +722,178 @@ def create_raw_material_trace(payload: RawMaterialTraceCreate, db: Session = Dep
         tracestatus=payload.tracestatus,
     )
     db.add(record)
+    kpi.add_materials(db, [record])
     db.commit()
+    response_cache.invalidate("raw-material-trace", record.traceid)
     db.refresh(record)
     return record
 
+@app.post("/raw-material-trace/bulk", response_model=BulkIngestReport, status_code=201, openapi_extra=bulk_request_body("RawMaterialTraceCreate"))
+async def bulk_create_raw_material_trace(request: Request, mode: Literal['atomic','partial'] = 'atomic', db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
+    rows = await read_bulk_rows(request)
+    report = await run_in_threadpool(
+        bulk_ingest.ingest, db, RawMaterialTraceRecord, RawMaterialTraceCreate, rows,
+        unique_fields=("traceid", "tracecode"), archive=RawMaterialTraceArchive, fill_now=("receivetime",), atomic=mode == "atomic",
+        on_insert=kpi.add_materials,
+    )
+    return bulk_result(report)
+
+def raw_material_trace_filters(
+    supplierid: Optional[str] = None,
+    materialbatchno: Optional[str] = None,
+    tracestatus: Optional[Literal['In Stock','In Use','Consumed','Scrapped']] = None,
+    receivetime_from: Optional[datetime] = None,
+    receivetime_to: Optional[datetime] = None,
+) -> list:
+    clauses = []
+    if supplierid:
+        clauses.append(RawMaterialTraceRecord.supplierid == supplierid)
+    if materialbatchno:
+        clauses.append(RawMaterialTraceRecord.materialbatchno == materialbatchno)
+    if tracestatus:
+        clauses.append(RawMaterialTraceRecord.tracestatus == tracestatus)
+    if receivetime_from:
+        clauses.append(RawMaterialTraceRecord.receivetime >= receivetime_from)
+    if receivetime_to:
+        clauses.append(RawMaterialTraceRecord.receivetime < receivetime_to)
+    return clauses
+
 @app.get("/raw-material-trace", response_model=List[RawMaterialTraceRead])
-def list_raw_material_trace(db: Session = Depends(get_db)):
-    return db.query(RawMaterialTraceRecord).order_by(RawMaterialTraceRecord.receivetime.desc()).all()
+async def list_raw_material_trace(
+    request: Request,
+    response: Response,
+    filters: list = Depends(raw_material_trace_filters),
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    db: AsyncSession = Depends(get_async_db),
+):
+    stmt = select(*serialization.columns(RawMaterialTraceRecord, RawMaterialTraceRead)).where(*filters)
+    records = await keyset_page(db, stmt, RawMaterialTraceRecord.receivetime, RawMaterialTraceRecord.traceid, cursor, limit, response)
+    return list_response(request, response, RawMaterialTraceRead, await with_usedrecords(db, records))
+
+@app.get("/raw-material-trace/search", response_model=SearchPage[RawMaterialTraceRead])
+async def search_raw_material_trace(
+    q: str = Query("", max_length=100, description="Substring of traceid, tracecode, materialbatchno or supplierid"),
+    sort: Literal['receivetime','traceid','tracecode','supplierid','remainingqty'] = 'receivetime',
+    order: Literal['asc','desc'] = 'desc',
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=SEARCH_PAGE_SIZE_MAX),
+    filters: list = Depends(raw_material_trace_filters),
+    db: AsyncSession = Depends(get_async_db),
+):
+    model = RawMaterialTraceRecord
+    total, records = await search_page(db, model, RawMaterialTraceRead, filters, q, getattr(model, sort), model.traceid, order, page, page_size)
+    return search_response(RawMaterialTraceRead, total, page, page_size, await with_usedrecords(db, records))
+
+@app.get("/raw-material-trace/export", response_class=StreamingResponse)
+def export_raw_material_trace(
+    format: Literal['ndjson','csv'] = 'ndjson',
+    gzip: bool = False,
+    filters: list = Depends(raw_material_trace_filters),
+):
+    stmt = select(*RawMaterialTraceRecord.__table__.columns).where(*filters)
+
+    def fold_ledger(conn, rows):
+        return [tuple(record.values()) for record in traceability.with_usedrecords(conn, rows)]
+
+    return export_response("rawmaterialtracerecord", RawMaterialTraceRecord, stmt, format, gzip, fold_ledger)
 
 @app.get("/raw-material-trace/{traceid}", response_model=RawMaterialTraceRead)
-def get_raw_material_trace(traceid: str, db: Session = Depends(get_db)):
-    record = db.query(RawMaterialTraceRecord).filter(RawMaterialTraceRecord.traceid == traceid).first()
-    if not record:
-        raise HTTPException(status_code=404, detail="RawMaterialTraceRecord not found")
-    return record
+async def get_raw_material_trace(traceid: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def load():
+        columns = serialization.columns(RawMaterialTraceRecord, RawMaterialTraceRead)
+        record = (await db.execute(select(*columns).where(RawMaterialTraceRecord.traceid == traceid))).first()
+        if not record:
+            # Archived units carry their ledger folded into usedrecords
+            record = await db.get(RawMaterialTraceArchive, traceid)
+            if not record:
+                raise HTTPException(status_code=404, detail="RawMaterialTraceRecord not found")
+            return record
+        return (await with_usedrecords(db, [record]))[0]
+    return await cached_record(request, "raw-material-trace", traceid, RawMaterialTraceRead, load)
 
 @app.delete("/raw-material-trace/{traceid}", status_code=204)
-def delete_raw_material_trace(traceid: str, db: Session = Depends(get_db), _: User = Depends(require_admin)):
+def delete_raw_material_trace(traceid: str, db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
     record = db.query(RawMaterialTraceRecord).filter(RawMaterialTraceRecord.traceid == traceid).first()
     if not record:
         raise HTTPException(status_code=404, detail="RawMaterialTraceRecord not found")
+    db.query(MaterialConsumptionRecord).filter(MaterialConsumptionRecord.tracecode == record.tracecode).delete(synchronize_session=False)
+    kpi.remove_materials(db, [record])
     db.delete(record)
     db.commit()
+    response_cache.invalidate("raw-material-trace", traceid)
     return None
 
+# Material consumption (MES picks)
+@app.post("/material-consumptions", response_model=MaterialConsumptionRead, status_code=201)
+def create_material_consumption(payload: MaterialConsumptionCreate, db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
+    """Record one draw against a material batch.
+
+    A conditional UPDATE decrements remainingqty and moves tracestatus
+    (In Stock -> In Use -> Consumed) atomically, then the draw is appended to
+    the ledger and the stock KPIs in the same transaction. The cost per pick
+    does not depend on how many picks the batch already has.
+    """
+    material = RawMaterialTraceRecord
+    # The ledger stores 2 decimals; draw exactly that amount so the KPI delta matches
+    quantity = round(payload.quantity, 2)
+    if quantity <= 0:
+        raise HTTPException(status_code=400, detail="quantity must be at least 0.01")
+    remaining = func.round(material.remainingqty - quantity, 2)
+    result = None
+    # One guarded UPDATE per prior status, so the status transition is known for the KPI tables
+    for previous in ("In Use", "In Stock"):
+        result = db.execute(
+            update(material)
+            .where(
+                material.tracecode == payload.tracecode,
+                material.tracestatus == previous,
+                material.remainingqty >= quantity,
+            )
+            .values(remainingqty=remaining, tracestatus=case((remaining <= 0, "Consumed"), else_="In Use"))
+            .returning(material.traceid, material.remainingqty, material.tracestatus, material.storagelocation)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if result is not None:
+            break
+    if result is None:
+        db.rollback()
+        current = db.query(material.remainingqty, material.tracestatus).filter(material.tracecode == payload.tracecode).first()
+        if current is None:
+            current = db.query(RawMaterialTraceArchive.remainingqty, RawMaterialTraceArchive.tracestatus).filter(
+                RawMaterialTraceArchive.tracecode == payload.tracecode).first()
+        if current is None:
+            raise HTTPException(status_code=404, detail="RawMaterialTraceRecord not found")
+        if current.tracestatus not in ("In Stock", "In Use"):
+            raise HTTPException(status_code=409, detail=f"Material is {current.tracestatus}")
+        raise HTTPException(status_code=409, detail=f"Insufficient remaining quantity ({float(current.remainingqty)})")
+    kpi.move_stock(db, result.storagelocation, previous, float(result.remainingqty) + quantity, result.tracestatus, result.remainingqty)
+    entry = MaterialConsumptionRecord(
+        tracecode=payload.tracecode,
+        quantity=quantity,
+        consumedtime=payload.consumedtime or datetime.now(timezone.utc),
+        workorderid=payload.workorderid,
+        semiproducttracecode=payload.semiproducttracecode,
+        operatorid=payload.operatorid,
+    )
+    db.add(entry)
+    db.commit()
+    response_cache.invalidate("raw-material-trace", result.traceid)
+    return MaterialConsumptionRead(
+        **traceability.consumption_entry(entry), tracecode=entry.tracecode,
+        remainingqty=float(result.remainingqty), tracestatus=result.tracestatus,
+    )
+
 # CRUD for BatchTraceRelation
 @app.post("/batch-trace-relations", response_model=BatchTraceRelationRead, status_code=201)
-def create_batch_trace_relation(payload: BatchTraceRelationCreate, db: Session = Depends(get_db), _: User = Depends(require_admin)):
+def create_batch_trace_relation(payload: BatchTraceRelationCreate, db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
     if db.query(BatchTraceRelation).filter(BatchTraceRelation.relationid == payload.relationid).first():
         raise HTTPException(status_code=400, detail="relationid already exists")
     if db.query(BatchTraceRelation).filter(BatchTraceRelation.producttracecode == payload.producttracecode).first():
         raise HTTPException(status_code=400, detail="producttracecode already exists")
-    # validate materialtracecode exists in RawMaterialTraceRecord
-    if not db.query(RawMaterialTraceRecord).filter(RawMaterialTraceRecord.tracecode == payload.materialtracecode).first():
+    # validate materialtracecode exists in RawMaterialTraceRecord or its archive
+    if not any(db.query(model).filter(model.tracecode == payload.materialtracecode).first()
+               for model in (RawMaterialTraceRecord, RawMaterialTraceArchive)):
         raise HTTPException(status_code=400, detail="materialtracecode not found in raw material records")
     inspectiontime = payload.inspectiontime or datetime.now(timezone.utc)
     rel = BatchTraceRelation(
@@ -276,34 +909,107 @@ def create_batch_trace_relation(payload: BatchTraceRelationCreate, db: Session =
         relationstatus=payload.relationstatus,
     )
     db.add(rel)
+    graph_sync.enqueue(db, "upsert", [rel])
     db.commit()
+    response_cache.invalidate("batch-trace-relation", rel.relationid)
     db.refresh(rel)
     return rel
 
+@app.post("/batch-trace-relations/bulk", response_model=BulkIngestReport, status_code=201, openapi_extra=bulk_request_body("BatchTraceRelationCreate"))
+async def bulk_create_batch_trace_relations(request: Request, mode: Literal['atomic','partial'] = 'atomic', db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
+    rows = await read_bulk_rows(request)
+    report = await run_in_threadpool(
+        bulk_ingest.ingest, db, BatchTraceRelation, BatchTraceRelationCreate, rows,
+        unique_fields=("relationid", "producttracecode"),
+        references={"materialtracecode": (RawMaterialTraceRecord.tracecode, RawMaterialTraceArchive.tracecode)},
+        fill_now=("inspectiontime",), atomic=mode == "atomic",
+        on_insert=lambda session, inserted: graph_sync.enqueue(session, "upsert", inserted),
+    )
+    return bulk_result(report)
+
+def batch_trace_relation_filters(
+    relationstatus: Optional[Literal['Valid','Invalid','Pending Confirmation']] = None,
+    inspectiontime_from: Optional[datetime] = None,
+    inspectiontime_to: Optional[datetime] = None,
+) -> list:
+    clauses = []
+    if relationstatus:
+        clauses.append(BatchTraceRelation.relationstatus == relationstatus)
+    if inspectiontime_from:
+        clauses.append(BatchTraceRelation.inspectiontime >= inspectiontime_from)
+    if inspectiontime_to:
+        clauses.append(BatchTraceRelation.inspectiontime < inspectiontime_to)
+    return clauses
+
 @app.get("/batch-trace-relations", response_model=List[BatchTraceRelationRead])
-def list_batch_trace_relations(db: Session = Depends(get_db)):
-    return db.query(BatchTraceRelation).order_by(BatchTraceRelation.inspectiontime.desc()).all()
+async def list_batch_trace_relations(
+    request: Request,
+    response: Response,
+    filters: list = Depends(batch_trace_relation_filters),
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    db: AsyncSession = Depends(get_async_db),
+):
+    stmt = select(*serialization.columns(BatchTraceRelation, BatchTraceRelationRead)).where(*filters)
+    rels = await keyset_page(db, stmt, BatchTraceRelation.inspectiontime, BatchTraceRelation.relationid, cursor, limit, response)
+    return list_response(request, response, BatchTraceRelationRead, rels)
+
+@app.get("/batch-trace-relations/search", response_model=SearchPage[BatchTraceRelationRead])
+async def search_batch_trace_relations(
+    q: str = Query("", max_length=100, description="Substring of relationid, product/material tracecode, productbatchno or equipmentid"),
+    sort: Literal['inspectiontime','relationid','producttracecode','relationstatus'] = 'inspectiontime',
+    order: Literal['asc','desc'] = 'desc',
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=SEARCH_PAGE_SIZE_MAX),
+    filters: list = Depends(batch_trace_relation_filters),
+    db: AsyncSession = Depends(get_async_db),
+):
+    model = BatchTraceRelation
+    total, rels = await search_page(db, model, BatchTraceRelationRead, filters, q, getattr(model, sort), model.relationid, order, page, page_size)
+    return search_response(BatchTraceRelationRead, total, page, page_size, rels)
+
+@app.get("/batch-trace-relations/export", response_class=StreamingResponse)
+def export_batch_trace_relations(
+    format: Literal['ndjson','csv'] = 'ndjson',
+    gzip: bool = False,
+    filters: list = Depends(batch_trace_relation_filters),
+):
+    stmt = select(*BatchTraceRelation.__table__.columns).where(*filters)
+    return export_response("batchtracerelation", BatchTraceRelation, stmt, format, gzip)
 
 @app.get("/batch-trace-relations/{relationid}", response_model=BatchTraceRelationRead)
-def get_batch_trace_relation(relationid: str, db: Session = Depends(get_db)):
-    rel = db.query(BatchTraceRelation).filter(BatchTraceRelation.relationid == relationid).first()
-    if not rel:
-        raise HTTPException(status_code=404, detail="BatchTraceRelation not found")
-    return rel
+async def get_batch_trace_relation(relationid: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def load():
+        rel = await db.get(BatchTraceRelation, relationid)
+        if not rel:
+            raise HTTPException(status_code=404, detail="BatchTraceRelation not found")
+        return rel
+    return await cached_record(request, "batch-trace-relation", relationid, BatchTraceRelationRead, load)
 
 @app.delete("/batch-trace-relations/{relationid}", status_code=204)
-def delete_batch_trace_relation(relationid: str, db: Session = Depends(get_db), _: User = Depends(require_admin)):
+def delete_batch_trace_relation(relationid: str, db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
     rel = db.query(BatchTraceRelation).filter(BatchTraceRelation.relationid == relationid).first()
     if not rel:
         raise HTTPException(status_code=404, detail="BatchTraceRelation not found")
+    graph_sync.enqueue(db, "delete", [rel])
     db.delete(rel)
     db.commit()
+    response_cache.invalidate("batch-trace-relation", relationid)
     return None
 
+@app.get("/graph-sync/status", response_model=dict)
+def graph_sync_status(_: Principal = Depends(require_admin)):
+    """Outbox lag (age of the oldest pending event), backlog, dead events and sync throughput."""
+    if graph_worker is None:
+        # Not drained in this process (another process drains, or no graph store is configured)
+        return {"sink": None, "running": False, "drains_in_app": graph_sync.drains_in_app(),
+                **graph_sync.outbox_status(SessionLocal)}
+    return graph_worker.status()
+
 # CRUD for QualityRiskWarning
 @app.post("/quality-risk-warnings", response_model=QualityRiskWarningRead, status_code=201)
-def create_quality_risk_warning(payload: QualityRiskWarningCreate, db: Session = Depends(get_db), _: User = Depends(require_admin)):
-    if db.query(QualityRiskWarning).filter(QualityRiskWarning.warningid == payload.warningid).first():
+def create_quality_risk_warning(payload: QualityRiskWarningCreate, db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
+    if db.get(QualityRiskWarning, payload.warningid) or db.get(QualityRiskWarningArchive, payload.warningid):
         raise HTTPException(status_code=400, detail="warningid already exists")
     triggertime = payload.triggertime or datetime.now(timezone.utc)
     warn = QualityRiskWarning(
@@ -319,30 +1025,314 @@ def create_quality_risk_warning(payload: QualityRiskWarningCreate, db: Session =
         handleresult=payload.handleresult,
     )
     db.add(warn)
+    kpi.add_warnings(db, [warn])
     db.commit()
+    response_cache.invalidate("quality-risk-warning", warn.warningid)
     db.refresh(warn)
     return warn
 
+@app.post("/quality-risk-warnings/bulk", response_model=BulkIngestReport, status_code=201, openapi_extra=bulk_request_body("QualityRiskWarningCreate"))
+async def bulk_create_quality_risk_warnings(request: Request, mode: Literal['atomic','partial'] = 'atomic', db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
+    rows = await read_bulk_rows(request)
+    report = await run_in_threadpool(
+        bulk_ingest.ingest, db, QualityRiskWarning, QualityRiskWarningCreate, rows,
+        unique_fields=("warningid",), archive=QualityRiskWarningArchive, fill_now=("triggertime",), atomic=mode == "atomic",
+        on_insert=kpi.add_warnings,
+    )
+    return bulk_result(report)
+
+def quality_risk_warning_filters(
+    risklevel: Optional[int] = Query(None, ge=1, le=5),
+    handlestatus: Optional[Literal['Pending Handling','In Handling','Closed']] = None,
+    triggertime_from: Optional[datetime] = None,
+    triggertime_to: Optional[datetime] = None,
+) -> list:
+    clauses = []
+    if risklevel is not None:
+        clauses.append(QualityRiskWarning.risklevel == risklevel)
+    if handlestatus:
+        clauses.append(QualityRiskWarning.handlestatus == handlestatus)
+    if triggertime_from:
+        clauses.append(QualityRiskWarning.triggertime >= triggertime_from)
+    if triggertime_to:
+        clauses.append(QualityRiskWarning.triggertime < triggertime_to)
+    return clauses
+
 @app.get("/quality-risk-warnings", response_model=List[QualityRiskWarningRead])
-def list_quality_risk_warnings(db: Session = Depends(get_db)):
-    return db.query(QualityRiskWarning).order_by(QualityRiskWarning.triggertime.desc()).all()
+async def list_quality_risk_warnings(
+    request: Request,
+    response: Response,
+    filters: list = Depends(quality_risk_warning_filters),
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    db: AsyncSession = Depends(get_async_db),
+):
+    stmt = select(*serialization.columns(QualityRiskWarning, QualityRiskWarningRead)).where(*filters)
+    warns = await keyset_page(db, stmt, QualityRiskWarning.triggertime, QualityRiskWarning.warningid, cursor, limit, response)
+    return list_response(request, response, QualityRiskWarningRead, warns)
+
+@app.get("/quality-risk-warnings/search", response_model=SearchPage[QualityRiskWarningRead])
+async def search_quality_risk_warnings(
+    q: str = Query("", max_length=100, description="Substring of warningid, objectid, risktype, triggercondition or handlerid"),
+    sort: Literal['triggertime','warningid','risklevel','handlestatus'] = 'triggertime',
+    order: Literal['asc','desc'] = 'desc',
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=SEARCH_PAGE_SIZE_MAX),
+    filters: list = Depends(quality_risk_warning_filters),
+    db: AsyncSession = Depends(get_async_db),
+):
+    model = QualityRiskWarning
+    total, warns = await search_page(db, model, QualityRiskWarningRead, filters, q, getattr(model, sort), model.warningid, order, page, page_size)
+    return search_response(QualityRiskWarningRead, total, page, page_size, warns)
 
 @app.get("/quality-risk-warnings/{warningid}", response_model=QualityRiskWarningRead)
-def get_quality_risk_warning(warningid: str, db: Session = Depends(get_db)):
-    warn = db.query(QualityRiskWarning).filter(QualityRiskWarning.warningid == warningid).first()
-    if not warn:
-        raise HTTPException(status_code=404, detail="QualityRiskWarning not found")
-    return warn
+async def get_quality_risk_warning(warningid: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def load():
+        warn = await db.get(QualityRiskWarning, warningid) or await db.get(QualityRiskWarningArchive, warningid)
+        if not warn:
+            raise HTTPException(status_code=404, detail="QualityRiskWarning not found")
+        return warn
+    return await cached_record(request, "quality-risk-warning", warningid, QualityRiskWarningRead, load)
 
 @app.delete("/quality-risk-warnings/{warningid}", status_code=204)
-def delete_quality_risk_warning(warningid: str, db: Session = Depends(get_db), _: User = Depends(require_admin)):
+def delete_quality_risk_warning(warningid: str, db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
     warn = db.query(QualityRiskWarning).filter(QualityRiskWarning.warningid == warningid).first()
     if not warn:
         raise HTTPException(status_code=404, detail="QualityRiskWarning not found")
+    kpi.remove_warnings(db, [warn])
     db.delete(warn)
     db.commit()
+    response_cache.invalidate("quality-risk-warning", warningid)
+    return None
+
+# KPI aggregates, read from the incrementally maintained summary tables
+@app.get("/kpi/warnings", response_model=List[WarningKpi])
+async def kpi_warnings(open_only: bool = True, db: AsyncSession = Depends(get_async_db)):
+    """Warning counts per (risklevel, risktype); open_only excludes Closed warnings."""
+    return (await db.execute(kpi.warnings_query(open_only))).mappings().all()
+
+@app.get("/kpi/stock", response_model=List[StockKpi])
+async def kpi_stock(
+    tracestatus: Optional[Literal['In Stock','In Use','Consumed','Scrapped']] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Units and remaining quantity per (tracestatus, storagelocation)."""
+    return (await db.execute(kpi.stock_query(tracestatus))).mappings().all()
+
+@app.get("/kpi/supplier-warnings", response_model=List[SupplierWarningKpi])
+async def kpi_supplier_warnings(
+    open_only: bool = False,
+    limit: int = Query(100, ge=1, le=10000),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Suppliers ranked by warnings raised against their raw material units."""
+    return (await db.execute(kpi.supplier_warnings_query(limit, open_only))).mappings().all()
+
+@app.post("/kpi/rebuild", response_model=dict)
+def rebuild_kpis(db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
+    """Recompute the KPI summary tables from the base tables (repair after out-of-band writes)."""
+    return kpi.rebuild(db)
+
+# Tiered archival (archive.py): finished units and closed warnings past retention leave the hot tables
+@app.post("/archive/run", response_model=dict)
+def run_archive(
+    material_days: int = Query(archive.ARCHIVE_MATERIAL_DAYS, ge=0),
+    warning_days: int = Query(archive.ARCHIVE_WARNING_DAYS, ge=0),
+    max_batches: Optional[int] = Query(None, ge=1),
+    _: Principal = Depends(require_admin),
+):
+    """Move Consumed/Scrapped units and Closed warnings older than the retention ages to the archive tables."""
+    return archive.archive(SessionLocal, material_days, warning_days, max_batches=max_batches)
+
+# Quality rules and inspection ingest (Section 6.2.2). A PUT is stored in the database
+# (shared_settings.py) and every worker checks the stored version before using its rules
+quality_engine = QualityRuleEngine(load_rules())
+quality_rules_setting = shared_settings.SharedValue("quality_rules", quality_engine.load)
+
+@app.get("/quality-rules", response_model=List[QualityRule])
+def get_quality_rules(db: Session = Depends(get_db)):
+    quality_rules_setting.refresh(db)
+    return quality_engine.rules
+
+@app.put("/quality-rules", response_model=List[QualityRule])
+def replace_quality_rules(rules: List[QualityRule], db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
+    rules = [r.model_dump() for r in rules]
+    try:
+        QualityRuleEngine(rules)  # compile first: an invalid set is never stored
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    quality_rules_setting.store(db, rules)
+    return quality_engine.rules
+
+@app.post("/inspection-measurements", response_model=InspectionIngestReport, status_code=201)
+def ingest_inspection_measurements(measurements: List[InspectionMeasurement], db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
+    """Evaluate a batch of measurements and raise QualityRiskWarning rows for out-of-range values."""
+    quality_rules_setting.refresh(db)
+    return quality_engine.raise_warnings(db, [m.model_dump() for m in measurements])
+
+# Picks up profiler changes made through other workers
+settings_watcher = shared_settings.Watcher(SessionLocal, [quality_rules_setting, profiler_setting])
+
+# Attachments: multipart uploads stream into the object store (MinIO, or a local
+# directory when not configured) keyed by SHA-256; downloads honour single Range requests
+ATTACHMENT_UPLOAD_BODY = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": [attachments.FILE_FIELD],
+    "properties": {attachments.FILE_FIELD: {"type": "string", "format": "binary"}},
+}}}}}
+
+def insert_attachment(row: dict) -> Attachment:
+    with SessionLocal() as db:
+        record = Attachment(**row)
+        db.add(record)
+        db.commit()
+        db.refresh(record)
+        return record
+
+@app.post("/attachments", response_model=AttachmentUploadRead, status_code=201, openapi_extra=ATTACHMENT_UPLOAD_BODY)
+async def upload_attachment(
+    request: Request,
+    objecttype: AttachmentObjectType,
+    objectid: str = Query(min_length=1, max_length=36, description="e.g. the incominginspectionid or supplierid"),
+    user: Principal = Depends(require_admin),
+):
+    """Store the multipart field `file` and attach it to (objecttype, objectid); the body is never held in memory."""
+    try:
+        upload = await attachments.receive_upload(request, get_object_store())
+    except attachments.AttachmentError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    record = await run_in_threadpool(insert_attachment, {
+        "attachmentid": uuid.uuid4().hex, "objecttype": objecttype, "objectid": objectid,
+        "filename": upload.filename, "contenttype": upload.contenttype, "size": upload.object.size,
+        "sha256": upload.object.sha256, "uploadedby": user.username, "uploadedtime": datetime.now(timezone.utc),
+    })
+    return AttachmentUploadRead(**AttachmentRead.model_validate(record).model_dump(), deduplicated=not upload.object.created)
+
+@app.get("/attachments", response_model=List[AttachmentRead])
+async def list_attachments(objecttype: AttachmentObjectType, objectid: str, db: AsyncSession = Depends(get_async_db)):
+    stmt = (select(Attachment).where(Attachment.objecttype == objecttype, Attachment.objectid == objectid)
+            .order_by(Attachment.uploadedtime.desc(), Attachment.attachmentid))
+    return (await db.scalars(stmt)).all()
+
+async def load_attachment(db: AsyncSession, attachmentid: str) -> Attachment:
+    record = await db.get(Attachment, attachmentid)
+    if not record:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return record
+
+@app.get("/attachments/{attachmentid}", response_model=AttachmentRead)
+async def get_attachment(attachmentid: str, db: AsyncSession = Depends(get_async_db)):
+    return await load_attachment(db, attachmentid)
+
+@app.get("/attachments/{attachmentid}/content", response_class=StreamingResponse)
+async def download_attachment(
+    attachmentid: str,
+    request: Request,
+    disposition: Literal['attachment','inline'] = 'attachment',
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Stream the file; `Range: bytes=start-end` returns 206 with that slice (If-Range is honoured)."""
+    record = await load_attachment(db, attachmentid)
+    store = get_object_store()
+    size = await run_in_threadpool(store.size, record.sha256)
+    if size is None:
+        raise HTTPException(status_code=404, detail="Attachment content missing from the object store")
+    # Content never changes for a given hash, so the hash is a strong ETag
+    etag = f'"{record.sha256}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes",
+               "Content-Disposition": attachments.content_disposition(record.filename, disposition)}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if_range = request.headers.get("if-range")
+    try:
+        byte_range = attachments.parse_range(request.headers.get("range"), size) if not if_range or if_range == etag else None
+    except attachments.RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(store.read(record.sha256), media_type=record.contenttype, headers=headers)
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(store.read(record.sha256, start, end - start + 1), status_code=206,
+                             media_type=record.contenttype, headers=headers)
+
+@app.delete("/attachments/{attachmentid}", status_code=204)
+def delete_attachment(attachmentid: str, db: Session = Depends(get_db), _: Principal = Depends(require_admin)):
+    """Remove the attachment; its content is collected by `python manage.py gc-objects` once unreferenced."""
+    record = db.get(Attachment, attachmentid)
+    if not record:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    db.delete(record)
+    db.commit()
     return None
 
+# Process and inspection time series (InfluxDB, or the local store when not configured)
+TIMESERIES_MAX_BATCH = 50000
+
+def timeseries_filters(
+    equipmentid: Optional[str] = None,
+    tracecode: Optional[str] = None,
+    measurement: Optional[str] = None,
+    field: Optional[str] = None,
+    start: Optional[datetime] = Query(None, description="Inclusive; defaults to 24h before end"),
+    end: Optional[datetime] = Query(None, description="Exclusive; defaults to now"),
+) -> dict:
+    if not equipmentid and not tracecode:
+        raise HTTPException(status_code=400, detail="equipmentid or tracecode is required")
+    if start and end and start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return {"equipmentid": equipmentid, "tracecode": tracecode, "measurement": measurement, "field": field, "start": start, "end": end}
+
+@app.post("/timeseries/points", response_model=dict, status_code=201)
+def write_timeseries_points(points: List[TimeSeriesPoint], _: Principal = Depends(require_admin)):
+    if len(points) > TIMESERIES_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {TIMESERIES_MAX_BATCH} points per request")
+    written = get_timeseries_backend().write_points([p.model_dump() for p in points])
+    return {"written": written}
+
+@app.get("/timeseries/points", response_model=List[TimeSeriesPoint])
+def read_timeseries_points(filters: dict = Depends(timeseries_filters), limit: int = Query(10000, ge=1, le=100000)):
+    """Raw points in time order; use /timeseries/rollups for long ranges."""
+    return get_timeseries_backend().query_points(**filters, limit=limit)
+
+@app.get("/timeseries/rollups", response_model=List[TimeSeriesRollup])
+def read_timeseries_rollups(resolution: Literal['1m','1h'] = '1h', filters: dict = Depends(timeseries_filters)):
+    """Precomputed min/max/mean per bucket, aggregated over the matching series."""
+    return get_timeseries_backend().query_rollups(resolution, **filters)
+
+# Full-chain traceability (Section 5.3). The endpoints are plain `def` with the sync
+# session: a deep trace runs many queries and encodes a large body, which belongs on
+# the threadpool, not on the event loop
+def run_trace(db: Session, tracecode: str, direction: str, max_depth: int, max_nodes: int, include_invalid: bool) -> Response:
+    result = traceability.trace(db, tracecode, direction, max_depth=max_depth, max_nodes=max_nodes, include_invalid=include_invalid)
+    if not result["relations"] and not result["materials"]:
+        raise HTTPException(status_code=404, detail="tracecode not found")
+    relations = [{**rel._mapping, "depth": depth} for depth, rel in result["relations"]]
+    body = serialization.encode(TraceResult, {**result, "relations": relations})
+    return Response(content=body, media_type="application/json")
+
+@app.get("/trace/backward/{tracecode}", response_model=TraceResult)
+def trace_backward(
+    tracecode: str,
+    max_depth: int = Query(traceability.TRACE_MAX_DEPTH, ge=1, le=traceability.TRACE_MAX_DEPTH),
+    max_nodes: int = Query(traceability.TRACE_MAX_NODES, ge=1, le=traceability.TRACE_MAX_NODES),
+    include_invalid: bool = False,
+    db: Session = Depends(get_db),
+):
+    """Upstream genealogy: product -> semi-finished -> raw material -> supplier."""
+    return run_trace(db, tracecode, "backward", max_depth, max_nodes, include_invalid)
+
+@app.get("/trace/forward/{tracecode}", response_model=TraceResult)
+def trace_forward(
+    tracecode: str,
+    max_depth: int = Query(traceability.TRACE_MAX_DEPTH, ge=1, le=traceability.TRACE_MAX_DEPTH),
+    max_nodes: int = Query(traceability.TRACE_MAX_NODES, ge=1, le=traceability.TRACE_MAX_NODES),
+    include_invalid: bool = False,
+    db: Session = Depends(get_db),
+):
+    """Downstream recall set: every product built from the given material or semi-finished code."""
+    return run_trace(db, tracecode, "forward", max_depth, max_nodes, include_invalid)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    uvicorn.run(app, host=os.getenv("HOST", "127.0.0.1"), port=int(os.getenv("PORT", "8000")))
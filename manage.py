@@ -0,0 +1,214 @@
+"""
+Database setup and maintenance commands, kept out of module import so that
+importing main (every worker, reload or frozen exe start) does no DDL and no
+password hashing.
+
+    python manage.py migrate        # create missing tables, indexes and search index
+    python manage.py seed           # create the admin user if missing (ADMIN_PASSWORD)
+    python manage.py rebuild-kpis   # recompute the KPI summary tables
+    python manage.py rebuild-search # re-index the SQLite FTS tables (e.g. after VACUUM)
+    python manage.py gc-objects     # delete stored attachment content no attachment references
+    python manage.py archive        # move finished units / closed warnings past retention to the archive tables
+    python manage.py graph-sync     # run the graph outbox drainer in the foreground (app started with GRAPH_SYNC_WORKER=0)
+    python manage.py graph-requeue  # retry graph outbox events that used up GRAPH_SYNC_MAX_ATTEMPTS
+
+All commands take --url (default: SQLALCHEMY_DATABASE_URL). With AUTO_MIGRATE=1
+(the default) the app runs bootstrap() once at startup instead; deployments
+that run migrate/seed as a release step can set AUTO_MIGRATE=0.
+
+migrate() stores a fingerprint of the schema it applied. A start against an
+up-to-date database costs one SELECT; otherwise the DDL runs under a database
+lock (BEGIN IMMEDIATE on SQLite, an advisory lock on PostgreSQL) so several
+workers starting together do not race.
+"""
+import argparse
+import hashlib
+import os
+import time
+from typing import Optional
+
+from sqlalchemy import inspect, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import search
+from models import Attachment, Base, SchemaInfo, User
+
+ADMIN_USERNAME = "admin"
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
+SCHEMA_KEY = "schema_fingerprint"
+# Arbitrary constant identifying this application's migration lock on PostgreSQL
+_PG_LOCK_ID = 0x7AC3
+
+
+def schema_fingerprint() -> str:
+    """Hash of every table, column, index and constraint in the models plus the search configuration."""
+    parts = []
+    for table in Base.metadata.sorted_tables:
+        parts.append(table.name)
+        parts.extend(f"{c.name}:{c.type}:{c.nullable}:{c.primary_key}" for c in table.columns)
+        parts.extend(sorted(f"{i.name}:{','.join(c.name for c in i.columns)}" for i in table.indexes))
+        parts.extend(sorted(str(c.name) for c in table.constraints if c.name))
+        parts.extend(sorted(f"{fk.parent.name}->{fk.target_fullname}" for fk in table.foreign_keys))
+    parts.append(repr(sorted(search.SEARCH_FIELDS.items())))
+    return hashlib.blake2b("\n".join(parts).encode(), digest_size=16).hexdigest()
+
+
+def stored_fingerprint(conn) -> Optional[str]:
+    if not conn.dialect.has_table(conn, SchemaInfo.__tablename__):
+        return None
+    return conn.execute(select(SchemaInfo.value).where(SchemaInfo.key == SCHEMA_KEY)).scalar()
+
+
+def _lock(conn) -> None:
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        # Take the write lock now; other starters wait here (busy_timeout) instead of failing mid-DDL
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    elif dialect == "postgresql":
+        conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({_PG_LOCK_ID})")
+
+
+# Foreign keys removed from the models that create_all cannot drop from existing databases.
+# batchtracerelation.materialtracecode may point at an archived unit (see archive.py)
+_DROPPED_FOREIGN_KEYS = (("batchtracerelation", "batchtracerelation_materialtracecode_fkey"),)
+
+
+def _drop_foreign_keys(conn) -> None:
+    # SQLite does not enforce foreign keys here (PRAGMA foreign_keys is off), so only PostgreSQL needs this
+    if conn.dialect.name == "postgresql":
+        for table, constraint in _DROPPED_FOREIGN_KEYS:
+            conn.exec_driver_sql(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {constraint}")
+
+
+# Columns added to existing tables, which create_all does not alter
+_ADDED_COLUMNS = (
+    ("graphoutbox", "claimedby", "VARCHAR(32)"),
+    ("graphoutbox", "claimeduntil", "TIMESTAMP"),
+)
+
+
+def _add_columns(conn) -> None:
+    inspector = inspect(conn)
+    for table, column, ddl_type in _ADDED_COLUMNS:
+        if column not in {c["name"] for c in inspector.get_columns(table)}:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}")
+
+
+def migrate(engine, force: bool = False) -> dict:
+    """Bring the schema up to date; a no-op when the stored fingerprint already matches."""
+    started = time.perf_counter()
+    fingerprint = schema_fingerprint()
+    with engine.connect() as conn:
+        current = stored_fingerprint(conn)
+    if not force and current == fingerprint:
+        return {"migrated": False, "seconds": round(time.perf_counter() - started, 3)}
+    with engine.connect() as conn:
+        _lock(conn)
+        # Another process may have applied the same schema while this one waited for the lock
+        if force or stored_fingerprint(conn) != fingerprint:
+            Base.metadata.create_all(bind=conn)
+            # create_all skips indexes of tables that already exist; add any that are missing
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(bind=conn, checkfirst=True)
+            _drop_foreign_keys(conn)
+            _add_columns(conn)
+        conn.commit()
+    # Substring search index (FTS5 trigram on SQLite, pg_trgm on PostgreSQL); idempotent
+    backend = search.ensure_index(engine)
+    with Session(engine) as db:
+        db.merge(SchemaInfo(key=SCHEMA_KEY, value=fingerprint))
+        db.commit()
+    return {"migrated": True, "search_backend": backend, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def seed_admin(session_factory, hasher=None) -> bool:
+    """Create the admin user if it does not exist; return whether it was created."""
+    with session_factory() as db:
+        if db.query(User.id).filter(User.username == ADMIN_USERNAME).first():
+            return False
+        if hasher is None:
+            from password_hashing import PasswordHasher
+
+            hasher = PasswordHasher()
+        db.add(User(username=ADMIN_USERNAME, hashed_password=hasher.hash_sync(ADMIN_PASSWORD), role="admin"))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another worker seeded it first
+            db.rollback()
+            return False
+        return True
+
+
+def bootstrap(engine, session_factory, hasher=None) -> dict:
+    """Startup hook: migrate if the schema changed, then seed the admin user if missing."""
+    result = migrate(engine)
+    result["seeded"] = seed_admin(session_factory, hasher)
+    return result
+
+
+def gc_objects(engine, store, grace_seconds: float = 3600) -> dict:
+    """Delete unreferenced objects older than `grace_seconds` (younger ones may belong to uploads in flight)."""
+    with engine.connect() as conn:
+        referenced = set(conn.execute(select(Attachment.sha256).distinct()).scalars())
+    return store.gc(referenced, grace_seconds)
+
+
+def main():
+    from sqlalchemy.orm import sessionmaker
+
+    import archive
+    import graph_sync
+    import kpi
+    from db_clients import DEFAULT_SQLALCHEMY_URL, create_sqlalchemy_engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["migrate", "seed", "rebuild-kpis", "rebuild-search", "gc-objects", "archive",
+                                            "graph-sync", "graph-requeue"])
+    parser.add_argument("--url", default=DEFAULT_SQLALCHEMY_URL)
+    parser.add_argument("--force", action="store_true", help="migrate: run the DDL even if the fingerprint matches")
+    parser.add_argument("--grace-seconds", type=float, default=3600, help="gc-objects: keep unreferenced objects younger than this")
+    parser.add_argument("--material-days", type=int, default=archive.ARCHIVE_MATERIAL_DAYS, help="archive: retention of Consumed/Scrapped units")
+    parser.add_argument("--warning-days", type=int, default=archive.ARCHIVE_WARNING_DAYS, help="archive: retention of Closed warnings")
+    parser.add_argument("--batch", type=int, default=archive.ARCHIVE_BATCH_SIZE, help="archive: rows per transaction")
+    args = parser.parse_args()
+    engine = create_sqlalchemy_engine(args.url)
+    if args.command == "migrate":
+        print(migrate(engine, force=args.force))
+    elif args.command == "seed":
+        print({"seeded": seed_admin(sessionmaker(bind=engine))})
+    elif args.command == "rebuild-kpis":
+        migrate(engine)
+        with Session(engine) as db:
+            print(kpi.rebuild(db))
+    elif args.command == "rebuild-search":
+        started = time.perf_counter()
+        search.rebuild(engine)
+        print({"seconds": round(time.perf_counter() - started, 3)})
+    elif args.command == "archive":
+        migrate(engine)
+        print(archive.archive(sessionmaker(bind=engine), args.material_days, args.warning_days, args.batch))
+    elif args.command == "graph-sync":
+        migrate(engine)
+        sink = graph_sync.create_sink()
+        if sink is None:
+            parser.error("graph-sync: no graph store configured (NEO4J_URI or GRAPH_SYNC_SINK)")
+        worker = graph_sync.GraphSyncWorker(sessionmaker(bind=engine), sink)
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            pass
+        print(worker.status())
+    elif args.command == "graph-requeue":
+        print({"requeued": graph_sync.requeue_dead(sessionmaker(bind=engine))})
+    else:
+        from db_clients import get_object_store
+
+        print(gc_objects(engine, get_object_store(), args.grace_seconds))
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Request and SQL instrumentation with a Prometheus text exposition.
+
+- MetricsMiddleware (pure ASGI) records a latency histogram and status counts
+  per (method, route template), plus in-flight requests.
+- instrument_engine() hooks SQLAlchemy cursor events. Statements are counted
+  and timed globally and attributed to the current request through a
+  ContextVar; statements slower than SLOW_QUERY_MS are logged and kept in a
+  ring buffer.
+- A request that runs the same statement shape N_PLUS_ONE_THRESHOLD times or
+  more is flagged as a probable N+1 (logged, counted per route).
+- SamplingProfiler samples all thread stacks while enabled; requests slower
+  than its threshold keep the samples taken during them as folded stacks,
+  ready for flamegraph.pl or speedscope.
+
+No client library is needed; render() writes the text format directly.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+PROFILER_SLOW_REQUEST_MS = float(os.getenv("PROFILER_SLOW_REQUEST_MS", "500"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+STATEMENT_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    __slots__ = ("statements", "sql_seconds", "shapes")
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.shapes: Counter = Counter()
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Iterable[str], values: Iterable[object]) -> str:
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+def _histogram_lines(name: str, label_names: Tuple[str, ...], series: Dict[tuple, Histogram]) -> List[str]:
+    lines = []
+    for key, hist in sorted(series.items()):
+        base = _labels(label_names, key)
+        sep = "," if base else ""
+        cumulative = 0
+        for bound, count in zip(hist.buckets, hist.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{base}{sep}le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{base}{sep}le="+Inf"}} {hist.count}')
+        lines.append(f"{name}_sum{{{base}}} {hist.sum:.6f}" if base else f"{name}_sum {hist.sum:.6f}")
+        lines.append(f"{name}_count{{{base}}} {hist.count}" if base else f"{name}_count {hist.count}")
+    return lines
+
+
+class SamplingProfiler:
+    """Periodic sys._current_frames() sampler; only runs while enabled."""
+
+    def __init__(self, interval_ms: float = PROFILER_INTERVAL_MS, slow_request_ms: float = PROFILER_SLOW_REQUEST_MS,
+                 max_samples: int = 200000, max_profiles: int = 20):
+        self.interval = interval_ms / 1000
+        self.slow_request_ms = slow_request_ms
+        self._samples: deque = deque(maxlen=max_samples)
+        self.profiles: deque = deque(maxlen=max_profiles)
+        self._next_profile_id = 1
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join(1.0)
+            self._samples.clear()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        labels: Dict[object, str] = {}
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = sys.intern(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    stack.append(label)
+                    frame = frame.f_back
+                self._samples.append((now, ";".join(reversed(stack))))
+
+    def capture(self, method: str, route: str, started: float, finished: float, stats: RequestStats) -> None:
+        if (finished - started) * 1000 < self.slow_request_ms:
+            return
+        stacks = Counter(folded for t, folded in list(self._samples) if started <= t <= finished)
+        with self._lock:
+            profile_id = self._next_profile_id
+            self._next_profile_id += 1
+            self.profiles.append({
+                "id": profile_id,
+                "method": method,
+                "route": route,
+                "time": time.time(),
+                "duration_ms": round((finished - started) * 1000, 3),
+                "sql_statements": stats.statements,
+                "sql_ms": round(stats.sql_seconds * 1000, 3),
+                "samples": sum(stacks.values()),
+                "stacks": stacks,
+            })
+
+    def folded(self, profile_id: int) -> Optional[str]:
+        for profile in list(self.profiles):
+            if profile["id"] == profile_id:
+                return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].most_common())
+        return None
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "interval_ms": self.interval * 1000,
+            "slow_request_ms": self.slow_request_ms,
+            "profiles": [{k: v for k, v in p.items() if k != "stacks"} for p in list(self.profiles)],
+        }
+
+
+class Metrics:
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS, n_plus_one_threshold: int = N_PLUS_ONE_THRESHOLD):
+        self.slow_query_ms = slow_query_ms
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self._lock = threading.Lock()
+        self.request_latency: Dict[tuple, Histogram] = {}
+        self.request_statements: Dict[tuple, Histogram] = {}
+        self.responses: Counter = Counter()
+        self.in_flight = 0
+        self.sql_latency = Histogram(SQL_BUCKETS)
+        self.slow_queries_total = 0
+        self.slow_queries: deque = deque(maxlen=50)
+        self.n_plus_one: Counter = Counter()
+        self.n_plus_one_recent: deque = deque(maxlen=50)
+        self.profiler = SamplingProfiler()
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[tuple, float], Tuple[str, ...]]]]] = []
+        if PROFILER_ENABLED:
+            self.profiler.start()
+
+    # SQL
+
+    def instrument_engine(self, engine) -> None:
+        """Attach cursor timing to a sync Engine (pass AsyncEngine.sync_engine for async)."""
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info["query_start"].pop()
+            self.observe_statement(statement, elapsed)
+
+    def observe_statement(self, statement: str, elapsed: float) -> None:
+        stats = _current_request.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.sql_seconds += elapsed
+            stats.shapes[statement] += 1
+        slow = elapsed * 1000 >= self.slow_query_ms
+        with self._lock:
+            self.sql_latency.observe(elapsed)
+            if slow:
+                self.slow_queries_total += 1
+                self.slow_queries.append({"time": time.time(), "ms": round(elapsed * 1000, 3), "statement": statement[:2000]})
+        if slow:
+            logger.warning("slow query (%.1f ms): %s", elapsed * 1000, statement[:500])
+
+    # Requests
+
+    def begin_request(self) -> Tuple[RequestStats, object]:
+        with self._lock:
+            self.in_flight += 1
+        stats = RequestStats()
+        return stats, _current_request.set(stats)
+
+    def end_request(self, token, stats: RequestStats, method: str, route: str, status: int,
+                    started: float, finished: float) -> None:
+        _current_request.reset(token)
+        key = (method, route)
+        suspects = [(shape, n) for shape, n in stats.shapes.items() if n >= self.n_plus_one_threshold]
+        with self._lock:
+            self.in_flight -= 1
+            hist = self.request_latency.get(key)
+            if hist is None:
+                hist = self.request_latency[key] = Histogram(LATENCY_BUCKETS)
+                self.request_statements[key] = Histogram(STATEMENT_COUNT_BUCKETS)
+            hist.observe(finished - started)
+            self.request_statements[key].observe(stats.statements)
+            self.responses[(method, route, str(status))] += 1
+            for shape, n in suspects:
+                self.n_plus_one[key] += 1
+                self.n_plus_one_recent.append({"time": time.time(), "method": method, "route": route,
+                                               "executions": n, "statement": shape[:2000]})
+        for shape, n in suspects:
+            logger.warning("possible N+1 on %s %s: %d executions of %s", method, route, n, shape[:200])
+        if self.profiler.enabled:
+            self.profiler.capture(method, route, started, finished, stats)
+
+    # Exposition
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Dict[tuple, float], Tuple[str, ...]]]]) -> None:
+        """`collector()` yields (name, type, help, {label values: value}, label names) at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                "# HELP http_request_duration_seconds Request latency by route template.",
+                "# TYPE http_request_duration_seconds histogram",
+                *_histogram_lines("http_request_duration_seconds", ("method", "route"), self.request_latency),
+                "# HELP http_request_sql_statements SQL statements executed per request.",
+                "# TYPE http_request_sql_statements histogram",
+                *_histogram_lines("http_request_sql_statements", ("method", "route"), self.request_statements),
+                "# HELP http_responses_total Responses by route template and status code.",
+                "# TYPE http_responses_total counter",
+                *(f"http_responses_total{{{_labels(('method', 'route', 'status'), k)}}} {v}" for k, v in sorted(self.responses.items())),
+                "# HELP http_requests_in_flight Requests currently being served.",
+                "# TYPE http_requests_in_flight gauge",
+                f"http_requests_in_flight {self.in_flight}",
+                "# HELP sql_statement_duration_seconds SQL statement latency.",
+                "# TYPE sql_statement_duration_seconds histogram",
+                *_histogram_lines("sql_statement_duration_seconds", (), {(): self.sql_latency}),
+                "# HELP sql_slow_statements_total Statements slower than SLOW_QUERY_MS.",
+                "# TYPE sql_slow_statements_total counter",
+                f"sql_slow_statements_total {self.slow_queries_total}",
+                "# HELP http_n_plus_one_suspected_total Requests repeating one statement at least N_PLUS_ONE_THRESHOLD times.",
+                "# TYPE http_n_plus_one_suspected_total counter",
+                *(f"http_n_plus_one_suspected_total{{{_labels(('method', 'route'), k)}}} {v}" for k, v in sorted(self.n_plus_one.items())),
+            ]
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception:
+                logger.exception("metrics collector failed")
+                continue
+            for name, kind, help_text, samples, label_names in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in samples.items():
+                    labels = _labels(label_names, key)
+                    lines.append(f"{name}{{{labels}}} {float(value):g}" if labels else f"{name} {float(value):g}")
+        return "\n".join(lines) + "\n"
+
+    def debug_report(self) -> dict:
+        with self._lock:
+            return {
+                "slow_query_ms": self.slow_query_ms,
+                "slow_queries": list(self.slow_queries),
+                "n_plus_one_threshold": self.n_plus_one_threshold,
+                "n_plus_one": list(self.n_plus_one_recent),
+            }
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streaming responses are timed to their last byte."""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats, token = self.metrics.begin_request()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope; templates keep label cardinality bounded
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            self.metrics.end_request(token, stats, scope["method"], route, status, started, time.perf_counter())
@@ -1,5 +1,5 @@
 # // filepath: c:\Users\W\Desktop\py\6\models.py
-from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, JSON, DECIMAL, CheckConstraint, ForeignKey
+from sqlalchemy import BigInteger, Column, Integer, String, Text, TIMESTAMP, JSON, DECIMAL, CheckConstraint, ForeignKey, Index
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -34,6 +34,11 @@ class RawMaterialTraceRecord(Base):
 
     __table_args__ = (
         CheckConstraint("tracestatus IN ('In Stock','In Use','Consumed','Scrapped')", name="chk_tracestatus"),
+        # Keyset pagination: (filter, receivetime, traceid) so every page is an index range scan
+        Index("ix_rawmaterial_receivetime", "receivetime", "traceid"),
+        Index("ix_rawmaterial_supplier_receivetime", "supplierid", "receivetime", "traceid"),
+        Index("ix_rawmaterial_batchno_receivetime", "materialbatchno", "receivetime", "traceid"),
+        Index("ix_rawmaterial_status_receivetime", "tracestatus", "receivetime", "traceid"),
     )
 
 # 5.2.2 Batch Trace Relation Table
@@ -42,7 +47,9 @@ class BatchTraceRelation(Base):
     relationid = Column(String(32), primary_key=True, nullable=False, unique=True)
     productbatchno = Column(String(20), nullable=False)
     producttracecode = Column(String(36), nullable=False, unique=True)
-    materialtracecode = Column(String(36), ForeignKey("rawmaterialtracerecord.tracecode"), nullable=False)
+    # No database foreign key: the material may have moved to rawmaterialtracerecord_archive.
+    # Writers check it exists in either table (see main.py / bulk_ingest references)
+    materialtracecode = Column(String(36), nullable=False)
     equipmentid = Column(String(20), nullable=False)
     processschemeid = Column(String(32), nullable=False)
     inspectionpersonid = Column(String(20), nullable=False)
@@ -52,6 +59,10 @@ class BatchTraceRelation(Base):
 
     __table_args__ = (
         CheckConstraint("relationstatus IN ('Valid','Invalid','Pending Confirmation')", name="chk_relationstatus"),
+        Index("ix_relation_inspectiontime", "inspectiontime", "relationid"),
+        # Forward trace expands material -> product edges
+        Index("ix_relation_materialtracecode", "materialtracecode"),
+        Index("ix_relation_status_inspectiontime", "relationstatus", "inspectiontime", "relationid"),
     )
 
 # 5.2.3 Quality Risk Warning Table
@@ -72,5 +83,161 @@ class QualityRiskWarning(Base):
         CheckConstraint("risklevel BETWEEN 1 AND 5", name="chk_risklevel"),
         CheckConstraint("warningobject IN ('Raw Material','Semi-Finished Product','Finished Product')", name="chk_warningobject"),
         CheckConstraint("handlestatus IN ('Pending Handling','In Handling','Closed')", name="chk_handlestatus"),
+        Index("ix_warning_triggertime", "triggertime", "warningid"),
+        Index("ix_warning_risklevel_triggertime", "risklevel", "triggertime", "warningid"),
+        Index("ix_warning_handlestatus_triggertime", "handlestatus", "triggertime", "warningid"),
+        # Rule engine de-duplication against open warnings
+        Index("ix_warning_objectid_risktype", "objectid", "risktype"),
     )
 
+
+# Material consumption ledger (Section 6.2.1 step 3): one append-only row per pick,
+# replacing read-modify-write of RawMaterialTraceRecord.usedrecords
+class MaterialConsumptionRecord(Base):
+    __tablename__ = "materialconsumptionrecord"
+    consumptionid = Column(Integer, primary_key=True, autoincrement=True)
+    tracecode = Column(String(36), ForeignKey("rawmaterialtracerecord.tracecode"), nullable=False)
+    quantity = Column(DECIMAL(10, 2), nullable=False)
+    consumedtime = Column(TIMESTAMP, nullable=False)
+    workorderid = Column(String(32), nullable=True)
+    semiproducttracecode = Column(String(36), nullable=True)
+    operatorid = Column(String(20), nullable=True)
+
+    __table_args__ = (
+        CheckConstraint("quantity > 0", name="chk_consumption_quantity"),
+        Index("ix_consumption_tracecode", "tracecode", "consumptionid"),
+    )
+
+
+# Transactional outbox for graph synchronization (Section 6.2.1 step 4): written in the
+# same transaction as the BatchTraceRelation change, drained into Neo4j by graph_sync
+class GraphOutbox(Base):
+    __tablename__ = "graphoutbox"
+    outboxid = Column(Integer, primary_key=True, autoincrement=True)
+    idempotencykey = Column(String(32), nullable=False, unique=True)
+    relationid = Column(String(32), nullable=False)
+    operation = Column(String(10), nullable=False)
+    payload = Column(JSON, nullable=False)
+    createdtime = Column(TIMESTAMP, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    lasterror = Column(Text, nullable=True)
+    processedtime = Column(TIMESTAMP, nullable=True)
+    # Lease of the drainer working on the row (graph_sync.GraphSyncWorker.claim)
+    claimedby = Column(String(32), nullable=True)
+    claimeduntil = Column(TIMESTAMP, nullable=True)
+
+    __table_args__ = (
+        CheckConstraint("operation IN ('upsert','delete')", name="chk_outbox_operation"),
+        # Pending scan: processedtime IS NULL ORDER BY outboxid
+        Index("ix_outbox_pending", "processedtime", "outboxid"),
+    )
+
+
+# KPI summary tables: maintained incrementally by the write paths (kpi.py) so the
+# aggregates API reads O(groups) rows; kpi.rebuild() recomputes them from scratch
+class KpiStock(Base):
+    __tablename__ = "kpistock"
+    tracestatus = Column(String(15), primary_key=True)
+    storagelocation = Column(String(50), primary_key=True)
+    itemcount = Column(Integer, nullable=False, default=0)
+    remainingqty = Column(DECIMAL(16, 2), nullable=False, default=0)
+
+
+class KpiWarning(Base):
+    __tablename__ = "kpiwarning"
+    handlestatus = Column(String(15), primary_key=True)
+    risklevel = Column(Integer, primary_key=True)
+    risktype = Column(String(50), primary_key=True)
+    warningcount = Column(Integer, nullable=False, default=0)
+
+
+# Warnings on raw material units (objectid = tracecode), attributed to the unit's supplier
+class KpiSupplierWarning(Base):
+    __tablename__ = "kpisupplierwarning"
+    supplierid = Column(String(20), primary_key=True)
+    warningcount = Column(Integer, nullable=False, default=0)
+    openwarningcount = Column(Integer, nullable=False, default=0)
+
+
+# Key/value facts about the database itself, e.g. the fingerprint of the schema
+# last applied by manage.migrate (so startup can skip DDL when nothing changed)
+class SchemaInfo(Base):
+    __tablename__ = "schemainfo"
+    key = Column(String(50), primary_key=True)
+    value = Column(String(255), nullable=False)
+
+
+# Settings changed at runtime through the API that every worker process must apply
+# (quality rules, profiler); each process reloads a row when its version changes (shared_settings.py)
+class SharedSetting(Base):
+    __tablename__ = "sharedsetting"
+    key = Column(String(50), primary_key=True)
+    value = Column(JSON, nullable=False)
+    version = Column(Integer, nullable=False)
+    updatedtime = Column(TIMESTAMP, nullable=False)
+
+
+# Files attached to traceability objects (inspection reports, supplier certificates).
+# Content lives in the object store under its SHA-256; rows sharing a hash share one object
+class Attachment(Base):
+    __tablename__ = "attachment"
+    attachmentid = Column(String(32), primary_key=True)
+    objecttype = Column(String(30), nullable=False)
+    objectid = Column(String(36), nullable=False)
+    filename = Column(String(255), nullable=False)
+    contenttype = Column(String(100), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    uploadedby = Column(String(50), nullable=False)
+    uploadedtime = Column(TIMESTAMP, nullable=False)
+
+    __table_args__ = (
+        CheckConstraint("objecttype IN ('Incoming Inspection','Supplier','Raw Material','Quality Warning')", name="chk_attachment_objecttype"),
+        Index("ix_attachment_object", "objecttype", "objectid", "uploadedtime"),
+        # Object garbage collection looks up referenced hashes
+        Index("ix_attachment_sha256", "sha256"),
+    )
+
+
+# Archive tiers (archive.py): Consumed/Scrapped raw material units and Closed warnings
+# past the retention age move here in batches, so the hot tables and their indexes
+# stay bounded. Same columns as the hot tables plus archivedtime; get-by-id, trace and
+# the KPI rebuild read both. A unit's consumption ledger is folded into usedrecords
+class RawMaterialTraceArchive(Base):
+    __tablename__ = "rawmaterialtracerecord_archive"
+    traceid = Column(String(32), primary_key=True)
+    materialbatchno = Column(String(20), nullable=False)
+    tracecode = Column(String(36), nullable=False, unique=True)
+    supplierid = Column(String(20), nullable=False)
+    purchaseorderid = Column(String(20), nullable=False)
+    incominginspectionid = Column(String(32), nullable=False)
+    receivetime = Column(TIMESTAMP, nullable=False)
+    storagelocation = Column(String(50), nullable=False)
+    usedrecords = Column(JSON, nullable=False, default=list)
+    remainingqty = Column(DECIMAL(10, 2), nullable=False, default=0.00)
+    tracestatus = Column(String(15), nullable=False)
+    archivedtime = Column(TIMESTAMP, nullable=False)
+
+    __table_args__ = (
+        Index("ix_rawmaterialarchive_supplier_receivetime", "supplierid", "receivetime", "traceid"),
+    )
+
+
+class QualityRiskWarningArchive(Base):
+    __tablename__ = "qualityriskwarning_archive"
+    warningid = Column(String(32), primary_key=True)
+    warningobject = Column(String(15), nullable=False)
+    objectid = Column(String(32), nullable=False)
+    risktype = Column(String(50), nullable=False)
+    risklevel = Column(Integer, nullable=False)
+    triggercondition = Column(Text, nullable=False)
+    triggertime = Column(TIMESTAMP, nullable=False)
+    handlerid = Column(String(20), nullable=False)
+    handlestatus = Column(String(15), nullable=False)
+    handleresult = Column(Text, nullable=True)
+    archivedtime = Column(TIMESTAMP, nullable=False)
+
+    __table_args__ = (
+        # Supplier KPI attribution joins warnings to units by objectid
+        Index("ix_warningarchive_objectid", "objectid"),
+    )
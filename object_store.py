@@ -0,0 +1,244 @@
+"""
+Content-addressed object storage for attachments (inspection reports,
+supplier certificates).
+
+Objects are keyed by the SHA-256 of their bytes, so the same file uploaded
+twice is stored once. Uploads go through an ObjectWriter: each chunk is
+hashed and appended to a temporary file as it arrives, and commit() moves the
+finished file into place under its hash. Reads return an iterator over a
+byte range. At no point is a whole object held in memory.
+
+ObjectStore is the interface used by the API. Two implementations:
+
+- LocalObjectStore: files under a root directory (<root>/ab/cd/<sha256>) for
+  offline/line-side use. The temporary file lives in <root>/tmp on the same
+  filesystem, so the final os.replace is atomic and readers never see a
+  partial object.
+- MinioObjectStore: wraps the MinIO client from db_clients. The key is only
+  known once the upload has been hashed, so chunks are spooled to a local
+  temporary file and uploaded with fput_object (multipart for large files).
+
+Objects are never deleted on the request path: several attachments may
+share one, and an upload of the same content can be in flight. gc() removes
+objects no attachment references once they are older than a grace period
+(`python manage.py gc-objects`).
+"""
+import hashlib
+import os
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple
+
+OBJECT_CHUNK_BYTES = 64 * 1024
+
+
+class ObjectTooLarge(Exception):
+    """The upload exceeded the writer's size limit."""
+
+
+class StoredObject(NamedTuple):
+    sha256: str
+    size: int
+    # False when an object with the same content was already stored
+    created: bool
+
+
+class ObjectWriter:
+    """One upload in progress: write() chunks, then commit() or abort()."""
+
+    def __init__(self, store: "ObjectStore", directory: Optional[str], max_bytes: Optional[int] = None):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(dir=directory, prefix="upload-", delete=False)
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise ObjectTooLarge(f"object larger than {self.max_bytes} bytes")
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self) -> StoredObject:
+        self._file.close()
+        sha256 = self._hash.hexdigest()
+        try:
+            created = self.store._store(self._file.name, sha256, self.size)
+        finally:
+            self._discard()
+        return StoredObject(sha256, self.size, created)
+
+    def abort(self) -> None:
+        self._file.close()
+        self._discard()
+
+    def _discard(self) -> None:
+        try:
+            os.remove(self._file.name)
+        except FileNotFoundError:
+            pass
+
+
+class ObjectStore(ABC):
+    name = "base"
+
+    @abstractmethod
+    def writer(self, max_bytes: Optional[int] = None) -> ObjectWriter:
+        ...
+
+    def put(self, chunks: Iterable[bytes], max_bytes: Optional[int] = None) -> StoredObject:
+        writer = self.writer(max_bytes)
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    @abstractmethod
+    def _store(self, path: str, sha256: str, size: int) -> bool:
+        """Move the finished temporary file at `path` into place; False if the object already existed."""
+
+    @abstractmethod
+    def size(self, sha256: str) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    def read(self, sha256: str, start: int = 0, length: Optional[int] = None) -> Iterator[bytes]:
+        """Chunks of the object from byte `start`, `length` bytes (to the end when None)."""
+
+    @abstractmethod
+    def list(self) -> Iterator[Tuple[str, float]]:
+        """(sha256, modification time) of every stored object."""
+
+    @abstractmethod
+    def delete(self, sha256: str) -> None:
+        ...
+
+    def gc(self, referenced, grace_seconds: float = 3600) -> dict:
+        """Delete objects not in `referenced` (a container of hashes) that are older than `grace_seconds`."""
+        cutoff = time.time() - grace_seconds
+        kept = deleted = 0
+        for sha256, modified in list(self.list()):
+            if sha256 in referenced or modified > cutoff:
+                kept += 1
+            else:
+                self.delete(sha256)
+                deleted += 1
+        return {"kept": kept, "deleted": deleted}
+
+
+class LocalObjectStore(ObjectStore):
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = root
+        self._tmp = os.path.join(root, "tmp")
+        os.makedirs(self._tmp, exist_ok=True)
+
+    def _path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def writer(self, max_bytes: Optional[int] = None) -> ObjectWriter:
+        return ObjectWriter(self, self._tmp, max_bytes)
+
+    def _store(self, path: str, sha256: str, size: int) -> bool:
+        target = self._path(sha256)
+        if os.path.exists(target):
+            # Refresh the age so gc() does not collect an object that just gained a reference
+            os.utime(target)
+            return False
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        return True
+
+    def size(self, sha256: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self._path(sha256))
+        except FileNotFoundError:
+            return None
+
+    def read(self, sha256: str, start: int = 0, length: Optional[int] = None) -> Iterator[bytes]:
+        with open(self._path(sha256), "rb") as f:
+            f.seek(start)
+            remaining = length
+            while remaining is None or remaining > 0:
+                chunk = f.read(OBJECT_CHUNK_BYTES if remaining is None else min(OBJECT_CHUNK_BYTES, remaining))
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def list(self) -> Iterator[Tuple[str, float]]:
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root and "tmp" in dirnames:
+                dirnames.remove("tmp")
+            for filename in filenames:
+                if len(filename) == 64:
+                    yield filename, os.path.getmtime(os.path.join(dirpath, filename))
+
+    def delete(self, sha256: str) -> None:
+        try:
+            os.remove(self._path(sha256))
+        except FileNotFoundError:
+            pass
+
+
+class MinioObjectStore(ObjectStore):
+    name = "minio"
+
+    def __init__(self, client, bucket: str, spool_dir: Optional[str] = None):
+        self.client = client
+        self.bucket = bucket
+        self.spool_dir = spool_dir
+        self._bucket_checked = False
+
+    def _ensure_bucket(self) -> None:
+        if not self._bucket_checked:
+            if not self.client.bucket_exists(self.bucket):
+                self.client.make_bucket(self.bucket)
+            self._bucket_checked = True
+
+    def writer(self, max_bytes: Optional[int] = None) -> ObjectWriter:
+        return ObjectWriter(self, self.spool_dir, max_bytes)
+
+    def _store(self, path: str, sha256: str, size: int) -> bool:
+        self._ensure_bucket()
+        if self.size(sha256) is not None:
+            # Server-side self-copy refreshes last_modified, which gc() uses as the object's age
+            from minio.commonconfig import REPLACE, CopySource
+
+            self.client.copy_object(self.bucket, sha256, CopySource(self.bucket, sha256),
+                                    metadata={"x-amz-meta-reused": str(int(time.time()))}, metadata_directive=REPLACE)
+            return False
+        self.client.fput_object(self.bucket, sha256, path)
+        return True
+
+    def size(self, sha256: str) -> Optional[int]:
+        from minio.error import S3Error
+
+        try:
+            return self.client.stat_object(self.bucket, sha256).size
+        except S3Error as exc:
+            if exc.code in ("NoSuchKey", "NoSuchBucket"):
+                return None
+            raise
+
+    def read(self, sha256: str, start: int = 0, length: Optional[int] = None) -> Iterator[bytes]:
+        response = self.client.get_object(self.bucket, sha256, offset=start, length=length or 0)
+        try:
+            yield from response.stream(OBJECT_CHUNK_BYTES)
+        finally:
+            response.close()
+            response.release_conn()
+
+    def list(self) -> Iterator[Tuple[str, float]]:
+        for obj in self.client.list_objects(self.bucket):
+            yield obj.object_name, obj.last_modified.timestamp()
+
+    def delete(self, sha256: str) -> None:
+        self.client.remove_object(self.bucket, sha256)
@@ -0,0 +1,139 @@
+"""
+Password hashing off the request path.
+
+pbkdf2 costs tens of milliseconds of CPU per call. Login runs the hash on a
+dedicated bounded executor rather than in the event loop or in Starlette's
+shared threadpool, so a burst of logins at shift change cannot starve other
+requests of threads. hashlib's pbkdf2 releases the GIL, so a thread pool
+scales across cores; PASSWORD_HASH_EXECUTOR=process is available for schemes
+that do not. When more than PASSWORD_HASH_MAX_PENDING calls are already
+waiting, new ones fail fast with HashingBusy instead of queueing without bound.
+
+The cost is PASSWORD_HASH_ROUNDS. Hashes with any other round count are
+flagged by verify_and_update and replaced on the next successful login.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+PASSWORD_HASH_SCHEME = "pbkdf2_sha256"
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "29000"))
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "256"))
+
+_contexts = {}
+
+
+def make_context(rounds: int = PASSWORD_HASH_ROUNDS) -> CryptContext:
+    # min == max == default: hashes at any other cost need an update
+    return CryptContext(
+        schemes=[PASSWORD_HASH_SCHEME],
+        deprecated="auto",
+        **{f"{PASSWORD_HASH_SCHEME}__{k}": rounds for k in ("default_rounds", "min_rounds", "max_rounds")},
+    )
+
+
+def _context(rounds: int) -> CryptContext:
+    # Module-level and keyed by rounds so the same functions work in worker processes
+    context = _contexts.get(rounds)
+    if context is None:
+        context = _contexts[rounds] = make_context(rounds)
+    return context
+
+
+def _hash(rounds: int, password: str) -> str:
+    return _context(rounds).hash(password)
+
+
+def _verify_and_update(rounds: int, password: str, hashed: Optional[str]) -> Tuple[bool, Optional[str]]:
+    context = _context(rounds)
+    if hashed is None:
+        # Unknown user: spend the same time as a real check so usernames cannot be probed by latency
+        context.dummy_verify()
+        return False, None
+    return context.verify_and_update(password, hashed)
+
+
+class HashingBusy(Exception):
+    """Too many hash operations are already queued."""
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = PASSWORD_HASH_ROUNDS, workers: int = PASSWORD_HASH_WORKERS,
+                 max_pending: int = PASSWORD_HASH_MAX_PENDING, executor: str = PASSWORD_HASH_EXECUTOR):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor_kind = executor
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.executor_kind == "process":
+                        # Imported on demand: pulls in multiprocessing, which slows every startup otherwise
+                        from concurrent.futures import ProcessPoolExecutor
+
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pwhash")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingBusy()
+            self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, self.rounds, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify_and_update(self, password: str, hashed: Optional[str]) -> Tuple[bool, Optional[str]]:
+        """Return (valid, new_hash); new_hash is set when the stored hash should be replaced."""
+        valid, new_hash = await self._run(_verify_and_update, password, hashed)
+        if new_hash is not None:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def hash_sync(self, password: str) -> str:
+        """Blocking variant for scripts and startup seeding."""
+        return _hash(self.rounds, password)
+
+    def verify_sync(self, password: str, hashed: str) -> bool:
+        return _verify_and_update(self.rounds, password, hashed)[0]
+
+    def stats(self) -> dict:
+        return {
+            "scheme": PASSWORD_HASH_SCHEME,
+            "rounds": self.rounds,
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,182 @@
+"""
+Quality rule engine (Section 6.2.2).
+
+Inspection measurements are compared against per-material thresholds
+(a [lower, upper] range, or nominal +/- tolerance). Rules are compiled into a
+lookup keyed by (materialtype, parameter), with "*" as a wildcard material
+type. A batch is evaluated column-wise per rule group, so the per-measurement
+cost is one dict lookup and two comparisons. Out-of-range values become
+QualityRiskWarning rows whose risklevel grows with the relative deviation;
+warnings already open for the same objectid/risktype are not duplicated, and
+new ones are written with one executemany.
+"""
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import kpi
+from models import QualityRiskWarning
+from traceability import chunked
+
+QUALITY_RULES_PATH = os.getenv("QUALITY_RULES_PATH", "")
+QUALITY_RULES_HANDLER = os.getenv("QUALITY_RULES_HANDLER", "QA-AUTO")
+
+# (max relative deviation, risklevel); anything beyond the last step is level 5
+RISK_LEVEL_STEPS = ((0.05, 2), (0.15, 3), (0.30, 4))
+
+DEFAULT_RULES = [
+    {"materialtype": "Titanium Alloy", "parameter": "tensile_strength", "lower": 895, "upper": 1100, "unit": "MPa"},
+    {"materialtype": "Titanium Alloy", "parameter": "elongation", "lower": 10, "unit": "%"},
+    {"materialtype": "Aluminium Alloy", "parameter": "tensile_strength", "lower": 470, "upper": 570, "unit": "MPa"},
+    {"materialtype": "Aluminium Alloy", "parameter": "hardness", "lower": 135, "upper": 165, "unit": "HB"},
+    {"materialtype": "*", "parameter": "diameter", "nominal": 10.0, "tolerance": 0.05, "unit": "mm"},
+]
+
+
+class CompiledRule(NamedTuple):
+    lower: float
+    upper: float
+    span: float
+    unit: str
+    risktype: str
+    handlerid: str
+
+
+def compile_rule(rule: dict) -> CompiledRule:
+    if rule.get("nominal") is not None and rule.get("tolerance") is not None:
+        lower = rule["nominal"] - rule["tolerance"]
+        upper = rule["nominal"] + rule["tolerance"]
+    else:
+        lower = rule.get("lower")
+        upper = rule.get("upper")
+        if lower is None and upper is None:
+            raise ValueError(f"Rule for {rule.get('parameter')} needs lower/upper or nominal/tolerance")
+        lower = float("-inf") if lower is None else lower
+        upper = float("inf") if upper is None else upper
+    if lower > upper:
+        raise ValueError(f"Rule for {rule.get('parameter')} has lower > upper")
+    finite = [abs(v) for v in (lower, upper) if v not in (float("-inf"), float("inf"))]
+    # Deviation is measured relative to the tolerance band, or to the bound for one-sided rules
+    span = (upper - lower) if len(finite) == 2 and upper > lower else (max(finite) if finite else 1.0)
+    return CompiledRule(
+        lower=lower,
+        upper=upper,
+        span=span or 1.0,
+        unit=rule.get("unit") or "",
+        risktype=(rule.get("risktype") or f"Out of Tolerance: {rule['parameter']}")[:50],
+        handlerid=rule.get("handlerid") or QUALITY_RULES_HANDLER,
+    )
+
+
+def risk_level(deviation: float) -> int:
+    for limit, level in RISK_LEVEL_STEPS:
+        if deviation <= limit:
+            return level
+    return 5
+
+
+class QualityRuleEngine:
+    def __init__(self, rules: Sequence[dict] = ()):
+        self.rules: List[dict] = []
+        self._compiled: Dict[Tuple[str, str], CompiledRule] = {}
+        self.load(rules)
+
+    def load(self, rules: Sequence[dict]) -> None:
+        """Compile and swap in a new rule set; the old set stays active if compilation fails."""
+        compiled = {(r["materialtype"], r["parameter"]): compile_rule(r) for r in rules}
+        self.rules, self._compiled = list(rules), compiled
+
+    def lookup(self, materialtype: str, parameter: str) -> Optional[CompiledRule]:
+        return self._compiled.get((materialtype, parameter)) or self._compiled.get(("*", parameter))
+
+    def evaluate(self, measurements: Sequence[dict]) -> dict:
+        """Return out-of-range findings, merged per (objectid, risktype) keeping the worst deviation."""
+        groups: Dict[Tuple[str, str], List[int]] = {}
+        for i, m in enumerate(measurements):
+            groups.setdefault((m["materialtype"], m["parameter"]), []).append(i)
+
+        findings: Dict[Tuple[str, str], dict] = {}
+        unmatched = 0
+        for (materialtype, parameter), indexes in groups.items():
+            rule = self.lookup(materialtype, parameter)
+            if rule is None:
+                unmatched += len(indexes)
+                continue
+            lower, upper, span = rule.lower, rule.upper, rule.span
+            values = [measurements[i]["value"] for i in indexes]
+            deviations = [(lower - v) / span if v < lower else (v - upper) / span if v > upper else 0.0 for v in values]
+            for i, value, deviation in zip(indexes, values, deviations):
+                if deviation <= 0:
+                    continue
+                m = measurements[i]
+                key = (m["objectid"], rule.risktype)
+                current = findings.get(key)
+                if current is None or deviation > current["deviation"]:
+                    findings[key] = {
+                        "measurement": m,
+                        "rule": rule,
+                        "value": value,
+                        "deviation": deviation,
+                        "risklevel": risk_level(deviation),
+                    }
+        return {"findings": findings, "unmatched": unmatched}
+
+    def raise_warnings(self, db: Session, measurements: Sequence[dict]) -> dict:
+        """Evaluate a batch and bulk-insert warnings that are not already open."""
+        result = self.evaluate(measurements)
+        findings = result["findings"]
+
+        open_keys = set()
+        objectids = list({objectid for objectid, _ in findings})
+        for chunk in chunked(objectids):
+            open_keys.update(
+                db.query(QualityRiskWarning.objectid, QualityRiskWarning.risktype)
+                .filter(QualityRiskWarning.objectid.in_(chunk), QualityRiskWarning.handlestatus != "Closed")
+            )
+
+        now = datetime.now(timezone.utc)
+        rows = []
+        for key, f in findings.items():
+            if key in open_keys:
+                continue
+            m, rule = f["measurement"], f["rule"]
+            bounds = f"[{rule.lower:g}, {rule.upper:g}]"
+            condition = f"{m['parameter']}={f['value']:g}{rule.unit} outside {bounds}{rule.unit}"
+            if m.get("inspectionid"):
+                condition += f" (inspection {m['inspectionid']})"
+            rows.append({
+                "warningid": "QW" + uuid.uuid4().hex[:30],
+                "warningobject": m.get("warningobject") or "Raw Material",
+                "objectid": m["objectid"],
+                "risktype": rule.risktype,
+                "risklevel": f["risklevel"],
+                "triggercondition": condition,
+                "triggertime": m.get("measuredtime") or now,
+                "handlerid": rule.handlerid,
+                "handlestatus": "Pending Handling",
+                "handleresult": None,
+            })
+        if rows:
+            db.execute(insert(QualityRiskWarning), rows)
+            kpi.add_warnings(db, rows)
+        db.commit()
+        return {
+            "received": len(measurements),
+            "unmatched": result["unmatched"],
+            "violations": len(findings),
+            "duplicates_suppressed": len(findings) - len(rows),
+            "warnings_created": len(rows),
+            "warningids": [r["warningid"] for r in rows],
+        }
+
+
+def load_rules() -> List[dict]:
+    if QUALITY_RULES_PATH:
+        with open(QUALITY_RULES_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    return DEFAULT_RULES
@@ -0,0 +1,115 @@
+"""
+Read-through cache of serialized single-record responses, plus ETag helpers.
+
+Shop-floor scanners look up the same trace codes over and over. Entries hold
+the final JSON bytes and their ETag, keyed by (kind, id), so a hit costs no
+query and no Pydantic serialization. The cache is bounded to `maxsize`
+entries with LRU eviction; write handlers invalidate the ids they change.
+Entries also expire after `ttl` seconds, which bounds staleness when several
+worker processes each hold their own cache.
+
+ETags are a hash of the response body, so they are valid for any response
+(cached or not) and a client sending a matching If-None-Match gets a 304.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation; a load that started before one is not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.maxsize > 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, kind: str, key: str) -> Optional[CachedResponse]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[(kind, key)]
+                self.misses += 1
+                return None
+            self._entries.move_to_end((kind, key))
+            self.hits += 1
+            return entry[0]
+
+    def put(self, kind: str, key: str, body: bytes, generation: Optional[int] = None) -> CachedResponse:
+        """Store `body`; skipped if anything was invalidated since `generation` was read."""
+        cached = CachedResponse(body, make_etag(body))
+        if not self.enabled:
+            return cached
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return cached
+            self._entries[(kind, key)] = (cached, time.time() + self.ttl)
+            self._entries.move_to_end((kind, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return cached
+
+    def invalidate(self, kind: str, *keys: str) -> None:
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop((kind, key), None)
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,137 @@
+"""
+Substring search over the trace tables, backed by an index.
+
+- SQLite: one external-content FTS5 table per searched table with the
+  trigram tokenizer (SQLite >= 3.34), kept in sync by triggers, so every
+  writer (ORM, bulk executemany, scripts) updates it. A query of three or
+  more characters is a trigram index lookup; shorter queries fall back to
+  LIKE. The FTS tables map back by rowid, so run rebuild() after a VACUUM
+  (`python manage.py rebuild-search`).
+- PostgreSQL: GIN pg_trgm indexes on the concatenated search columns;
+  queries use ILIKE on the same expression, which the index serves.
+- Anything else: LIKE across the search columns (no index).
+"""
+import sqlite3
+from typing import Dict, Tuple
+
+from sqlalchemy import func, literal_column, or_, text
+from sqlalchemy.exc import OperationalError
+
+from models import BatchTraceRelation, QualityRiskWarning, RawMaterialTraceRecord
+
+SEARCH_FIELDS: Dict[str, Tuple[str, ...]] = {
+    RawMaterialTraceRecord.__tablename__: ("traceid", "tracecode", "materialbatchno", "supplierid"),
+    BatchTraceRelation.__tablename__: ("relationid", "producttracecode", "materialtracecode", "productbatchno", "equipmentid"),
+    QualityRiskWarning.__tablename__: ("warningid", "objectid", "risktype", "triggercondition", "handlerid"),
+}
+TRIGRAM_MIN_CHARS = 3
+
+
+def fts_table(table: str) -> str:
+    return f"{table}_fts"
+
+
+def _sqlite_statements(table: str, fields: Tuple[str, ...]) -> list:
+    fts = fts_table(table)
+    cols = ", ".join(fields)
+    new = ", ".join(f"new.{f}" for f in fields)
+    old = ", ".join(f"old.{f}" for f in fields)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', content_rowid='rowid', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old}); END",
+        # Only searched columns re-index; quantity/status updates do not touch the FTS table
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new}); END",
+    ]
+
+
+def _concat(model):
+    return func.concat_ws(" ", *(getattr(model, f) for f in SEARCH_FIELDS[model.__tablename__]))
+
+
+def ensure_index(engine) -> str:
+    """Create the search index for the engine's dialect; return the backend name in use."""
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        if sqlite3.sqlite_version_info < (3, 34, 0):
+            return "like"
+        try:
+            with engine.begin() as conn:
+                for table, fields in SEARCH_FIELDS.items():
+                    exists = conn.exec_driver_sql(
+                        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (fts_table(table),)
+                    ).first()
+                    for statement in _sqlite_statements(table, fields):
+                        conn.exec_driver_sql(statement)
+                    if not exists:
+                        # Index rows that predate the FTS table
+                        conn.exec_driver_sql(f"INSERT INTO {fts_table(table)}({fts_table(table)}) VALUES ('rebuild')")
+        except OperationalError:
+            # FTS5 not compiled in
+            return "like"
+        return "fts5"
+    if dialect == "postgresql":
+        try:
+            with engine.begin() as conn:
+                conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                for model in (RawMaterialTraceRecord, BatchTraceRelation, QualityRiskWarning):
+                    fields = ", ".join(SEARCH_FIELDS[model.__tablename__])
+                    conn.exec_driver_sql(
+                        f"CREATE INDEX IF NOT EXISTS ix_{model.__tablename__}_trgm ON {model.__tablename__} "
+                        f"USING gin ((concat_ws(' ', {fields})) gin_trgm_ops)"
+                    )
+        except Exception:
+            return "like"
+        return "pg_trgm"
+    return "like"
+
+
+def detect_backend(engine) -> str:
+    """Backend name for an index created earlier by ensure_index (one catalog query, no DDL)."""
+    dialect = engine.dialect.name
+    with engine.connect() as conn:
+        if dialect == "sqlite":
+            names = [fts_table(table) for table in SEARCH_FIELDS]
+            found = conn.exec_driver_sql(
+                f"SELECT count(*) FROM sqlite_master WHERE type='table' AND name IN ({', '.join('?' * len(names))})",
+                tuple(names),
+            ).scalar()
+            return "fts5" if found == len(names) else "like"
+        if dialect == "postgresql":
+            names = tuple(f"ix_{table}_trgm" for table in SEARCH_FIELDS)
+            found = conn.exec_driver_sql("SELECT count(*) FROM pg_indexes WHERE indexname = ANY(%(names)s)", {"names": list(names)}).scalar()
+            return "pg_trgm" if found == len(names) else "like"
+    return "like"
+
+
+def rebuild(engine) -> None:
+    """Re-index every row (SQLite FTS only), e.g. after VACUUM renumbered rowids."""
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        for table in SEARCH_FIELDS:
+            conn.exec_driver_sql(f"INSERT INTO {fts_table(table)}({fts_table(table)}) VALUES ('rebuild')")
+
+
+def _like_pattern(q: str) -> str:
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def search_condition(model, q: str, backend: str):
+    """WHERE clause matching rows of `model` whose search columns contain `q` (case-insensitive)."""
+    table = model.__tablename__
+    if backend == "fts5" and len(q) >= TRIGRAM_MIN_CHARS:
+        fts = fts_table(table)
+        phrase = '"' + q.replace('"', '""') + '"'
+        return literal_column(f"{table}.rowid").in_(
+            text(f"SELECT rowid FROM {fts} WHERE {fts} MATCH :search_phrase").bindparams(search_phrase=phrase)
+        )
+    pattern = _like_pattern(q)
+    if backend == "pg_trgm":
+        return _concat(model).ilike(pattern, escape="\\")
+    return or_(*(getattr(model, f).ilike(pattern, escape="\\") for f in SEARCH_FIELDS[table]))
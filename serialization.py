@@ -0,0 +1,114 @@
+"""
+Fast JSON encoding of read responses (lists, search pages, traces).
+
+Returning rows through a response_model builds an ORM object and a Pydantic
+model per row before the JSON encoder runs; for a page of PAGE_SIZE_MAX rows
+that costs more than the query. Read endpoints instead select only the
+columns their schema declares, as row tuples (columns()), and encode them
+with a plan compiled once per schema (encoder()):
+
+- fields in declaration order, read from dicts, result rows or ORM objects
+- float fields coerced the way Pydantic does (DECIMAL columns arrive as Decimal)
+- nested models and lists of models encoded recursively
+- everything else (str, int, datetime, JSON columns) passed through
+
+For the types used by the read schemas the bytes equal model_dump_json(),
+so ETags do not depend on which path produced a body. Endpoints keep their
+response_model, so the OpenAPI schema is unchanged; returning the encoded
+Response skips the per-row validation.
+
+orjson is used when installed (OPT_UTC_Z writes UTC as "Z" like Pydantic),
+otherwise the standard library json module.
+"""
+import json
+import typing
+from decimal import Decimal
+from functools import partial
+from typing import Callable, Dict, List, Sequence
+
+from pydantic import BaseModel
+from sqlalchemy.engine import Row
+
+_orjson = None
+_plans: Dict[type, Callable[[object], dict]] = {}
+_columns: Dict[tuple, list] = {}
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, "isoformat"):
+        text = value.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def dumps(value) -> bytes:
+    global _orjson
+    if _orjson is None:
+        try:
+            import orjson as _orjson
+        except ImportError:
+            _orjson = False
+    if _orjson:
+        return _orjson.dumps(value, default=_default, option=_orjson.OPT_UTC_Z)
+    return json.dumps(value, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def _optional(convert):
+    return lambda value: None if value is None else convert(value)
+
+
+def _converter(annotation):
+    """A function applied to a field's value before encoding, or None to pass it through."""
+    origin, args = typing.get_origin(annotation), typing.get_args(annotation)
+    if origin is typing.Union and type(None) in args:
+        inner = [a for a in args if a is not type(None)]
+        convert = _converter(inner[0]) if len(inner) == 1 else None
+        return _optional(convert) if convert else None
+    if annotation is float:
+        return float
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return encoder(annotation)
+    if origin in (list, List) and args:
+        item = _converter(args[0])
+        return (lambda values: [item(v) for v in values]) if item else None
+    return None
+
+
+def encoder(schema: type) -> Callable[[object], dict]:
+    """Compile (once) the function turning a dict, row or object into the JSON-ready dict for `schema`."""
+    plan = _plans.get(schema)
+    if plan is None:
+        fields = [(name, _converter(field.annotation)) for name, field in schema.model_fields.items()]
+
+        def plan(value) -> dict:
+            if isinstance(value, dict):
+                get = value.__getitem__
+            elif isinstance(value, Row):
+                get = value._mapping.__getitem__
+            else:
+                get = partial(getattr, value)
+            return {name: convert(get(name)) if convert else get(name) for name, convert in fields}
+
+        _plans[schema] = plan
+    return plan
+
+
+def encode(schema: type, value) -> bytes:
+    return dumps(encoder(schema)(value))
+
+
+def encode_list(schema: type, values: Sequence[object]) -> bytes:
+    plan = encoder(schema)
+    return dumps([plan(value) for value in values])
+
+
+def columns(model, schema: type) -> list:
+    """The columns of `model` that `schema` declares, in schema order, for a row-tuple select."""
+    key = (model, schema)
+    selected = _columns.get(key)
+    if selected is None:
+        table = model.__table__
+        selected = _columns[key] = [table.c[name] for name in schema.model_fields if name in table.c]
+    return selected
@@ -0,0 +1,105 @@
+"""
+Multi-worker launcher: one supervisor process, WORKERS uvicorn worker
+processes sharing the listening socket.
+
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+
+Before starting workers the supervisor applies migrations and seeds the
+admin user once (unless AUTO_MIGRATE=0), so workers only find the schema up
+to date. Workers are spawned, not forked: each imports main and creates its
+own engines, pools and lazy clients, and configuration reaches them only
+through the environment. SECRET_KEY in particular must be identical in every
+worker; if it is unset a random key is generated for this launch (tokens then
+do not survive a restart, so set it in production).
+
+The graph outbox (graph_sync.py) is drained by the supervisor on a
+background thread; workers start with GRAPH_SYNC_WORKER=0 and only enqueue.
+Set GRAPH_SYNC_WORKER=0 for serve.py as well to drain elsewhere.
+
+uvicorn restarts workers that die. gunicorn also works (Linux):
+
+    GRAPH_SYNC_WORKER=0 gunicorn main:app -k uvicorn.workers.UvicornWorker -w 4 -b 0.0.0.0:8000
+    python manage.py graph-sync     # the one graph outbox drainer
+
+db_clients resets pools and clients after a fork, so --preload is safe too;
+run `python manage.py migrate` and `seed` first in that case.
+"""
+import argparse
+import logging
+import os
+import secrets
+
+logger = logging.getLogger("serve")
+
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 1)))
+
+
+def prepare_environment() -> bool:
+    """Settings every worker must agree on, exported before workers start.
+
+    Returns whether the supervisor should drain the graph outbox.
+    """
+    if not os.getenv("SECRET_KEY"):
+        logger.warning("SECRET_KEY is not set; using a random key for this launch (tokens end at restart)")
+        os.environ["SECRET_KEY"] = secrets.token_urlsafe(32)
+    drain = os.getenv("GRAPH_SYNC_WORKER", "1") == "1"
+    os.environ["GRAPH_SYNC_WORKER"] = "0"
+    return drain
+
+
+def bootstrap() -> dict:
+    """Migrate and seed once in the supervisor, then release its connections."""
+    from sqlalchemy.orm import sessionmaker
+
+    import manage
+    from db_clients import DEFAULT_SQLALCHEMY_URL, create_sqlalchemy_engine
+
+    engine = create_sqlalchemy_engine(DEFAULT_SQLALCHEMY_URL)
+    try:
+        return manage.bootstrap(engine, sessionmaker(bind=engine))
+    finally:
+        engine.dispose()
+
+
+def start_graph_sync():
+    """Start the graph outbox drainer in the supervisor; None when no graph store is configured."""
+    from sqlalchemy.orm import sessionmaker
+
+    import graph_sync
+    from db_clients import DEFAULT_SQLALCHEMY_URL, create_sqlalchemy_engine
+
+    sink = graph_sync.create_sink()
+    if sink is None:
+        return None
+    worker = graph_sync.GraphSyncWorker(sessionmaker(bind=create_sqlalchemy_engine(DEFAULT_SQLALCHEMY_URL)), sink)
+    worker.start()
+    return worker
+
+
+def run(host: str = "127.0.0.1", port: int = 8000, workers: int = WORKERS) -> None:
+    import uvicorn
+
+    drain = prepare_environment()
+    if os.getenv("AUTO_MIGRATE", "1") == "1":
+        logger.info("bootstrap: %s", bootstrap())
+    graph_worker = start_graph_sync() if drain else None
+    try:
+        # An import string, so each spawned worker imports the app itself
+        uvicorn.run("main:app", host=host, port=port, workers=max(1, workers))
+    finally:
+        if graph_worker is not None:
+            graph_worker.stop()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:     %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="worker processes (default: WORKERS or CPU count)")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    args = parser.parse_args()
+    run(args.host, args.port, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Runtime settings changed through the API that every worker process must
+agree on: the quality rule set and the sampling profiler.
+
+Under serve.py each worker holds its own rule engine and profiler, so a PUT
+handled by one worker must not only change that worker. store() writes the
+value to the sharedsetting table with version + 1 and applies it locally;
+every other process re-reads the row once its stored version differs from
+the one it applied:
+
+- before each use, with refresh(db) (one primary-key lookup; the quality
+  rule endpoints do this so no measurement is judged by an old rule set);
+- every SHARED_SETTINGS_POLL_SECONDS on a Watcher thread, for settings that
+  are not read on a request path (the profiler).
+
+Versions only move forward, so a slow refresh never rolls back a newer value.
+A process with no stored row keeps its startup value (QUALITY_RULES_PATH,
+PROFILER_ENABLED).
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Optional, Sequence
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import SharedSetting
+
+logger = logging.getLogger(__name__)
+
+SHARED_SETTINGS_POLL_SECONDS = float(os.getenv("SHARED_SETTINGS_POLL_SECONDS", "5"))
+
+
+class SharedValue:
+    def __init__(self, key: str, apply: Callable[[object], None]):
+        self.key = key
+        self.apply = apply
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def _apply(self, value, version: int) -> None:
+        with self._lock:
+            if version > self.version:
+                self.apply(value)
+                self.version = version
+
+    def refresh(self, db: Session) -> bool:
+        """Apply the stored value if it is newer than the one this process has; return whether it was."""
+        version = db.execute(select(SharedSetting.version).where(SharedSetting.key == self.key)).scalar()
+        if version is None or version <= self.version:
+            return False
+        value, version = db.execute(
+            select(SharedSetting.value, SharedSetting.version).where(SharedSetting.key == self.key)
+        ).one()
+        self._apply(value, version)
+        return True
+
+    def store(self, db: Session, value) -> int:
+        """Persist `value` for all processes and apply it here; validate it before calling this."""
+        now = datetime.now(timezone.utc)
+        version = db.execute(
+            update(SharedSetting).where(SharedSetting.key == self.key)
+            .values(value=value, version=SharedSetting.version + 1, updatedtime=now)
+            .returning(SharedSetting.version)
+        ).scalar()
+        if version is None:
+            try:
+                db.execute(insert(SharedSetting).values(key=self.key, value=value, version=1, updatedtime=now))
+                version = 1
+            except IntegrityError:
+                # Another process stored the first version meanwhile
+                db.rollback()
+                return self.store(db, value)
+        db.commit()
+        self._apply(value, version)
+        return version
+
+
+class Watcher:
+    """Background thread refreshing shared values every `interval` seconds."""
+
+    def __init__(self, session_factory, values: Sequence[SharedValue], interval: float = SHARED_SETTINGS_POLL_SECONDS):
+        self.session_factory = session_factory
+        self.values = list(values)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh_all(self) -> None:
+        with self.session_factory() as db:
+            for value in self.values:
+                value.refresh(db)
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh_all()
+            except Exception:
+                logger.exception("shared settings refresh failed")
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="shared-settings", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
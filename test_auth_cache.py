@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+import main
+from auth_cache import Principal, TokenCache
+from models import User
+
+
+def login(client, username, password):
+    response = client.post("/auth/login", data={"username": username, "password": password})
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def operator(client):
+    with main.SessionLocal() as db:
+        db.query(User).filter(User.username == "operator").delete()
+        db.add(User(username="operator", hashed_password=main.get_password_hash("secret"), role="user"))
+        db.commit()
+    return login(client, "operator", "secret")
+
+
+def set_role(username, role):
+    with main.SessionLocal() as db:
+        db.query(User).filter(User.username == username).one().role = role
+        db.commit()
+
+
+def test_entries_expire_with_the_token():
+    cache = TokenCache(ttl=60)
+    cache.put("a", Principal(1, "a", "user"), token_exp=time.time() - 1)
+    cache.put("b", Principal(1, "a", "user"))
+    assert cache.get("a") is None
+    assert cache.get("b") == Principal(1, "a", "user")
+
+
+def test_lru_eviction_and_user_invalidation():
+    cache = TokenCache(maxsize=2, ttl=60)
+    cache.put("a", Principal(1, "a", "user"))
+    cache.put("b", Principal(2, "b", "user"))
+    cache.get("a")
+    cache.put("c", Principal(1, "a", "user"))
+    assert cache.get("b") is None
+    cache.invalidate_user(1)
+    assert (cache.get("a"), cache.get("c")) == (None, None)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cached_principal_is_reused(client, operator):
+    assert client.get("/me", headers=operator).json()["role"] == "user"
+    hits = main.token_cache.hits
+    assert client.get("/me", headers=operator).status_code == 200
+    assert main.token_cache.hits == hits + 1
+
+
+def test_role_change_is_seen_on_the_next_request(client, operator):
+    assert client.get("/auth/cache-stats", headers=operator).status_code == 403
+    set_role("operator", "admin")
+    assert client.get("/me", headers=operator).json()["role"] == "admin"
+    assert client.get("/auth/cache-stats", headers=operator).status_code == 200
+
+
+def test_deleted_user_is_rejected(client, operator):
+    assert client.get("/me", headers=operator).status_code == 200
+    with main.SessionLocal() as db:
+        db.delete(db.query(User).filter(User.username == "operator").one())
+        db.commit()
+    assert client.get("/me", headers=operator).status_code == 401
@@ -0,0 +1,111 @@
+from datetime import datetime
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel, Field
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+import bulk_ingest
+from models import Base, BatchTraceRelation, RawMaterialTraceRecord
+
+NOW = datetime(2025, 1, 1)
+
+
+class RelationIn(BaseModel):
+    relationid: str = Field(min_length=1, max_length=32)
+    productbatchno: str = "PB"
+    producttracecode: str = Field(min_length=1, max_length=36)
+    materialtracecode: str = "RAW"
+    equipmentid: str = "EQ"
+    processschemeid: str = "PS"
+    inspectionpersonid: str = "QC"
+    inspectiontime: Optional[datetime] = None
+    relationstage: str = "Processing"
+    relationstatus: str = "Valid"
+
+
+def row(relationid, product):
+    return {"relationid": relationid, "producttracecode": product}
+
+
+def ingest(db, rows, **kwargs):
+    kwargs.setdefault("unique_fields", ("relationid", "producttracecode"))
+    return bulk_ingest.ingest(db, BatchTraceRelation, RelationIn, rows, fill_now=("inspectiontime",), **kwargs)
+
+
+def stored(db):
+    return sorted(relationid for (relationid,) in db.query(BatchTraceRelation.relationid))
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def test_ndjson_skips_blank_lines_and_keeps_bad_lines_in_place():
+    rows = bulk_ingest.parse_ndjson_lines([b'{"a": 1}\n', b"\n", b"{not json\n", b'{"a": 2}'])
+    assert rows[0] == {"a": 1} and rows[2] == {"a": 2}
+    assert isinstance(rows[1], ValueError)
+
+
+def test_json_array_must_be_a_list():
+    assert bulk_ingest.parse_json_array(b"") == []
+    for body in (b"{}", b"[1,"):
+        with pytest.raises(bulk_ingest.BulkIngestError):
+            bulk_ingest.parse_json_array(body)
+
+
+def test_rejected_rows_are_reported_by_index(db):
+    ingest(db, [row("OLD", "P-OLD")])
+    rows = [row("R1", "P1"), ValueError("Invalid JSON"), row("R1", "P2"), row("R3", "P-OLD"), {"relationid": "R4"}]
+    report = ingest(db, rows, atomic=False)
+    assert [(e["index"], e["field"]) for e in report["errors"]] == [
+        (1, None), (2, "relationid"), (3, "producttracecode"), (4, "producttracecode"),
+    ]
+    assert (report["received"], report["inserted"], report["rejected"]) == (5, 1, 4)
+    assert stored(db) == ["OLD", "R1"]
+
+
+def test_atomic_writes_nothing_when_any_row_is_rejected(db):
+    report = ingest(db, [row("R1", "P1"), row("R2", "")])
+    assert (report["mode"], report["inserted"], report["rejected"]) == ("atomic", 0, 1)
+    assert stored(db) == []
+
+    report = ingest(db, [row("R1", "P1"), row("R2", "P2")], chunk_size=1)
+    assert (report["inserted"], report["errors"]) == (2, [])
+    assert stored(db) == ["R1", "R2"]
+
+
+def test_references_must_exist(db):
+    db.execute(insert(RawMaterialTraceRecord), [{
+        "traceid": "T1", "materialbatchno": "MB", "tracecode": "RAW", "supplierid": "SUP", "purchaseorderid": "PO",
+        "incominginspectionid": "II", "receivetime": NOW, "storagelocation": "WH", "remainingqty": 1,
+        "tracestatus": "In Stock",
+    }])
+    rows = [row("R1", "P1"), dict(row("R2", "P2"), materialtracecode="MISSING")]
+    report = ingest(db, rows, references={"materialtracecode": RawMaterialTraceRecord.tracecode}, atomic=False)
+    assert [(e["index"], e["detail"]) for e in report["errors"]] == [(1, "materialtracecode not found")]
+    assert stored(db) == ["R1"]
+
+
+def test_partial_insert_conflict_rejects_only_the_conflicting_row(db):
+    # Simulate a concurrent writer: the pre-check does not see P2, the insert does
+    ingest(db, [row("OTHER", "P2")])
+    report = ingest(db, [row("R1", "P1"), row("R2", "P2"), row("R3", "P3")], unique_fields=("relationid",), atomic=False)
+    assert (report["inserted"], report["rejected"]) == (2, 1)
+    [error] = report["errors"]
+    assert error["index"] == 1 and error["detail"].startswith("conflict during insert")
+    assert stored(db) == ["OTHER", "R1", "R3"]
+
+
+def test_atomic_insert_conflict_rolls_back_the_batch(db):
+    ingest(db, [row("OTHER", "P2")])
+    report = ingest(db, [row("R1", "P1"), row("R2", "P2")], unique_fields=("relationid",), chunk_size=1)
+    assert (report["inserted"], report["rejected"]) == (0, 2)
+    assert report["errors"][0]["index"] == -1
+    assert stored(db) == ["OTHER"]
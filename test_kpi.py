@@ -0,0 +1,116 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import archive
+import kpi
+from models import Base, KpiStock, KpiSupplierWarning, KpiWarning, QualityRiskWarning, RawMaterialTraceRecord
+
+OLD = datetime(2020, 1, 1)
+
+
+def material(tracecode, supplier, status="In Stock", qty=10, location="WH"):
+    return {
+        "traceid": tracecode, "materialbatchno": "MB", "tracecode": tracecode, "supplierid": supplier,
+        "purchaseorderid": "PO", "incominginspectionid": "II", "receivetime": OLD, "storagelocation": location,
+        "remainingqty": qty, "tracestatus": status,
+    }
+
+
+def warning(warningid, objectid, status="Pending Handling", level=3):
+    return {
+        "warningid": warningid, "warningobject": "Raw Material", "objectid": objectid, "risktype": "Dimension",
+        "risklevel": level, "triggercondition": "rule", "triggertime": OLD, "handlerid": "QC", "handlestatus": status,
+    }
+
+
+def totals(db):
+    return {
+        "stock": sorted((r.tracestatus, r.storagelocation, r.itemcount, float(r.remainingqty))
+                        for r in db.query(KpiStock) if r.itemcount),
+        "warnings": sorted((r.handlestatus, r.risklevel, r.risktype, r.warningcount)
+                           for r in db.query(KpiWarning) if r.warningcount),
+        "suppliers": sorted((r.supplierid, r.warningcount, r.openwarningcount)
+                            for r in db.query(KpiSupplierWarning) if r.warningcount),
+    }
+
+
+def add(db, materials=(), warnings=()):
+    if materials:
+        db.execute(insert(RawMaterialTraceRecord), list(materials))
+        kpi.add_materials(db, list(materials))
+    if warnings:
+        db.execute(insert(QualityRiskWarning), list(warnings))
+        kpi.add_warnings(db, list(warnings))
+    db.commit()
+
+
+@pytest.fixture
+def sessions():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    yield sessionmaker(engine)
+    engine.dispose()
+
+
+def assert_matches_rebuild(db):
+    incremental = totals(db)
+    kpi.rebuild(db)
+    assert totals(db) == incremental
+
+
+def test_inserts_and_removals_are_counted(sessions):
+    with sessions() as db:
+        add(db, [material("M1", "SUP-A"), material("M2", "SUP-A", qty=2.5), material("M3", "SUP-B", "Consumed", 0)])
+        add(db, warnings=[warning("W1", "M1"), warning("W2", "M3", "Closed")])
+        assert totals(db) == {
+            "stock": [("Consumed", "WH", 1, 0.0), ("In Stock", "WH", 2, 12.5)],
+            "warnings": [("Closed", 3, "Dimension", 1), ("Pending Handling", 3, "Dimension", 1)],
+            "suppliers": [("SUP-A", 1, 1), ("SUP-B", 1, 0)],
+        }
+        assert_matches_rebuild(db)
+
+        kpi.remove_warnings(db, [warning("W1", "M1")])
+        db.query(QualityRiskWarning).filter(QualityRiskWarning.warningid == "W1").delete()
+        kpi.remove_materials(db, [material("M2", "SUP-A", qty=2.5)])
+        db.query(RawMaterialTraceRecord).filter(RawMaterialTraceRecord.traceid == "M2").delete()
+        db.commit()
+        assert totals(db)["suppliers"] == [("SUP-B", 1, 0)]
+        assert_matches_rebuild(db)
+
+
+def test_warning_before_its_unit_is_counted_when_the_unit_arrives(sessions):
+    with sessions() as db:
+        add(db, warnings=[warning("W1", "LATE")])
+        assert totals(db)["suppliers"] == []
+        add(db, [material("LATE", "SUP-A")])
+        assert totals(db)["suppliers"] == [("SUP-A", 1, 1)]
+        assert_matches_rebuild(db)
+
+
+def test_stock_moves(sessions):
+    with sessions() as db:
+        add(db, [material("M1", "SUP-A")])
+        kpi.move_stock(db, "WH", "In Stock", 10, "In Use", 7.25)
+        db.commit()
+        assert totals(db)["stock"] == [("In Use", "WH", 1, 7.25)]
+
+
+def test_archive_leaves_totals_unchanged(sessions):
+    with sessions() as db:
+        add(db, [material("M1", "SUP-A", "Consumed", 0), material("M2", "SUP-A")])
+        add(db, warnings=[warning("W1", "M1", "Closed"), warning("W2", "M2")])
+        before = totals(db)
+
+    report = archive.archive(sessions, material_days=30, warning_days=30)
+    assert (report["raw_materials"]["archived"], report["warnings"]["archived"]) == (1, 1)
+    with sessions() as db:
+        assert totals(db) == before
+        assert_matches_rebuild(db)
+        # A warning raised later against the archived unit still counts toward its supplier
+        add(db, warnings=[warning("W3", "M1")])
+        assert totals(db)["suppliers"] == [("SUP-A", 3, 2)]
+        assert_matches_rebuild(db)
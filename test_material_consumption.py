@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+def pick(client, tracecode, quantity):
+    return client.post("/material-consumptions", json={"tracecode": tracecode, "quantity": quantity})
+
+
+def test_picks_move_the_unit_through_its_statuses(client, receive):
+    receive("CONS-1", 5)
+    assert pick(client, "CONS-1", 2).json()["tracestatus"] == "In Use"
+    last = pick(client, "CONS-1", 3).json()
+    assert (last["remainingqty"], last["tracestatus"]) == (0, "Consumed")
+
+    record = client.get("/raw-material-trace/CONS-1").json()
+    assert record["tracestatus"] == "Consumed"
+    assert [entry["quantity"] for entry in record["usedrecords"]] == [2, 3]
+
+
+def test_consumed_unit_and_overdraw_are_conflicts(client, receive):
+    receive("CONS-2", 1)
+    response = pick(client, "CONS-2", 1.5)
+    assert response.status_code == 409
+    assert response.json()["detail"].startswith("Insufficient remaining quantity")
+
+    assert pick(client, "CONS-2", 1).status_code == 201
+    response = pick(client, "CONS-2", 0.5)
+    assert (response.status_code, response.json()["detail"]) == (409, "Material is Consumed")
+    assert pick(client, "CONS-MISSING", 1).status_code == 404
+
+
+def test_concurrent_picks_never_overdraw(client, receive):
+    receive("CONS-3", 10)
+    with ThreadPoolExecutor(8) as pool:
+        statuses = list(pool.map(lambda _: pick(client, "CONS-3", 2).status_code, range(8)))
+    assert sorted(statuses) == [201] * 5 + [409] * 3
+
+    record = client.get("/raw-material-trace/CONS-3").json()
+    assert (record["remainingqty"], record["tracestatus"]) == (0, "Consumed")
+    assert len(record["usedrecords"]) == 5
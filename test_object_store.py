@@ -0,0 +1,98 @@
+import hashlib
+import os
+import time
+
+import pytest
+
+import attachments
+import main
+import manage
+import object_store
+from db_clients import get_object_store
+
+DATA = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Small chunks so ranges cross chunk boundaries
+    monkeypatch.setattr(object_store, "OBJECT_CHUNK_BYTES", 100)
+    return object_store.LocalObjectStore(str(tmp_path))
+
+
+def age(store, sha256, seconds):
+    past = time.time() - seconds
+    os.utime(store._path(sha256), (past, past))
+
+
+def test_same_content_is_stored_once(store):
+    first = store.put([DATA[:300], DATA[300:]])
+    assert first == (hashlib.sha256(DATA).hexdigest(), len(DATA), True)
+    assert store.put([DATA]).created is False
+    assert [sha256 for sha256, _ in store.list()] == [first.sha256]
+    assert store.size(first.sha256) == len(DATA) and store.size("0" * 64) is None
+
+
+def test_oversized_upload_leaves_nothing_behind(store):
+    with pytest.raises(object_store.ObjectTooLarge):
+        store.put([DATA, DATA], max_bytes=len(DATA))
+    assert list(store.list()) == []
+    assert os.listdir(store._tmp) == []
+
+
+def test_range_reads(store):
+    sha256 = store.put([DATA]).sha256
+    assert b"".join(store.read(sha256)) == DATA
+    assert b"".join(store.read(sha256, 95, 110)) == DATA[95:205]
+    assert b"".join(store.read(sha256, 1000)) == DATA[1000:]
+    assert b"".join(store.read(sha256, 1000, 100)) == DATA[1000:]
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None), ("bytes=0-9", (0, 9)), ("bytes=1000-", (1000, 1023)), ("bytes=-24", (1000, 1023)),
+    ("bytes=-5000", (0, 1023)), ("bytes=10-5000", (10, 1023)), ("bytes=9-0", None), ("bytes=0-1,4-5", None),
+    ("items=0-9", None), ("bytes=x-9", None),
+])
+def test_parse_range(header, expected):
+    assert attachments.parse_range(header, len(DATA)) == expected
+
+
+def test_unsatisfiable_ranges():
+    for header, size in (("bytes=1024-", 1024), ("bytes=-0", 1024), ("bytes=-5", 0)):
+        with pytest.raises(attachments.RangeNotSatisfiable):
+            attachments.parse_range(header, size)
+
+
+def test_gc_keeps_referenced_and_recent_objects(store):
+    referenced, recent, stale = (store.put([DATA + bytes([i])]).sha256 for i in range(3))
+    for sha256 in (referenced, stale):
+        age(store, sha256, 7200)
+    assert store.gc({referenced}, grace_seconds=3600) == {"kept": 2, "deleted": 1}
+    assert store.size(stale) is None
+
+    # Uploading the content again refreshes its age
+    age(store, recent, 7200)
+    store.put([DATA + bytes([1])])
+    assert store.gc(set(), grace_seconds=3600) == {"kept": 1, "deleted": 1}
+    assert [sha256 for sha256, _ in store.list()] == [recent]
+
+
+def test_download_ranges_and_collect_after_delete(client):
+    response = client.post("/attachments", params={"objecttype": "Supplier", "objectid": "SUP-OS"},
+                           files={"file": ("证书.pdf", DATA, "application/pdf")})
+    assert response.status_code == 201
+    attachment = response.json()
+    url = f"/attachments/{attachment['attachmentid']}/content"
+
+    response = client.get(url, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 100-199/{len(DATA)}"
+    assert response.content == DATA[100:200]
+    assert client.get(url, headers={"Range": f"bytes={len(DATA)}-"}).status_code == 416
+    # A stale If-Range gets the whole object
+    response = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+    assert (response.status_code, response.content) == (200, DATA)
+
+    assert client.delete(f"/attachments/{attachment['attachmentid']}").status_code == 204
+    manage.gc_objects(main.engine, get_object_store(), grace_seconds=0)
+    assert get_object_store().size(attachment["sha256"]) is None
@@ -0,0 +1,48 @@
+import main
+from response_cache import ResponseCache, etag_matches, make_etag
+
+
+def test_if_none_match_forms():
+    etag = make_etag(b"{}")
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+
+
+def test_load_started_before_an_invalidation_is_not_stored():
+    cache = ResponseCache()
+    generation = cache.generation
+    cache.invalidate("kind", "1")
+    cache.put("kind", "1", b"stale", generation)
+    assert cache.get("kind", "1") is None
+    cache.put("kind", "1", b"fresh", cache.generation)
+    assert cache.get("kind", "1").body == b"fresh"
+
+
+def test_matching_etag_gets_304(client, receive):
+    receive("RC-1")
+    response = client.get("/raw-material-trace/RC-1")
+    etag = response.headers["ETag"]
+    assert etag == make_etag(response.content)
+
+    response = client.get("/raw-material-trace/RC-1", headers={"If-None-Match": etag})
+    assert (response.status_code, response.content) == (304, b"")
+    assert client.get("/raw-material-trace/RC-1", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_writes_invalidate_the_cached_record(client, receive):
+    receive("RC-2")
+    etag = client.get("/raw-material-trace/RC-2").headers["ETag"]
+    hits = main.response_cache.hits
+    assert client.get("/raw-material-trace/RC-2").headers["ETag"] == etag
+    assert main.response_cache.hits == hits + 1
+
+    assert client.post("/material-consumptions", json={"tracecode": "RC-2", "quantity": 1}).status_code == 201
+    response = client.get("/raw-material-trace/RC-2", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["remainingqty"] == 4
+
+    assert client.delete("/raw-material-trace/RC-2").status_code == 204
+    assert client.get("/raw-material-trace/RC-2").status_code == 404
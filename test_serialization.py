@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine, insert, select
+
+import serialization
+from main import RawMaterialTraceRead, TraceResult
+from models import Base, RawMaterialTraceRecord
+
+RECORDS = [
+    {
+        "traceid": "T1", "materialbatchno": "MB", "tracecode": "RAW-1", "supplierid": "供应商-A",
+        "purchaseorderid": "PO", "incominginspectionid": "II", "receivetime": datetime(2025, 1, 1, 8, 0, 0, 123456),
+        "storagelocation": "WH \"east\"", "usedrecords": [{"quantity": 1.5, "note": "首件"}],
+        "remainingqty": Decimal("8.50"), "tracestatus": "In Use",
+    },
+    {
+        "traceid": "T2", "materialbatchno": "MB", "tracecode": "RAW-2", "supplierid": "SUP",
+        "purchaseorderid": "PO", "incominginspectionid": "II", "receivetime": datetime(2025, 1, 1, tzinfo=timezone.utc),
+        "storagelocation": "WH", "usedrecords": [], "remainingqty": 3, "tracestatus": "In Stock",
+    },
+    {
+        "traceid": "T3", "materialbatchno": "MB", "tracecode": "RAW-3", "supplierid": "SUP",
+        "purchaseorderid": "PO", "incominginspectionid": "II",
+        "receivetime": datetime(2025, 1, 1, 8, tzinfo=timezone(timedelta(hours=8))),
+        "storagelocation": "WH", "usedrecords": [], "remainingqty": 0.1, "tracestatus": "Consumed",
+    },
+]
+
+
+@pytest.fixture(params=["orjson", "json"])
+def json_library(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+        monkeypatch.setattr(serialization, "_orjson", None)
+    else:
+        monkeypatch.setattr(serialization, "_orjson", False)
+    return request.param
+
+
+def pydantic_list(schema, values):
+    return b"[" + b",".join(schema.model_validate(v).model_dump_json().encode() for v in values) + b"]"
+
+
+def test_records_match_pydantic(json_library):
+    for record in RECORDS:
+        assert serialization.encode(RawMaterialTraceRead, record) == RawMaterialTraceRead(**record).model_dump_json().encode()
+    assert serialization.encode_list(RawMaterialTraceRead, RECORDS) == pydantic_list(RawMaterialTraceRead, RECORDS)
+
+
+def test_row_tuples_match_pydantic(json_library):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(RawMaterialTraceRecord), RECORDS[:2])
+        rows = conn.execute(select(*serialization.columns(RawMaterialTraceRecord, RawMaterialTraceRead))).all()
+    engine.dispose()
+    expected = pydantic_list(RawMaterialTraceRead, [row._mapping for row in rows])
+    assert serialization.encode_list(RawMaterialTraceRead, rows) == expected
+
+
+def test_nested_models_match_pydantic(json_library):
+    result = {
+        "tracecode": "PRODUCT", "direction": "backward", "depth": 1, "truncated": False, "tracecodes": ["RAW-1"],
+        "relations": [{
+            "relationid": "R1", "productbatchno": "PB", "producttracecode": "PRODUCT", "materialtracecode": "RAW-1",
+            "equipmentid": "EQ", "processschemeid": "PS", "inspectionpersonid": "QC",
+            "inspectiontime": datetime(2025, 1, 2, 9, 30), "relationstage": "Processing", "relationstatus": "Valid",
+            "depth": 1,
+        }],
+        "materials": RECORDS, "suppliers": ["SUP"],
+    }
+    assert serialization.encode(TraceResult, result) == TraceResult.model_validate(result).model_dump_json().encode()
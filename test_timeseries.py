@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import timeseries
+
+T0 = datetime(2025, 1, 1, 23, 59, 30, tzinfo=timezone.utc)
+
+
+def point(seconds, value, equipmentid="EQ-1", field="temperature"):
+    return {"measurement": "process", "field": field, "value": value, "equipmentid": equipmentid,
+            "time": T0 + timedelta(seconds=seconds)}
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = timeseries.SQLiteTimeSeriesBackend(str(tmp_path / "ts.db"))
+    yield backend
+    backend.close()
+
+
+def test_naive_times_are_utc_and_the_default_window_is_a_day():
+    assert timeseries.to_epoch_ms(datetime(2025, 1, 1)) == timeseries.to_epoch_ms(datetime(2025, 1, 1, tzinfo=timezone.utc))
+    start_ms, end_ms = timeseries.resolve_range(None, T0)
+    assert end_ms - start_ms == 24 * 3600 * 1000
+
+
+def test_points_across_midnight_are_read_in_order(backend):
+    backend.write_points([point(45, 3.0), point(0, 1.0), point(20, 2.0), point(0, 9.0, equipmentid="EQ-2")])
+    conn = backend._conn()
+    assert backend._partitions(conn) == ["points_20250101", "points_20250102"]
+
+    rows = backend.query_points(equipmentid="EQ-1", start=T0, end=T0 + timedelta(minutes=1))
+    assert [r["value"] for r in rows] == [1.0, 2.0, 3.0]
+    # end is exclusive
+    rows = backend.query_points(equipmentid="EQ-1", start=T0, end=T0 + timedelta(seconds=20))
+    assert [r["value"] for r in rows] == [1.0]
+
+
+def test_rollups_merge_batches_and_are_stamped_with_the_bucket_start(backend):
+    backend.write_points([point(0, 1.0), point(20, 5.0)])
+    backend.write_points([point(25, 3.0), point(40, 7.0)])
+    rows = backend.query_rollups("1m", equipmentid="EQ-1", start=T0 - timedelta(hours=1), end=T0 + timedelta(hours=1))
+    assert [(r["time"], r["count"], r["min"], r["max"], r["mean"]) for r in rows] == [
+        (datetime(2025, 1, 1, 23, 59, tzinfo=timezone.utc), 3, 1.0, 5.0, 3.0),
+        (datetime(2025, 1, 2, 0, 0, tzinfo=timezone.utc), 1, 7.0, 7.0, 7.0),
+    ]
+    [hour] = backend.query_rollups("1h", equipmentid="EQ-1", start=T0 - timedelta(hours=1), end=T0)
+    assert (hour["time"], hour["count"]) == (datetime(2025, 1, 1, 23, tzinfo=timezone.utc), 3)
+    with pytest.raises(ValueError):
+        backend.query_rollups("1d", equipmentid="EQ-1")
+
+
+def test_retention_drops_raw_points_and_keeps_rollups(backend):
+    backend.write_points([point(0, 1.0), point(45, 2.0)])
+    assert backend.drop_partitions_before(datetime(2025, 1, 2)) == ["points_20250101"]
+    window = {"equipmentid": "EQ-1", "start": T0 - timedelta(hours=1), "end": T0 + timedelta(hours=1)}
+    assert [r["value"] for r in backend.query_points(**window)] == [2.0]
+    assert sum(r["count"] for r in backend.query_rollups("1h", **window)) == 2
+
+
+def test_api_range_parsing(client):
+    points = [{"measurement": "process", "field": "temperature", "value": v, "equipmentid": "EQ-API",
+               "time": "2025-01-02T08:00:00+08:00"} for v in (1, 3)]
+    assert client.post("/timeseries/points", json=points).json() == {"written": 2}
+
+    query = {"equipmentid": "EQ-API", "start": "2025-01-02T00:00:00Z", "end": "2025-01-02T01:00:00Z"}
+    [rollup] = client.get("/timeseries/rollups", params=query).json()
+    assert (rollup["time"], rollup["count"], rollup["mean"]) == ("2025-01-02T00:00:00Z", 2, 2.0)
+    assert len(client.get("/timeseries/points", params=query).json()) == 2
+
+    assert client.get("/timeseries/points", params={"start": query["start"]}).status_code == 400
+    reversed_range = {"equipmentid": "EQ-API", "start": query["end"], "end": query["start"]}
+    assert client.get("/timeseries/rollups", params=reversed_range).status_code == 400
@@ -0,0 +1,94 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+import traceability
+from models import Base, BatchTraceRelation, MaterialConsumptionRecord, RawMaterialTraceRecord
+
+NOW = datetime(2025, 1, 1)
+
+
+def relation(relationid, material, product, status="Valid"):
+    return {
+        "relationid": relationid, "productbatchno": "PB", "producttracecode": product, "materialtracecode": material,
+        "equipmentid": "EQ", "processschemeid": "PS", "inspectionpersonid": "QC", "inspectiontime": NOW,
+        "relationstage": "Processing", "relationstatus": status,
+    }
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+@pytest.fixture
+def chain(db):
+    # RAW -> SEMI -> PRODUCT
+    db.execute(insert(BatchTraceRelation), [relation("R1", "RAW", "SEMI"), relation("R2", "SEMI", "PRODUCT")])
+    db.commit()
+    return db
+
+
+def test_single_edge_is_depth_one(db):
+    db.execute(insert(BatchTraceRelation), [relation("R1", "A", "B")])
+    result = traceability.trace(db, "B", "backward")
+    assert result["depth"] == 1
+    assert result["truncated"] is False
+    assert result["tracecodes"] == ["A"]
+
+
+def test_depth_counts_levels_with_relations(chain):
+    for code, direction in (("PRODUCT", "backward"), ("RAW", "forward")):
+        result = traceability.trace(chain, code, direction)
+        assert result["depth"] == 2
+        assert result["truncated"] is False
+        assert [depth for depth, _ in result["relations"]] == [1, 2]
+
+
+def test_max_depth_truncates_only_when_relations_remain(chain):
+    result = traceability.trace(chain, "PRODUCT", "backward", max_depth=1)
+    assert result["depth"] == 1
+    assert result["truncated"] is True
+    assert result["tracecodes"] == ["SEMI"]
+
+    result = traceability.trace(chain, "PRODUCT", "backward", max_depth=2)
+    assert result["depth"] == 2
+    assert result["truncated"] is False
+
+
+def test_max_nodes_stops_within_a_level(db):
+    db.execute(insert(BatchTraceRelation), [relation(f"R{i}", "RAW", f"P{i}") for i in range(10)])
+    result = traceability.trace(db, "RAW", "forward", max_nodes=5)
+    assert result["truncated"] is True
+    assert len(result["tracecodes"]) == 5
+
+    result = traceability.trace(db, "RAW", "forward", max_nodes=11)
+    assert result["truncated"] is False
+    assert len(result["tracecodes"]) == 10
+
+
+def test_invalid_relations_are_skipped_unless_asked(db):
+    db.execute(insert(BatchTraceRelation), [relation("R1", "A", "B", status="Invalid")])
+    result = traceability.trace(db, "B", "backward")
+    assert (result["depth"], result["relations"]) == (0, [])
+    assert traceability.trace(db, "B", "backward", include_invalid=True)["depth"] == 1
+
+
+def test_materials_include_the_consumption_ledger(chain):
+    chain.execute(insert(RawMaterialTraceRecord), [{
+        "traceid": "T1", "materialbatchno": "MB", "tracecode": "RAW", "supplierid": "SUP", "purchaseorderid": "PO",
+        "incominginspectionid": "II", "receivetime": NOW, "storagelocation": "WH", "usedrecords": [{"note": "stored"}],
+        "remainingqty": 8, "tracestatus": "In Use",
+    }])
+    chain.execute(insert(MaterialConsumptionRecord), [{"tracecode": "RAW", "quantity": 2, "consumedtime": NOW}])
+    result = traceability.trace(chain, "PRODUCT", "backward")
+    assert result["suppliers"] == ["SUP"]
+    [material] = result["materials"]
+    assert material["usedrecords"][0] == {"note": "stored"}
+    assert material["usedrecords"][1]["quantity"] == 2.0
@@ -0,0 +1,292 @@
+"""
+Time-series storage for per-equipment process and inspection measurements.
+
+TimeSeriesBackend is the interface used by the API. Two implementations:
+
+- SQLiteTimeSeriesBackend: embedded store for offline/line-side use. Raw
+  points go to one table per UTC day (points_YYYYMMDD), so range scans only
+  touch the days they cover and retention is a DROP TABLE. Every write batch
+  is pre-aggregated in memory and upserted into 1m and 1h rollup tables
+  (count/sum/min/max), so dashboards over months read rollups, not raw points.
+- InfluxTimeSeriesBackend: wraps the InfluxDB client from db_clients; rollups
+  are computed server-side with aggregateWindow, stamped with the window
+  start like the SQLite buckets.
+"""
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+ROLLUP_RESOLUTIONS = {"1m": 60, "1h": 3600}
+DEFAULT_QUERY_WINDOW = timedelta(hours=24)
+MAX_POINTS_PER_QUERY = 100000
+
+
+def to_epoch_ms(value: Optional[datetime]) -> int:
+    if value is None:
+        value = datetime.now(timezone.utc)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def from_epoch_ms(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+
+
+def resolve_range(start: Optional[datetime], end: Optional[datetime]) -> Tuple[int, int]:
+    end_ms = to_epoch_ms(end)
+    start_ms = to_epoch_ms(start) if start else end_ms - int(DEFAULT_QUERY_WINDOW.total_seconds() * 1000)
+    return start_ms, end_ms
+
+
+class TimeSeriesBackend(ABC):
+    """Points are dicts with measurement, field, value, time and optional equipmentid/tracecode."""
+
+    @abstractmethod
+    def write_points(self, points: Sequence[dict]) -> int:
+        ...
+
+    @abstractmethod
+    def query_points(self, equipmentid: Optional[str] = None, tracecode: Optional[str] = None,
+                     measurement: Optional[str] = None, field: Optional[str] = None,
+                     start: Optional[datetime] = None, end: Optional[datetime] = None,
+                     limit: int = MAX_POINTS_PER_QUERY) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def query_rollups(self, resolution: str, equipmentid: Optional[str] = None, tracecode: Optional[str] = None,
+                      measurement: Optional[str] = None, field: Optional[str] = None,
+                      start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteTimeSeriesBackend(TimeSeriesBackend):
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self._write_lock:
+            conn = self._conn()
+            for name in ROLLUP_RESOLUTIONS:
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS rollup_{name} ("
+                    "equipmentid TEXT NOT NULL, tracecode TEXT NOT NULL, measurement TEXT NOT NULL, field TEXT NOT NULL, "
+                    "bucket INTEGER NOT NULL, count INTEGER NOT NULL, sum REAL NOT NULL, min REAL NOT NULL, max REAL NOT NULL, "
+                    "PRIMARY KEY (equipmentid, tracecode, measurement, field, bucket)) WITHOUT ROWID"
+                )
+                # The primary key leads with equipmentid but then tracecode: filtering by equipment and
+                # time alone needs its own index to range-scan on bucket
+                conn.execute(f"CREATE INDEX IF NOT EXISTS ix_rollup_{name}_equipment ON rollup_{name} (equipmentid, bucket)")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS ix_rollup_{name}_tracecode ON rollup_{name} (tracecode, bucket)")
+            conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _partitions(conn: sqlite3.Connection, first: str = "points_", last: str = "points_~") -> List[str]:
+        """Partitions in [first, last], read from the schema: other processes create and drop them."""
+        rows = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'points_%' AND name BETWEEN ? AND ?",
+            (first, last),
+        )
+        return sorted(name for (name,) in rows)
+
+    @staticmethod
+    def _partition_for(ts_ms: int) -> str:
+        return "points_" + from_epoch_ms(ts_ms).strftime("%Y%m%d")
+
+    @staticmethod
+    def _ensure_partition(conn: sqlite3.Connection, table: str) -> None:
+        # Not cached per process: the partition may have been dropped by another process's retention run
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (ts INTEGER NOT NULL, equipmentid TEXT NOT NULL, tracecode TEXT NOT NULL, "
+            "measurement TEXT NOT NULL, field TEXT NOT NULL, value REAL NOT NULL)"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_equipment ON {table} (equipmentid, ts)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_tracecode ON {table} (tracecode, ts)")
+
+    def write_points(self, points: Sequence[dict]) -> int:
+        by_partition: Dict[str, list] = {}
+        rollups: Dict[str, Dict[tuple, list]] = {name: {} for name in ROLLUP_RESOLUTIONS}
+        for p in points:
+            ts = to_epoch_ms(p.get("time"))
+            row = (ts, p.get("equipmentid") or "", p.get("tracecode") or "", p["measurement"], p["field"], float(p["value"]))
+            by_partition.setdefault(self._partition_for(ts), []).append(row)
+            for name, seconds in ROLLUP_RESOLUTIONS.items():
+                bucket = ts // 1000 // seconds * seconds
+                key = (row[1], row[2], row[3], row[4], bucket)
+                agg = rollups[name].get(key)
+                value = row[5]
+                if agg is None:
+                    rollups[name][key] = [1, value, value, value]
+                else:
+                    agg[0] += 1
+                    agg[1] += value
+                    agg[2] = min(agg[2], value)
+                    agg[3] = max(agg[3], value)
+
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                for table, rows in by_partition.items():
+                    self._ensure_partition(conn, table)
+                    conn.executemany(f"INSERT INTO {table} VALUES (?,?,?,?,?,?)", rows)
+                for name, groups in rollups.items():
+                    conn.executemany(
+                        f"INSERT INTO rollup_{name} VALUES (?,?,?,?,?,?,?,?,?) "
+                        "ON CONFLICT (equipmentid, tracecode, measurement, field, bucket) DO UPDATE SET "
+                        "count = count + excluded.count, sum = sum + excluded.sum, "
+                        "min = MIN(min, excluded.min), max = MAX(max, excluded.max)",
+                        [key + tuple(agg) for key, agg in groups.items()],
+                    )
+        return len(points)
+
+    @staticmethod
+    def _filters(equipmentid, tracecode, measurement, field) -> Tuple[List[str], list]:
+        clauses, params = [], []
+        for column, value in (("equipmentid", equipmentid), ("tracecode", tracecode),
+                              ("measurement", measurement), ("field", field)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        return clauses, params
+
+    def query_points(self, equipmentid=None, tracecode=None, measurement=None, field=None,
+                     start=None, end=None, limit=MAX_POINTS_PER_QUERY) -> List[dict]:
+        start_ms, end_ms = resolve_range(start, end)
+        first, last = self._partition_for(start_ms), self._partition_for(end_ms)
+        clauses, params = self._filters(equipmentid, tracecode, measurement, field)
+        where = " AND ".join(["ts >= ?", "ts < ?"] + clauses)
+        conn = self._conn()
+        for attempt in range(2):
+            tables = self._partitions(conn, first, last)
+            if not tables:
+                return []
+            sql = " UNION ALL ".join(
+                f"SELECT ts, equipmentid, tracecode, measurement, field, value FROM {t} WHERE {where}" for t in tables
+            ) + " ORDER BY ts LIMIT ?"
+            try:
+                rows = conn.execute(sql, [start_ms, end_ms, *params] * len(tables) + [limit]).fetchall()
+                break
+            except sqlite3.OperationalError as exc:
+                # A retention run dropped a partition between listing and reading: list again
+                if attempt or "no such table" not in str(exc):
+                    raise
+        return [
+            {"time": from_epoch_ms(ts), "equipmentid": e or None, "tracecode": t or None,
+             "measurement": m, "field": f, "value": v}
+            for ts, e, t, m, f, v in rows
+        ]
+
+    def query_rollups(self, resolution, equipmentid=None, tracecode=None, measurement=None, field=None,
+                      start=None, end=None) -> List[dict]:
+        if resolution not in ROLLUP_RESOLUTIONS:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        start_ms, end_ms = resolve_range(start, end)
+        clauses, params = self._filters(equipmentid, tracecode, measurement, field)
+        where = " AND ".join(["bucket >= ?", "bucket < ?"] + clauses)
+        rows = self._conn().execute(
+            f"SELECT bucket, measurement, field, SUM(count), SUM(sum), MIN(min), MAX(max) FROM rollup_{resolution} "
+            f"WHERE {where} GROUP BY bucket, measurement, field ORDER BY bucket",
+            [start_ms // 1000, end_ms // 1000, *params],
+        )
+        return [
+            {"time": from_epoch_ms(bucket * 1000), "measurement": m, "field": f,
+             "count": n, "min": lo, "max": hi, "mean": total / n}
+            for bucket, m, f, n, total, lo, hi in rows
+        ]
+
+    def drop_partitions_before(self, day: datetime) -> List[str]:
+        """Retention: drop raw-point partitions older than `day`; rollups are kept."""
+        cutoff = "points_" + day.strftime("%Y%m%d")
+        with self._write_lock:
+            conn = self._conn()
+            dropped = [t for t in self._partitions(conn) if t < cutoff]
+            for table in dropped:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.commit()
+        return dropped
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class InfluxTimeSeriesBackend(TimeSeriesBackend):
+    def __init__(self, client, bucket: str, org: str):
+        from influxdb_client.client.write_api import SYNCHRONOUS
+
+        self.client = client
+        self.bucket = bucket
+        self.org = org
+        self._write_api = client.write_api(write_options=SYNCHRONOUS)
+        self._query_api = client.query_api()
+
+    def write_points(self, points: Sequence[dict]) -> int:
+        from influxdb_client import Point
+
+        records = []
+        for p in points:
+            point = Point(p["measurement"]).field(p["field"], float(p["value"])).time(p.get("time") or datetime.now(timezone.utc))
+            if p.get("equipmentid"):
+                point = point.tag("equipmentid", p["equipmentid"])
+            if p.get("tracecode"):
+                point = point.tag("tracecode", p["tracecode"])
+            records.append(point)
+        self._write_api.write(bucket=self.bucket, org=self.org, record=records)
+        return len(records)
+
+    def _flux(self, start, end, equipmentid, tracecode, measurement, field) -> Tuple[str, dict]:
+        start_ms, end_ms = resolve_range(start, end)
+        params = {"start": from_epoch_ms(start_ms), "stop": from_epoch_ms(end_ms)}
+        query = f'from(bucket: "{self.bucket}") |> range(start: params.start, stop: params.stop)'
+        for name, value in (("equipmentid", equipmentid), ("tracecode", tracecode),
+                            ("_measurement", measurement), ("_field", field)):
+            if value:
+                params[name.lstrip("_")] = value
+                query += f' |> filter(fn: (r) => r.{name} == params.{name.lstrip("_")})'
+        return query, params
+
+    def query_points(self, equipmentid=None, tracecode=None, measurement=None, field=None,
+                     start=None, end=None, limit=MAX_POINTS_PER_QUERY) -> List[dict]:
+        query, params = self._flux(start, end, equipmentid, tracecode, measurement, field)
+        query += f" |> sort(columns: [\"_time\"]) |> limit(n: {int(limit)})"
+        points = []
+        for table in self._query_api.query(query, org=self.org, params=params):
+            for r in table.records:
+                points.append({
+                    "time": r.get_time(), "equipmentid": r.values.get("equipmentid"), "tracecode": r.values.get("tracecode"),
+                    "measurement": r.get_measurement(), "field": r.get_field(), "value": r.get_value(),
+                })
+        return points
+
+    def query_rollups(self, resolution, equipmentid=None, tracecode=None, measurement=None, field=None,
+                      start=None, end=None) -> List[dict]:
+        if resolution not in ROLLUP_RESOLUTIONS:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        base, params = self._flux(start, end, equipmentid, tracecode, measurement, field)
+        grouped = {}
+        for fn in ("count", "min", "max", "mean"):
+            query = base + f' |> group(columns: ["_measurement", "_field"]) |> aggregateWindow(every: {resolution}, fn: {fn}, createEmpty: false, timeSrc: "_start")'
+            for table in self._query_api.query(query, org=self.org, params=params):
+                for r in table.records:
+                    key = (r.get_time(), r.get_measurement(), r.get_field())
+                    grouped.setdefault(key, {"time": key[0], "measurement": key[1], "field": key[2]})[fn] = r.get_value()
+        return [grouped[k] for k in sorted(grouped, key=lambda k: k[0])]
+
+    def close(self) -> None:
+        self._write_api.close()
@@ -0,0 +1,145 @@
+"""
+Full-chain traceability over BatchTraceRelation (Section 5.3).
+
+Backward trace follows product -> material edges to return the upstream
+genealogy ("FinishedProduct -> SemiProduct -> RawMaterial -> Supplier").
+Forward trace follows material -> product edges to return the downstream
+recall set. Each level is expanded with one batched IN query per chunk of
+frontier codes over the indexed producttracecode/materialtracecode columns,
+so a trace costs O(depth) round trips instead of one query per node.
+Relations and units are read as plain result rows (attribute access like ORM
+objects, without the identity map and per-object state).
+"""
+from typing import Dict, Iterable, Iterator, List, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import BatchTraceRelation, MaterialConsumptionRecord, RawMaterialTraceArchive, RawMaterialTraceRecord
+
+TRACE_MAX_DEPTH = 32
+TRACE_MAX_NODES = 100000
+# Stay well below SQLite's bound-parameter limit
+IN_CHUNK_SIZE = 500
+
+
+def chunked(items: Sequence, size: int = IN_CHUNK_SIZE) -> Iterator[Sequence]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def consumption_entry(row) -> dict:
+    """A consumption ledger row as it appears in a unit's usedrecords."""
+    return {
+        "consumptionid": row.consumptionid,
+        "quantity": float(row.quantity),
+        "consumedtime": row.consumedtime.isoformat(),
+        "workorderid": row.workorderid,
+        "semiproducttracecode": row.semiproducttracecode,
+        "operatorid": row.operatorid,
+    }
+
+
+def ledger_entries(db, tracecodes: Iterable[str]) -> Dict[str, List[dict]]:
+    """Consumption ledger entries per unit in consumption order, one query per IN chunk.
+
+    `db` is a Session or a Connection.
+    """
+    table = MaterialConsumptionRecord.__table__
+    ledger: Dict[str, List[dict]] = {}
+    for chunk in chunked(list(tracecodes)):
+        rows = db.execute(
+            select(table).where(table.c.tracecode.in_(chunk)).order_by(table.c.tracecode, table.c.consumptionid)
+        )
+        for row in rows:
+            ledger.setdefault(row.tracecode, []).append(consumption_entry(row))
+    return ledger
+
+
+def with_usedrecords(db, rows: Sequence) -> List[dict]:
+    """Unit result rows as dicts whose usedrecords are the stored entries followed by the ledger's.
+
+    Every read of a unit (get, list, search, export, trace) goes through this.
+    Archived units already carry their ledger folded in and have no ledger
+    rows left, so they pass through unchanged.
+    """
+    ledger = ledger_entries(db, [r.tracecode for r in rows])
+    return [{**r._mapping, "usedrecords": list(r.usedrecords or []) + ledger.get(r.tracecode, [])} for r in rows]
+
+
+def trace(db: Session, tracecode: str, direction: str = "backward", max_depth: int = TRACE_MAX_DEPTH,
+          max_nodes: int = TRACE_MAX_NODES, include_invalid: bool = False) -> dict:
+    """Expand the genealogy of `tracecode` level by level.
+
+    Codes already visited are never expanded again, which protects against
+    cycles in bad data. `depth` counts the levels that had relations (A -> B
+    is depth 1). The walk stops after `max_depth` levels or as soon as more
+    than `max_nodes` codes have been reached; `truncated` is set only when
+    relations were left out that way.
+    """
+    if direction == "backward":
+        from_col, to_attr = BatchTraceRelation.producttracecode, "materialtracecode"
+    elif direction == "forward":
+        from_col, to_attr = BatchTraceRelation.materialtracecode, "producttracecode"
+    else:
+        raise ValueError(f"Unknown trace direction: {direction}")
+    conditions = [] if include_invalid else [BatchTraceRelation.relationstatus != "Invalid"]
+
+    visited = {tracecode}
+    frontier: List[str] = [tracecode]
+    relations = []
+    depth = 0
+    truncated = False
+    while frontier:
+        if depth >= max_depth:
+            # Out of levels: truncated only if the next level would have had relations
+            truncated = any(
+                db.execute(select(from_col).where(from_col.in_(chunk), *conditions).limit(1)).first()
+                for chunk in chunked(frontier)
+            )
+            break
+        level = []
+        next_frontier: List[str] = []
+        for chunk in chunked(frontier):
+            for rel in db.execute(select(BatchTraceRelation.__table__).where(from_col.in_(chunk), *conditions)):
+                level.append(rel)
+                code = getattr(rel, to_attr)
+                if code not in visited:
+                    visited.add(code)
+                    next_frontier.append(code)
+                    if len(visited) > max_nodes:
+                        truncated = True
+                        break
+            if truncated:
+                break
+        if not level:
+            break
+        depth += 1
+        relations.extend((depth, rel) for rel in level)
+        if truncated:
+            break
+        frontier = next_frontier
+
+    codes = list(visited)
+    hot = RawMaterialTraceRecord.__table__
+    materials = []
+    for chunk in chunked(codes):
+        materials.extend(db.execute(select(hot).where(hot.c.tracecode.in_(chunk))))
+    # Units not in the hot table may have been archived (archive.py); codes some relation
+    # produced are semi-finished or finished products, never raw material units
+    produced = {rel.producttracecode for _, rel in relations}
+    missing = list(visited - produced - {m.tracecode for m in materials})
+    archived = RawMaterialTraceArchive.__table__
+    for chunk in chunked(missing):
+        materials.extend(db.execute(select(*(archived.c[c.name] for c in hot.c)).where(archived.c.tracecode.in_(chunk))))
+    materials = with_usedrecords(db, materials)
+    return {
+        "tracecode": tracecode,
+        "direction": direction,
+        "depth": depth,
+        "truncated": truncated,
+        "tracecodes": sorted(visited - {tracecode}),
+        "relations": relations,
+        "materials": materials,
+        "suppliers": sorted({m["supplierid"] for m in materials}),
+    }